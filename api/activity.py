@@ -0,0 +1,54 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import User
+
+
+# ============================================
+# ПОСЛЕДНИЙ ВХОД
+# ============================================
+
+class LastLoginTracker:
+    """
+    Отмечает активность пользователей без записи на каждый запрос: один
+    пользователь попадает в очередь не чаще раза в LAST_LOGIN_INTERVAL
+    вместе со временем своего запроса, а очередь пишется одним UPDATE раз
+    в LAST_LOGIN_FLUSH_SECONDS или при наборе LAST_LOGIN_BATCH_SIZE
+    пользователей. Срок проверяется на каждом запросе, а не только при
+    новом пользователе в очереди. UPDATE не вызывает сигналов, поэтому
+    отметка не сбрасывает кэш авторизации.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+
+    def touch(self, user):
+        queued = cache.add('last-login:%s' % user.pk, True, settings.LAST_LOGIN_INTERVAL)
+        with self.lock:
+            if queued:
+                self.pending[user.pk] = timezone.now()
+            due = bool(self.pending) and (
+                len(self.pending) >= settings.LAST_LOGIN_BATCH_SIZE or
+                time.monotonic() - self.flushed_at >= settings.LAST_LOGIN_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            touched, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+        if touched:
+            User.objects.filter(pk__in=touched).update(last_login=Case(
+                *[When(pk=pk, then=Value(value)) for pk, value in touched.items()],
+                output_field=DateTimeField()))
+        return len(touched)
+
+
+tracker = LastLoginTracker()
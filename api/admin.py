@@ -1,10 +1,25 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, Employee, Client, Appointment, Purchase
+from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, Employee, Client, Appointment, Purchase, PurchaseProduct, RevenueRollup
 import datetime
-from django.urls import reverse
+from django.urls import reverse, path
 from django.utils.html import escape, mark_safe
 from django_reverse_admin import ReverseModelAdmin
+from .booking import booking_transaction, get_duration, is_employee_busy, BUSY_MESSAGE
+from . import pricing
+from .pricing import recalculate_appointments, recalculate_purchases
+from .stock import complete_purchases
+from .catalog import bump_version, bump_version_on_commit
+from . import reports, search
+from .search import FullTextSearchAdminMixin
+from .serializers import RevenueReportQuerySerializer
+from django.db.models import Sum
+from django.template.response import TemplateResponse
+from .export import StreamingExportMixin
+from .imports import BulkImportAdminMixin, BulkModelResource, CachedForeignKeyWidget
+from django import forms
+from django.contrib import messages
+from rest_framework import serializers
 
 from import_export.admin import ImportExportActionModelAdmin
 from import_export import resources
@@ -16,9 +31,10 @@ class NewsResource(resources.ModelResource):
 
     class Meta:
         model = News
+        exclude = ('imageThumbnails',)
 
 
-class NewsAdmin(ImportExportActionModelAdmin):
+class NewsAdmin(FullTextSearchAdminMixin, StreamingExportMixin, ImportExportActionModelAdmin):
     resource_class = NewsResource
     list_filter = ('status',)
     list_display = ('title', 'description', 'status',
@@ -37,6 +53,8 @@ class NewsAdmin(ImportExportActionModelAdmin):
     def make_news_published(self, request, queryset):
         rows_updated = queryset.update(
             status='published', published_at=datetime.datetime.now())
+        bump_version_on_commit(News)
+        search.index_queryset(queryset)
         message_bit = ""
         if rows_updated == 1:
             message_bit = "1 новости"
@@ -52,9 +70,10 @@ class ProductTypeResource(resources.ModelResource):
 
     class Meta:
         model = ProductType
+        exclude = ('imageThumbnails',)
 
 
-class ProductTypeAdmin(ImportExportActionModelAdmin):
+class ProductTypeAdmin(StreamingExportMixin, ImportExportActionModelAdmin):
     resource_class = ProductTypeResource
     list_display = ('title', 'description')
     search_fields = ('title', 'description')
@@ -68,29 +87,40 @@ class ProductTypeAdmin(ImportExportActionModelAdmin):
     filter_horizontal = ()
 
 
-class ProductResource(resources.ModelResource):
+class ProductResource(BulkModelResource):
     productType = fields.Field(column_name="productType", attribute="productType",
-                               widget=ForeignKeyWidget(ProductType, 'productType'))
+                               widget=CachedForeignKeyWidget(ProductType, 'title'))
 
     class Meta:
         model = Product
+        exclude = ('photoThumbnails',)
 
+    def after_bulk_import(self, updated_ids):
+        pricing.recalculate_open_orders_for_products(updated_ids)
 
-class ProductAdmin(ImportExportActionModelAdmin):
+    def after_bulk_commit(self, updated_ids):
+        pricing.invalidate_prices(Product, updated_ids)
+        bump_version(Product)
+        search.rebuild([Product])
+
+
+class ProductAdmin(FullTextSearchAdminMixin, StreamingExportMixin, BulkImportAdminMixin,
+                    ImportExportActionModelAdmin):
     resource_class = ProductResource
 
     def productType_link(self, obj: Product):
         if obj.productType == None:
             return 'Нет типа'
         link = reverse("admin:api_producttype_change",
-                       args=[obj.productType.id])
+                       args=[obj.productType_id])
         return mark_safe(f'<a href="{link}">{escape(obj.productType.__str__())}</a>')
 
     productType_link.short_description = 'Тип продукта'
-    productType_link.admin_order_field = 'тип продукта'
+    productType_link.admin_order_field = 'productType__title'
 
     list_display = ('title', 'productType_link',
-                    'description', 'countLeft')
+                    'description', 'countLeft', 'price')
+    list_select_related = ('productType',)
     search_fields = ('title', 'description',)
     list_filter = ('productType',)
     fieldsets = ((None, {
@@ -99,6 +129,7 @@ class ProductAdmin(ImportExportActionModelAdmin):
             'title',
             'description',
             'countLeft',
+            'price',
             'photo',
         )
     }),)
@@ -109,9 +140,10 @@ class ServiceGroupResource(resources.ModelResource):
 
     class Meta:
         model = ServiceGroup
+        exclude = ('imageThumbnails',)
 
 
-class ServiceGroupAdmin(ImportExportActionModelAdmin):
+class ServiceGroupAdmin(StreamingExportMixin, ImportExportActionModelAdmin):
     resource_class = ServiceGroupResource
     list_display = ('title', 'description',)
     search_fields = ('title', 'description')
@@ -125,29 +157,31 @@ class ServiceGroupAdmin(ImportExportActionModelAdmin):
     filter_horizontal = ()
 
 
-class WorkPositionResource(resources.ModelResource):
+class WorkPositionResource(BulkModelResource):
     serviceGroup = fields.Field(column_name="serviceGroup", attribute="serviceGroup",
-                                widget=ForeignKeyWidget(ServiceGroup, 'serviceGroup'))
+                                widget=CachedForeignKeyWidget(ServiceGroup, 'title'))
 
     class Meta:
         model = WorkPosition
 
 
-class WorkPositionAdmin(ImportExportActionModelAdmin):
+class WorkPositionAdmin(StreamingExportMixin, BulkImportAdminMixin,
+                         ImportExportActionModelAdmin):
     resource_class = WorkPositionResource
 
     def serviceGroup_link(self, obj: Product):
         if obj.serviceGroup == None:
             return 'Нет типа'
         link = reverse("admin:api_servicegroup_change",
-                       args=[obj.serviceGroup.id])
+                       args=[obj.serviceGroup_id])
         return mark_safe(f'<a href="{link}">{escape(obj.serviceGroup.__str__())}</a>')
 
     serviceGroup_link.short_description = 'Группа услуг'
-    serviceGroup_link.admin_order_field = 'группа услуг'
+    serviceGroup_link.admin_order_field = 'serviceGroup__title'
 
     list_display = ('title', 'description',
                     'serviceGroup_link', 'workSchedule')
+    list_select_related = ('serviceGroup',)
     list_filter = ('serviceGroup', 'workSchedule')
     search_fields = ('title', )
     fieldsets = ((None, {
@@ -161,29 +195,40 @@ class WorkPositionAdmin(ImportExportActionModelAdmin):
     filter_horizontal = ()
 
 
-class ServiceResource(resources.ModelResource):
+class ServiceResource(BulkModelResource):
     serviceGroup = fields.Field(column_name="serviceGroup", attribute="serviceGroup",
-                                widget=ForeignKeyWidget(ServiceGroup, 'serviceGroup'))
+                                widget=CachedForeignKeyWidget(ServiceGroup, 'title'))
 
     class Meta:
         model = Service
+        exclude = ('imageThumbnails',)
+
+    def after_bulk_import(self, updated_ids):
+        pricing.recalculate_open_orders_for_services(updated_ids)
+
+    def after_bulk_commit(self, updated_ids):
+        pricing.invalidate_prices(Service, updated_ids)
+        bump_version(Service)
+        search.rebuild([Service])
 
 
-class ServiceAdmin(ImportExportActionModelAdmin):
+class ServiceAdmin(FullTextSearchAdminMixin, StreamingExportMixin, BulkImportAdminMixin,
+                    ImportExportActionModelAdmin):
     resource_class = ServiceResource
 
     def serviceGroup_link(self, obj: Service):
         if obj.serviceGroup == None:
             return 'Нет в группе'
         link = reverse("admin:api_servicegroup_change",
-                       args=[obj.serviceGroup.id])
+                       args=[obj.serviceGroup_id])
         return mark_safe(f'<a href="{link}">{escape(obj.serviceGroup.__str__())}</a>')
 
     serviceGroup_link.short_description = 'Группа услуг'
-    serviceGroup_link.admin_order_field = 'группа услуг'
+    serviceGroup_link.admin_order_field = 'serviceGroup__title'
 
     list_display = ('title', 'description',
-                    'serviceGroup_link', 'price', 'percToEmpl')
+                    'serviceGroup_link', 'price', 'percToEmpl', 'duration')
+    list_select_related = ('serviceGroup',)
     list_filter = ('serviceGroup',)
     search_fields = ('title', 'description',)
     fieldsets = ((None, {
@@ -193,7 +238,8 @@ class ServiceAdmin(ImportExportActionModelAdmin):
             'serviceGroup',
             'image',
             'price',
-            'percToEmpl'
+            'percToEmpl',
+            'duration',
         )
     }),)
     filter_horizontal = ()
@@ -205,7 +251,7 @@ class DiscountResource(resources.ModelResource):
         model = Discount
 
 
-class DiscountAdmin(ImportExportActionModelAdmin):
+class DiscountAdmin(StreamingExportMixin, ImportExportActionModelAdmin):
     resource_class = DiscountResource
     list_display = ('id', 'discountAmount', 'promoCode')
     search_fields = ('promoCode',)
@@ -266,11 +312,11 @@ class EmployeeAdmin(ReverseModelAdmin):
         if obj.workPosition == None:
             return 'Нет должности'
         link = reverse("admin:api_workposition_change",
-                       args=[obj.workPosition.id])
+                       args=[obj.workPosition_id])
         return mark_safe(f'<a href="{link}">{escape(obj.workPosition.__str__())}</a>')
 
     workPosition_link.short_description = 'Должность'
-    workPosition_link.admin_order_field = 'должность'
+    workPosition_link.admin_order_field = 'workPosition__title'
 
     inline_type = 'stacked'
     inline_reverse = [
@@ -284,6 +330,7 @@ class EmployeeAdmin(ReverseModelAdmin):
     list_filter = ('employeeStatus', 'workPosition')
     list_display = ('user', 'workPosition_link', 'phone',
                     'address', 'employeeStatus')
+    list_select_related = ('user', 'workPosition')
     search_fields = ('user__name',
                      'user__surname', 'phone')
 
@@ -297,50 +344,77 @@ class ClientAdmin(ReverseModelAdmin):
         },
     ]
     list_display = ('user', 'phone', 'birthdate', 'address')
+    list_select_related = ('user',)
     search_fields = ('user__name', 'user__surname', 'phone',)
 
 
 class AppointmentResource(resources.ModelResource):
     client = fields.Field(column_name="client", attribute="client",
-                          widget=ForeignKeyWidget(Client, 'user'))
+                          widget=ForeignKeyWidget(Client, 'phone'))
     employee = fields.Field(column_name="employee", attribute="employee",
-                            widget=ForeignKeyWidget(Employee, "employee"))
+                            widget=ForeignKeyWidget(Employee, 'phone'))
     discount = fields.Field(column_name="discount", attribute="discount",
-                            widget=ForeignKeyWidget(Discount, 'discountAmount'))
+                            widget=ForeignKeyWidget(Discount, 'promoCode'))
 
     class Meta:
         model = Appointment
 
 
-class AppointmentAdmin(ImportExportActionModelAdmin):
+class AppointmentAdminForm(forms.ModelForm):
+    """
+    Отклоняет пересечение с другими записями сотрудника, как при записи
+    через API. Форма проверяется внутри транзакции страницы изменения,
+    которую AppointmentAdmin открывает через booking_transaction, поэтому
+    блокировка сотрудника держится до сохранения.
+    """
+
+    def clean(self):
+        data = super().clean()
+        start = data.get('scheduledTime')
+        appointment = Appointment(
+            pk=self.instance.pk, employee=data.get('employee'), scheduledTime=start,
+            appointmentStatus=data.get('appointmentStatus'))
+        if start:
+            appointment.endTime = start + get_duration(data.get('services', ()))
+        if is_employee_busy(appointment):
+            self.add_error('scheduledTime', BUSY_MESSAGE)
+        return data
+
+
+class AppointmentAdmin(StreamingExportMixin, ImportExportActionModelAdmin):
     resource_class = AppointmentResource
+    form = AppointmentAdminForm
+
+    def changeform_view(self, request, *args, **kwargs):
+        with booking_transaction():
+            return super().changeform_view(request, *args, **kwargs)
 
     def client_link(self, obj: Appointment):
         if obj.client == None:
             return 'Нет в приложении'
-        link = reverse("admin:api_client_change", args=[obj.client.id])
+        link = reverse("admin:api_client_change", args=[obj.client_id])
         return mark_safe(f'<a href="{link}">{escape(obj.client.__str__())}</a>')
 
     client_link.short_description = 'Клиент'
-    client_link.admin_order_field = 'клиент'
+    client_link.admin_order_field = 'client__user__surname'
 
     def employee_link(self, obj: Appointment):
         if obj.employee == None:
             return 'Нет сотрудника'
-        link = reverse("admin:api_employee_change", args=[obj.employee.id])
+        link = reverse("admin:api_employee_change", args=[obj.employee_id])
         return mark_safe(f'<a href="{link}">{escape(obj.employee.__str__())}</a>')
 
     employee_link.short_description = 'Сотрудник'
-    employee_link.admin_order_field = 'сотрудник'
+    employee_link.admin_order_field = 'employee__user__surname'
 
     def discount_link(self, obj: Appointment):
         if obj.discount == None:
             return 'Без скидки'
-        link = reverse("admin:api_discount_change", args=[obj.discount.id])
+        link = reverse("admin:api_discount_change", args=[obj.discount_id])
         return mark_safe(f'<a href="{link}">{escape(obj.discount.__str__())}</a>')
 
     discount_link.short_description = 'Скидка'
-    discount_link.admin_order_field = 'скидка'
+    discount_link.admin_order_field = 'discount__discountAmount'
 
     def unauthorized(self, obj: Appointment):
         if obj.client == None:
@@ -348,11 +422,26 @@ class AppointmentAdmin(ImportExportActionModelAdmin):
         return 'Есть в приложении'
 
     unauthorized.short_description = 'Неавторизованный клиент'
-    unauthorized.admin_order_field = 'неавторизованный клиент'
+    unauthorized.admin_order_field = 'unauthorizedUser'
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        appointment = form.instance
+        if appointment.scheduledTime:
+            appointment.endTime = appointment.scheduledTime + \
+                get_duration(appointment.services.all())
+            Appointment.objects.filter(pk=appointment.pk).update(
+                endTime=appointment.endTime)
+        recalculate_appointments(Appointment.objects.filter(pk=appointment.pk))
+        # цена пересчитана через UPDATE без сигналов — обновляем сводку сами
+        if appointment.appointmentStatus == Appointment.COMPLETED:
+            reports.rebuild_appointments([appointment.pk])
 
     list_filter = ('appointmentStatus',)
     list_display = ("id", 'client_link', 'unauthorized', 'employee_link', 'discount_link', 'fullPrice',
-                    "appointmentStatus", "scheduledTime",)
+                    "appointmentStatus", "scheduledTime", "endTime",)
+    list_select_related = ('client__user', 'employee__user', 'discount')
+    readonly_fields = ('fullPrice',)
     search_fields = ('client__user__name', 'client__user__surname',
                      'employee__user__name', 'employee__user__surname', 'unauthorizedUser')
     filter_horizontal = ()
@@ -360,34 +449,42 @@ class AppointmentAdmin(ImportExportActionModelAdmin):
 
 class PurchaseResource(resources.ModelResource):
     client = fields.Field(column_name="client", attribute="client",
-                          widget=ForeignKeyWidget(Client, 'user'))
+                          widget=ForeignKeyWidget(Client, 'phone'))
     discount = fields.Field(column_name="discount", attribute="discount",
-                            widget=ForeignKeyWidget(Discount, 'discountAmount'))
+                            widget=ForeignKeyWidget(Discount, 'promoCode'))
 
     class Meta:
         model = Purchase
 
 
-class PurchaseAdmin(ImportExportActionModelAdmin):
+class PurchaseProductInline(admin.TabularInline):
+    model = PurchaseProduct
+    fields = ('product', 'quantity', 'unitPrice')
+    extra = 0
+
+
+class PurchaseAdmin(StreamingExportMixin, ImportExportActionModelAdmin):
     resource_class = PurchaseResource
+    inlines = (PurchaseProductInline,)
+    actions = ImportExportActionModelAdmin.actions + ["make_purchases_completed", ]
 
     def client_link(self, obj: Appointment):
         if obj.client == None:
             return 'Нет в приложении'
-        link = reverse("admin:api_client_change", args=[obj.client.id])
+        link = reverse("admin:api_client_change", args=[obj.client_id])
         return mark_safe(f'<a href="{link}">{escape(obj.client.__str__())}</a>')
 
     client_link.short_description = 'Клиент'
-    client_link.admin_order_field = 'клиент'
+    client_link.admin_order_field = 'client__user__surname'
 
     def discount_link(self, obj: Appointment):
         if obj.discount == None:
             return 'Без скидки'
-        link = reverse("admin:api_discount_change", args=[obj.discount.id])
+        link = reverse("admin:api_discount_change", args=[obj.discount_id])
         return mark_safe(f'<a href="{link}">{escape(obj.discount.__str__())}</a>')
 
     discount_link.short_description = 'Скидка'
-    discount_link.admin_order_field = 'скидка'
+    discount_link.admin_order_field = 'discount__discountAmount'
 
     def unauthorized(self, obj: Appointment):
         if obj.client == None:
@@ -395,16 +492,111 @@ class PurchaseAdmin(ImportExportActionModelAdmin):
         return 'Есть в приложении'
 
     unauthorized.short_description = 'Неавторизованный клиент'
-    unauthorized.admin_order_field = 'неавторизованный клиент'
+    unauthorized.admin_order_field = 'unauthorizedUser'
+
+    def save_model(self, request, obj, form, change):
+        # товары списываются в save_related, когда строки покупки уже сохранены
+        obj._completing = obj.purchaseStatus == Purchase.COMPLETED and \
+            form.initial.get('purchaseStatus') != Purchase.COMPLETED
+        if obj._completing:
+            obj.purchaseStatus = Purchase.IN_PROGRESS
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        purchases = Purchase.objects.filter(pk=form.instance.pk)
+        recalculate_purchases(purchases)
+        if getattr(form.instance, '_completing', False):
+            self.complete(request, purchases)
+        elif form.instance.purchaseStatus == Purchase.COMPLETED:
+            reports.rebuild_purchases([form.instance.pk])
+
+    def complete(self, request, queryset):
+        try:
+            return complete_purchases(queryset)
+        except serializers.ValidationError as error:
+            for message in error.detail['purchaseStatus']:
+                self.message_user(request, message, messages.ERROR)
+            return 0
+
+    def make_purchases_completed(self, request, queryset):
+        rows_updated = self.complete(request, queryset)
+        if rows_updated:
+            self.message_user(
+                request, "выполнено покупок: %s." % rows_updated)
+
+    make_purchases_completed.short_description = "Выполнить выбранные покупки"
 
     list_filter = ('purchaseStatus',)
     list_display = ("id", 'client_link', 'unauthorized', 'discount_link',
                     "purchaseStatus", "fullPrice", "created_at")
+    list_select_related = ('client__user', 'discount')
+    readonly_fields = ('fullPrice',)
     search_fields = ('client__user__name',
                      'client__user__surname', 'unauthorizedUser')
     filter_horizontal = ()
 
 
+class RevenueRollupAdmin(admin.ModelAdmin):
+    """
+    Сводки только читаются: их пишут сигналы и команда rebuild_revenue.
+    Отчёт за произвольный период — на странице dashboard/.
+    """
+    change_list_template = "admin/api/revenuerollup/change_list.html"
+    list_display = ("periodStart", "period", "dimension",
+                    "objectId", "revenue", "commission", "count")
+    list_filter = ("period", "dimension")
+    date_hierarchy = "periodStart"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path("dashboard/", self.admin_site.admin_view(self.dashboard_view),
+                 name="api_revenuerollup_dashboard"),
+        ] + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        if hasattr(response, "context_data") and "cl" in response.context_data:
+            response.context_data["totals"] = response.context_data["cl"].queryset \
+                .aggregate(revenue=Sum("revenue"), commission=Sum("commission"))
+        return response
+
+    def dashboard_view(self, request):
+        today = datetime.date.today()
+        query = RevenueReportQuerySerializer(data={
+            "dimension": request.GET.get("dimension", RevenueRollup.SERVICE),
+            "dateFrom": request.GET.get("dateFrom", today.replace(day=1)),
+            "dateTo": request.GET.get("dateTo", today),
+        })
+        rows, errors = [], []
+        if query.is_valid():
+            data = query.validated_data
+            rows = reports.get_totals(data["dimension"], data["dateFrom"], data["dateTo"])
+        else:
+            errors = [error for field in query.errors.values() for error in field]
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title="Выручка за период",
+            query=query.initial_data,
+            dimensions=RevenueRollup.DIMENSION_CHOICES,
+            rows=rows,
+            errors=errors,
+            revenue=sum(row["revenue"] for row in rows),
+            commission=sum(row["commission"] for row in rows),
+        )
+        return TemplateResponse(request, "admin/api/revenuerollup/dashboard.html", context)
+
+
 admin.site.register(News, NewsAdmin)
 admin.site.register(ProductType, ProductTypeAdmin)
 admin.site.register(Product, ProductAdmin)
@@ -417,3 +609,4 @@ admin.site.register(Client, ClientAdmin)
 admin.site.register(Appointment, AppointmentAdmin)
 admin.site.register(Purchase, PurchaseAdmin)
 admin.site.register(User, UserProfileAdmin)
+admin.site.register(RevenueRollup, RevenueRollupAdmin)
@@ -0,0 +1,79 @@
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from . import catalog
+from .views import NewsViewSet, ProductViewSet, ServiceViewSet, AvailabilityViewSet
+
+
+# ============================================
+# АСИНХРОННОЕ ЧТЕНИЕ
+# ============================================
+
+# Под ASGI ответ из кэша каталога отдаётся прямо в цикле событий, а запрос
+# ждёт медленного клиента без отдельного потока. К базе обращается только
+# синхронный viewset, который выполняется через sync_to_async с
+# thread_sensitive=True — так Django держит соединение с базой в одном
+# потоке. Кэш потокобезопасен, поэтому читается из общего пула потоков.
+
+def cache_call(func):
+    return sync_to_async(func, thread_sensitive=False)
+
+
+def sync_call(view):
+    def render(request, **kwargs):
+        return view(request, **kwargs).render()
+    return sync_to_async(render, thread_sensitive=True)
+
+
+def json_view(viewset, action, basename):
+    return viewset.as_view({'get': action}, basename=basename,
+                           renderer_classes=[JSONRenderer])
+
+
+def catalog_view(viewset, action, basename):
+    """
+    Асинхронный list/retrieve для viewset с CatalogCacheMixin. Ключи кэша
+    совпадают с ключами самого viewset, поэтому промах заполняет кэш для
+    следующих запросов.
+    """
+    run_view = sync_call(json_view(viewset, action, basename))
+
+    async def view(request, **kwargs):
+        etag, last_modified = await cache_call(catalog.get_validators)(
+            [basename, action, JSONRenderer.format, request.scheme, request.get_host(),
+             request.get_full_path()],
+            viewset.cache_models)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            data = await cache_call(catalog.get_cache().get)(catalog.response_key(etag))
+            if data is None:
+                return await run_view(request, **kwargs)
+            response = HttpResponse(JSONRenderer().render(data),
+                                    content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    return view
+
+
+def plain_view(viewset, action, basename):
+    run_view = sync_call(json_view(viewset, action, basename))
+
+    async def view(request, **kwargs):
+        return await run_view(request, **kwargs)
+
+    return view
+
+
+news_list = catalog_view(NewsViewSet, 'list', 'news')
+news_detail = catalog_view(NewsViewSet, 'retrieve', 'news')
+product_list = catalog_view(ProductViewSet, 'list', 'products')
+product_detail = catalog_view(ProductViewSet, 'retrieve', 'products')
+service_list = catalog_view(ServiceViewSet, 'list', 'services')
+service_detail = catalog_view(ServiceViewSet, 'retrieve', 'services')
+availability = plain_view(AvailabilityViewSet, 'list', 'availability')
@@ -0,0 +1,87 @@
+import hashlib
+import hmac
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+
+from .activity import tracker
+
+
+# ============================================
+# КЭШ АВТОРИЗАЦИИ
+# ============================================
+
+# Проверенные токены и пары логин/пароль хранятся в кэше вместе с поколением
+# пользователя. Сохранение пользователя, удаление токена и выход меняют
+# поколение, и все записи пользователя сразу перестают приниматься;
+# остальные живут не дольше AUTH_CACHE_TIMEOUT.
+
+def get_cache():
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def generation_key(user_id):
+    return 'auth:generation:%s' % user_id
+
+
+def get_generation(user_id):
+    cache = get_cache()
+    cache.add(generation_key(user_id), uuid.uuid4().hex, None)
+    return cache.get(generation_key(user_id))
+
+
+def invalidate_user(user_id):
+    get_cache().set(generation_key(user_id), uuid.uuid4().hex, None)
+
+
+def credentials_key(kind, *parts):
+    # в ключе только HMAC: ни токен, ни пароль не попадают в кэш открыто
+    digest = hmac.new(settings.SECRET_KEY.encode(), '\0'.join(parts).encode(),
+                      hashlib.sha256).hexdigest()
+    return 'auth:%s:%s' % (kind, digest)
+
+
+def get_cached(key):
+    entry = get_cache().get(key)
+    if entry is None:
+        return None
+    user, auth = entry['result']
+    if entry['generation'] != get_cache().get(generation_key(user.pk)):
+        return None
+    return user, auth
+
+
+def set_cached(key, result):
+    user, auth = result
+    get_cache().set(key, {'result': result, 'generation': get_generation(user.pk)},
+                    settings.AUTH_CACHE_TIMEOUT)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cache_key = credentials_key('token', key)
+        result = get_cached(cache_key)
+        if result is None:
+            result = super().authenticate_credentials(key)
+            set_cached(cache_key, result)
+        tracker.touch(result[0])
+        return result
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Хэширование пароля (PBKDF2) выполняется один раз, дальше пара
+    логин/пароль проверяется по кэшу. Неверные пароли не кэшируются.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        cache_key = credentials_key('basic', userid, password)
+        result = get_cached(cache_key)
+        if result is None:
+            result = super().authenticate_credentials(userid, password, request)
+            set_cached(cache_key, result)
+        tracker.touch(result[0])
+        return result
@@ -0,0 +1,133 @@
+import bisect
+import datetime
+from itertools import accumulate
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import WorkPosition, Employee, Appointment
+
+
+# ============================================
+# ГРАФИКИ РАБОТЫ
+# ============================================
+
+# (рабочих дней, длина цикла)
+SHIFT_CYCLES = {
+    WorkPosition.TWO_TWO: (2, 4),
+    WorkPosition.THREE_THREE: (3, 6),
+}
+
+WEEKLY_WORKDAYS = {
+    WorkPosition.FIVE_TWO: 5,
+    WorkPosition.SIX_ONE: 6,
+}
+
+UNAVAILABLE_STATUSES = (
+    Employee.ON_SICK_LEAVE,
+    Employee.ON_VACATION,
+    Employee.FIRED,
+)
+
+
+def works_on(work_schedule, day):
+    if work_schedule in SHIFT_CYCLES:
+        workdays, cycle = SHIFT_CYCLES[work_schedule]
+        return (day - settings.BOOKING_SHIFT_CYCLE_START).days % cycle < workdays
+    return day.weekday() < WEEKLY_WORKDAYS.get(work_schedule, 5)
+
+
+# ============================================
+# ИНДЕКС ИНТЕРВАЛОВ
+# ============================================
+
+class IntervalIndex:
+    """
+    Отсортированные занятые интервалы [начало, конец) одного сотрудника.
+    Проверка пересечения со слотом — один bisect по началам и сравнение
+    с максимальным концом среди интервалов, начавшихся раньше конца слота.
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self.starts = [start for start, end in intervals]
+        self.max_ends = list(accumulate((end for start, end in intervals), max))
+
+    def overlaps(self, start, end):
+        position = bisect.bisect_left(self.starts, end)
+        return position > 0 and self.max_ends[position - 1] > start
+
+
+def slot_length():
+    return datetime.timedelta(minutes=settings.BOOKING_SLOT_MINUTES)
+
+
+def day_slots(day, length):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.datetime.combine(
+        day, datetime.time(settings.BOOKING_OPENING_HOUR)), tz)
+    closing = timezone.make_aware(datetime.datetime.combine(
+        day, datetime.time(settings.BOOKING_CLOSING_HOUR)), tz)
+    step = slot_length()
+    while start + length <= closing:
+        yield start
+        start += step
+
+
+# ============================================
+# СВОБОДНОЕ ВРЕМЯ
+# ============================================
+
+def get_available_employees(service_group):
+    return Employee.objects \
+        .filter(workPosition__serviceGroup=service_group) \
+        .exclude(employeeStatus__in=UNAVAILABLE_STATUSES) \
+        .select_related('user', 'workPosition') \
+        .order_by('id')
+
+
+def get_busy_intervals(employees, range_start, range_end):
+    intervals = {employee.id: [] for employee in employees}
+    appointments = Appointment.objects \
+        .filter(employee__in=list(intervals),
+                scheduledTime__lt=range_end,
+                endTime__gt=range_start) \
+        .exclude(appointmentStatus=Appointment.CLIENT_CANCELED) \
+        .values_list('employee_id', 'scheduledTime', 'endTime')
+    for employee_id, start, end in appointments:
+        intervals[employee_id].append((start, end))
+    return intervals
+
+
+def get_free_slots(employees, date_from, date_to, length=None):
+    """
+    Возвращает [{employee, slots}] с началами свободных слотов для дней
+    с date_from по date_to включительно. Слот длиной length должен целиком
+    поместиться в рабочий день. Два запроса на весь диапазон.
+    """
+    employees = list(employees)
+    days = [date_from + datetime.timedelta(days=offset)
+            for offset in range((date_to - date_from).days + 1)]
+    if not employees or not days:
+        return []
+
+    length = length or slot_length()
+    candidates = {day: list(day_slots(day, length)) for day in days}
+    range_start = timezone.make_aware(
+        datetime.datetime.combine(days[0], datetime.time()))
+    range_end = timezone.make_aware(datetime.datetime.combine(
+        days[-1] + datetime.timedelta(days=1), datetime.time()))
+
+    busy = get_busy_intervals(employees, range_start, range_end)
+    now = timezone.now()
+
+    result = []
+    for employee in employees:
+        index = IntervalIndex(busy[employee.id])
+        schedule = employee.workPosition.workSchedule
+        slots = [start
+                 for day in days if works_on(schedule, day)
+                 for start in candidates[day]
+                 if start >= now and not index.overlaps(start, start + length)]
+        result.append({'employee': employee, 'slots': slots})
+    return result
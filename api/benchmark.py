@@ -0,0 +1,315 @@
+import asyncio
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .generator import DataGenerator, FUTURE_DAYS, SLOT_HOURS
+from .metrics import percentile
+from .models import User, Service, Employee, Appointment
+
+
+# ============================================
+# БАЗА ДЛЯ ЗАМЕРОВ
+# ============================================
+
+# Замеры идут на отдельной базе, заполненной генератором с фиксированным
+# зерном, поэтому прогоны на одной машине сравнимы между собой, а рабочая
+# база не меняется.
+
+@contextmanager
+def benchmark_database():
+    settings_dict = connection.settings_dict
+    old_name = settings_dict['NAME']
+    old_test_name = settings_dict['TEST'].get('NAME')
+    if connection.vendor == 'sqlite':
+        # база в памяти не видна из потоков WSGI-сервера, нужен файл
+        settings_dict['TEST']['NAME'] = os.path.join(
+            tempfile.gettempdir(), 'benchmark-%s.sqlite3' % os.getpid())
+    try:
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+    finally:
+        settings_dict['TEST']['NAME'] = old_test_name
+
+
+def seed(rows, stdout=None):
+    DataGenerator(seed=0, stdout=stdout).generate(
+        clients=max(100, rows // 10), employees=max(20, rows // 2000), services=100,
+        products=500, appointments=rows, purchases=rows // 2, news=max(10, rows // 100))
+
+
+# ============================================
+# СЦЕНАРИИ
+# ============================================
+
+class Scenario:
+    """
+    Одна точка доступа под нагрузкой. build(index) возвращает путь и тело
+    index-го запроса: номер растёт через все прогоны, поэтому новые записи
+    не пересекаются друг с другом.
+    """
+
+    def __init__(self, name, method, expected_status, build, token=None):
+        self.name = name
+        self.method = method
+        self.writes = method != 'GET'
+        self.expected_status = expected_status
+        self.build = build
+        self.token = token
+        self.counter = itertools.count()
+
+    def next_request(self):
+        path, data = self.build(next(self.counter))
+        body = json.dumps(data).encode() if data is not None else b''
+        headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+        if self.token:
+            headers['Authorization'] = 'Token %s' % self.token
+        return self.method, path, body, headers
+
+
+def create_scenarios():
+    admin = User.objects.create_user(
+        email='benchmark@example.com', name='Нагрузка', surname='Тест',
+        password='password', is_staff=True)
+    token = Token.objects.create(user=admin).key
+
+    employee_ids = list(Employee.objects.order_by('pk').values_list('pk', flat=True))
+    service_id = Service.objects.filter(duration__lte=SLOT_HOURS * 60) \
+        .order_by('pk').values_list('pk', flat=True).first()
+    appointment_ids = list(Appointment.objects
+                           .filter(appointmentStatus=Appointment.EMPLOYEE_WAITING)
+                           .order_by('pk').values_list('pk', flat=True)[:100])
+    # новые записи ставятся после всех сгенерированных, по окну на сотрудника
+    first_slot = timezone.make_aware(datetime.datetime.combine(
+        timezone.localdate() + datetime.timedelta(days=FUTURE_DAYS + 1), datetime.time(10)))
+    statuses = (Appointment.IN_PROGRESS, Appointment.EMPLOYEE_WAITING)
+
+    def create_appointment(index):
+        employee = employee_ids[index % len(employee_ids)]
+        start = first_slot + datetime.timedelta(
+            hours=SLOT_HOURS * (index // len(employee_ids)))
+        return '/api/v1/appointments/', {
+            'employee': employee, 'services': [service_id], 'scheduledTime': start.isoformat()}
+
+    def update_status(index):
+        appointment = appointment_ids[index % len(appointment_ids)]
+        return '/api/v1/appointments/%s/' % appointment, {
+            'appointmentStatus': statuses[index // len(appointment_ids) % 2]}
+
+    return [
+        Scenario('services.list', 'GET', 200, lambda index: ('/api/v1/services/', None)),
+        Scenario('appointments.list', 'GET', 200,
+                 lambda index: ('/api/v1/appointments/', None), token),
+        Scenario('purchases.list', 'GET', 200, lambda index: ('/api/v1/purchases/', None), token),
+        Scenario('appointments.create', 'POST', 201, create_appointment, token),
+        Scenario('appointments.update', 'PUT', 200, update_status, token),
+    ]
+
+
+# ============================================
+# СЕРВЕРЫ
+# ============================================
+
+# Приложение вызывается напрямую по протоколу WSGI или ASGI, без сети:
+# в замер попадает весь стек Django, но не сокеты и не HTTP-сервер.
+
+def get_host():
+    return next((host for host in settings.ALLOWED_HOSTS
+                 if host != '*' and not host.startswith('.')), 'localhost')
+
+
+def call_wsgi(application, method, path, body, headers):
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': get_host(), 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        key = name.upper().replace('-', '_')
+        environ[key if key in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + key] = value
+    status = []
+
+    def start_response(value, response_headers, exc_info=None):
+        status.append(int(value.split()[0]))
+
+    response = application(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        # close() отправляет request_finished и закрывает соединения
+        response.close()
+    return status[0]
+
+
+def run_wsgi(scenario, count, concurrency):
+    from core.wsgi import application
+    tickets = itertools.count()
+
+    def worker():
+        samples = []
+        while next(tickets) < count:
+            method, path, body, headers = scenario.next_request()
+            started = time.perf_counter()
+            status = call_wsgi(application, method, path, body, headers)
+            samples.append((time.perf_counter() - started, status))
+        connection.close()
+        return samples
+
+    with ThreadPoolExecutor(concurrency, thread_name_prefix='benchmark') as pool:
+        futures = [pool.submit(worker) for _ in range(concurrency)]
+    return [sample for future in futures for sample in future.result()]
+
+
+async def call_asgi(application, method, path, body, headers):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'client': ('127.0.0.1', 0),
+        'server': (get_host(), 80),
+        'headers': [(b'host', get_host().encode())] + [
+            (name.lower().encode(), value.encode()) for name, value in headers.items()],
+    }
+    messages = [{'type': 'http.disconnect'},
+                {'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        return messages.pop()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def run_asgi(scenario, count, concurrency):
+    from core.asgi import application
+    tickets = itertools.count()
+
+    async def worker(samples):
+        while next(tickets) < count:
+            method, path, body, headers = scenario.next_request()
+            started = time.perf_counter()
+            status = await call_asgi(application, method, path, body, headers)
+            samples.append((time.perf_counter() - started, status))
+
+    async def run():
+        samples = []
+        await asyncio.gather(*[worker(samples) for _ in range(concurrency)])
+        return samples
+
+    return asyncio.run(run())
+
+
+SERVERS = {
+    'wsgi': run_wsgi,
+    'asgi': run_asgi,
+}
+
+
+# ============================================
+# ЗАМЕРЫ И СРАВНЕНИЕ
+# ============================================
+
+def get_concurrency(scenario, concurrency):
+    # SQLite допускает одного писателя, а параллельная транзакция, которой
+    # нужна запись после чтения, сразу получает «database is locked» вместо
+    # ожидания, поэтому запись на SQLite замеряется последовательно
+    if scenario.writes and connection.vendor == 'sqlite':
+        return 1
+    return concurrency
+
+
+def measure(server, scenario, requests, concurrency, warmup=0):
+    run = SERVERS[server]
+    concurrency = get_concurrency(scenario, concurrency)
+    if warmup:
+        run(scenario, warmup, concurrency)
+    started = time.perf_counter()
+    samples = run(scenario, requests, concurrency)
+    elapsed = time.perf_counter() - started
+    durations = sorted(duration for duration, _ in samples)
+    return {
+        'server': server,
+        'endpoint': scenario.name,
+        'requests': len(samples),
+        'concurrency': concurrency,
+        'errors': sum(status != scenario.expected_status for _, status in samples),
+        'rps': round(len(samples) / elapsed, 1),
+        'meanMs': round(sum(durations) / len(durations) * 1000, 2),
+        'p50Ms': round(percentile(durations, 0.5) * 1000, 2),
+        'p95Ms': round(percentile(durations, 0.95) * 1000, 2),
+        'p99Ms': round(percentile(durations, 0.99) * 1000, 2),
+    }
+
+
+def get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment(rows, requests, concurrency):
+    return {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'debug': settings.DEBUG,
+        'cpus': os.cpu_count(),
+        'rows': rows,
+        'requests': requests,
+        'concurrency': concurrency,
+    }
+
+
+def change(before, after):
+    return (after - before) * 100 / before if before else 0
+
+
+def compare(results, baseline, threshold):
+    """
+    Регрессии относительно прошлого прогона: p95 вырос или пропускная
+    способность упала больше чем на threshold процентов.
+    """
+    previous = {(row['server'], row['endpoint']): row for row in baseline['results']}
+    regressions = []
+    for row in results:
+        before = previous.get((row['server'], row['endpoint']))
+        if before is None:
+            continue
+        p95 = change(before['p95Ms'], row['p95Ms'])
+        rps = change(before['rps'], row['rps'])
+        if p95 > threshold or rps < -threshold:
+            regressions.append({
+                'server': row['server'], 'endpoint': row['endpoint'],
+                'p95Ms': [before['p95Ms'], row['p95Ms']], 'p95Change': round(p95, 1),
+                'rps': [before['rps'], row['rps']], 'rpsChange': round(rps, 1),
+            })
+    return regressions
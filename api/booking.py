@@ -0,0 +1,98 @@
+import datetime
+import threading
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import serializers
+
+from .models import Employee, Appointment
+from .pricing import get_appointment_price
+
+
+# ============================================
+# ЗАПИСЬ К СОТРУДНИКУ
+# ============================================
+
+BUSY_MESSAGE = 'Сотрудник уже занят в это время'
+
+
+def get_duration(services):
+    minutes = sum(service.duration for service in services)
+    return datetime.timedelta(minutes=minutes or settings.BOOKING_SLOT_MINUTES)
+
+
+def get_overlapping(employee_id, start, end, exclude=None):
+    appointments = Appointment.objects \
+        .filter(employee_id=employee_id, scheduledTime__lt=end, endTime__gt=start) \
+        .exclude(appointmentStatus=Appointment.CLIENT_CANCELED)
+    if exclude is not None:
+        appointments = appointments.exclude(pk=exclude.pk)
+    return appointments
+
+
+def lock_employee(employee_id):
+    # блокируется только строка сотрудника: записи к разным сотрудникам
+    # проходят параллельно, к одному — по очереди
+    Employee.objects.select_for_update().only('id').get(pk=employee_id)
+
+
+# На базе без SELECT ... FOR UPDATE (SQLite) lock_employee ничего не
+# блокирует, и параллельные запросы одного процесса проходили бы проверку
+# пересечений одновременно. Там транзакции записей идут по очереди под
+# блокировкой процесса: SQLite всё равно пишет по одному. От других
+# процессов она не защищает — воркерам нужна база с блокировкой строк.
+process_lock = threading.RLock()
+
+
+@contextmanager
+def booking_transaction():
+    """
+    Транзакция, в которой проверяется и сохраняется запись. Блокировка
+    процесса берётся до неё и снимается после фиксации или отката.
+    """
+    lock = nullcontext() if connection.features.has_select_for_update else process_lock
+    with lock, transaction.atomic():
+        yield
+
+
+def is_employee_busy(appointment):
+    """
+    Пересекается ли запись с другими записями того же сотрудника. Строка
+    сотрудника блокируется до конца транзакции, поэтому вызывать нужно
+    внутри booking_transaction перед сохранением записи.
+    """
+    if not (appointment.employee_id and appointment.scheduledTime and appointment.endTime) \
+            or appointment.appointmentStatus == Appointment.CLIENT_CANCELED:
+        return False
+    lock_employee(appointment.employee_id)
+    return get_overlapping(appointment.employee_id, appointment.scheduledTime,
+                           appointment.endTime,
+                           exclude=appointment if appointment.pk else None).exists()
+
+
+def check_employee_free(appointment):
+    if is_employee_busy(appointment):
+        raise serializers.ValidationError({'scheduledTime': BUSY_MESSAGE})
+
+
+def save_appointment(appointment, services=None):
+    """
+    Сохраняет запись, пересчитывая время окончания по длительности услуг
+    и стоимость по ценам услуг, и отклоняя пересечение с другими записями
+    того же сотрудника.
+    """
+    with booking_transaction():
+        current_services = services
+        if services is None:
+            current_services = list(appointment.services.all()) if appointment.pk else []
+        start = appointment.scheduledTime
+        appointment.endTime = start + get_duration(current_services) if start else None
+        appointment.fullPrice = get_appointment_price(
+            [service.id for service in current_services], appointment.discount)
+
+        check_employee_free(appointment)
+        appointment.save()
+        if services is not None:
+            appointment.services.set(services)
+    return appointment
@@ -0,0 +1,110 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+# ============================================
+# КЭШ КАТАЛОГА
+# ============================================
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def version_key(model):
+    return 'catalog:version:%s' % model._meta.label_lower
+
+
+def new_version():
+    return {'token': uuid.uuid4().hex, 'modified': int(time.time())}
+
+
+def bump_version(model):
+    get_cache().set(version_key(model), new_version(), None)
+
+
+def bump_version_on_commit(model):
+    """
+    Меняет версию сразу и ещё раз после фиксации транзакции: ответ, который
+    параллельный запрос успел закэшировать по старым данным под
+    промежуточной версией, после фиксации больше не запросят.
+    """
+    bump_version(model)
+    transaction.on_commit(lambda: bump_version(model))
+
+
+def get_versions(models):
+    cache = get_cache()
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # ключ вытеснен или ещё не создан: начинаем новую версию
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_validators(parts, models):
+    """
+    ETag и Last-Modified ответа: parts описывают запрос, а токены версий
+    моделей меняют ETag после любого изменения каталога.
+    """
+    versions = get_versions(models)
+    source = '|'.join(list(parts) + [version['token'] for version in versions])
+    etag = '"%s"' % hashlib.md5(source.encode()).hexdigest()
+    last_modified = max(version['modified'] for version in versions)
+    return etag, last_modified
+
+
+def response_key(etag):
+    return 'catalog:response:' + etag.strip('"')
+
+
+class CatalogCacheMixin:
+    """
+    Кэширует ответы list/retrieve публичного каталога. Ключ строится из
+    версий моделей cache_models, которые меняются сигналами при сохранении,
+    поэтому старые ответы просто перестают запрашиваться. ETag и
+    Last-Modified позволяют клиенту получить 304 без тела ответа.
+    """
+    cache_models = ()
+
+    def get_cache_validators(self, request):
+        # ответ содержит абсолютные ссылки на картинки, поэтому адрес сайта
+        # входит в ключ: иначе клиенты другого домена получили бы чужие ссылки
+        return get_validators([self.basename, self.action, request.accepted_renderer.format,
+                               request.scheme, request.get_host(), request.get_full_path()],
+                              self.cache_models)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_cache_validators(request)
+        headers = {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+
+        if get_conditional_response(request._request, etag=etag, last_modified=last_modified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        cache = get_cache()
+        key = response_key(etag)
+        data = cache.get(key)
+        if data is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,299 @@
+import asyncio
+import io
+import json
+import queue
+import threading
+import uuid
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+
+from .activity import tracker
+from .authentication import get_generation
+
+
+# ============================================
+# СОБЫТИЯ
+# ============================================
+
+class Broker:
+    """
+    Рассылка событий внутри процесса. Последние события хранятся в
+    кольцевом буфере, чтобы переподключившийся клиент получил пропущенное.
+    Номер события содержит токен процесса: после перезапуска старые номера
+    не совпадут, и клиент получит событие reset.
+    """
+
+    def __init__(self, size):
+        self.token = uuid.uuid4().hex[:8]
+        self.last_number = 0
+        self.history = deque(maxlen=size)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def publish(self, event, data):
+        with self.lock:
+            self.last_number += 1
+            message = {'id': '%s-%s' % (self.token, self.last_number),
+                       'event': event, 'data': data}
+            self.history.append(message)
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            callback(message)
+        return message
+
+    def parse_id(self, event_id):
+        token, _, number = (event_id or '').partition('-')
+        if token != self.token or not number.isdigit():
+            return None
+        return int(number)
+
+    def subscribe(self, callback, last_event_id=None):
+        """
+        Подписывает callback и возвращает события после last_event_id или
+        None, если их уже нет в буфере.
+        """
+        with self.lock:
+            self.subscribers.add(callback)
+            if not last_event_id:
+                return []
+            number = self.parse_id(last_event_id)
+            if number is None or number > self.last_number:
+                return None
+            if self.history and self.parse_id(self.history[0]['id']) > number + 1:
+                return None
+            return [message for message in self.history
+                    if self.parse_id(message['id']) > number]
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers.discard(callback)
+
+
+broker = Broker(settings.EVENTS_BUFFER_SIZE)
+
+
+def publish_on_commit(event, data):
+    transaction.on_commit(lambda: broker.publish(event, data))
+
+
+def format_event(message):
+    return 'id: %s\nevent: %s\ndata: %s\n\n' % (
+        message['id'], message['event'],
+        json.dumps(message['data'], ensure_ascii=False, cls=JSONEncoder))
+
+
+def reset_event():
+    return 'event: reset\ndata: {}\n\n'
+
+
+def stream(last_event_id=None):
+    """
+    Поток для WSGI: каждый клиент ждёт событий в своём потоке.
+    """
+    messages = queue.Queue()
+    missed = broker.subscribe(messages.put, last_event_id)
+    try:
+        yield 'retry: %s\n\n' % settings.EVENTS_RETRY_MS
+        if missed is None:
+            yield reset_event()
+        for message in missed or ():
+            yield format_event(message)
+        while True:
+            try:
+                message = messages.get(timeout=settings.EVENTS_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            yield format_event(message)
+    finally:
+        broker.unsubscribe(messages.put)
+
+
+async def stream_async(last_event_id=None):
+    """
+    Поток для ASGI: клиенты ждут событий в цикле событий без потоков.
+    """
+    loop = asyncio.get_running_loop()
+    messages = asyncio.Queue()
+
+    def callback(message):
+        loop.call_soon_threadsafe(messages.put_nowait, message)
+
+    missed = broker.subscribe(callback, last_event_id)
+    try:
+        yield 'retry: %s\n\n' % settings.EVENTS_RETRY_MS
+        if missed is None:
+            yield reset_event()
+        for message in missed or ():
+            yield format_event(message)
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    messages.get(), settings.EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield format_event(message)
+    finally:
+        broker.unsubscribe(callback)
+
+
+# ============================================
+# ДОСТУП
+# ============================================
+
+# Билет подписан отдельной солью, поэтому годится только для потока
+# событий. В нём поколение пользователя: выход и смена пароля отзывают
+# билеты вместе с токенами.
+ticket_signer = signing.TimestampSigner(salt='api.events.ticket')
+
+
+def issue_ticket(user):
+    return ticket_signer.sign('%s:%s' % (user.pk, get_generation(user.pk)))
+
+
+class QueryTicketAuthentication(BaseAuthentication):
+    """
+    EventSource в браузере не умеет передавать заголовки, поэтому поток
+    открывается по билету ?ticket=. Токен в адресе оседал бы в логах
+    прокси и истории браузера, а билет живёт EVENTS_TICKET_SECONDS и
+    проверяется только при подключении.
+    """
+
+    def authenticate(self, request):
+        ticket = request.query_params.get('ticket')
+        if not ticket:
+            return None
+        try:
+            user_id, generation = ticket_signer.unsign(
+                ticket, max_age=settings.EVENTS_TICKET_SECONDS).split(':')
+            user = get_user_model().objects.get(pk=user_id, is_active=True)
+        except (signing.BadSignature, ValueError, get_user_model().DoesNotExist):
+            raise exceptions.AuthenticationFailed('Билет недействителен или устарел')
+        if generation != get_generation(user.pk):
+            raise exceptions.AuthenticationFailed('Билет недействителен или устарел')
+        tracker.touch(user)
+        return user, None
+
+
+AUTHENTICATION_CLASSES = api_settings.DEFAULT_AUTHENTICATION_CLASSES + [QueryTicketAuthentication]
+
+
+def get_last_event_id(request):
+    return request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('lastEventId')
+
+
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode()
+
+
+def event_stream_response(content):
+    response = StreamingHttpResponse(content, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class EventStreamView(APIView):
+    """
+    Поток изменений статусов сотрудников и записей для стойки
+    администратора вместо опроса списков.
+    """
+    authentication_classes = AUTHENTICATION_CLASSES
+    permission_classes = [IsAdminUser]
+    renderer_classes = [EventStreamRenderer] + api_settings.DEFAULT_RENDERER_CLASSES
+
+    def get(self, request):
+        return event_stream_response(stream(get_last_event_id(request)))
+
+
+class EventTicketView(APIView):
+    """
+    Выдаёт билет на открытие потока событий. Сам запрос авторизуется
+    обычным заголовком, и токен не попадает в адрес потока.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        return Response({'ticket': issue_ticket(request.user),
+                         'expiresIn': settings.EVENTS_TICKET_SECONDS})
+
+
+def authenticate(http_request):
+    close_old_connections()
+    try:
+        request = Request(http_request,
+                          authenticators=[auth() for auth in AUTHENTICATION_CLASSES])
+        user = request.user
+    except exceptions.APIException:
+        return None
+    finally:
+        close_old_connections()
+    return user if IsAdminUser().has_permission(request, None) else None
+
+
+class EventStreamRouter:
+    """
+    ASGI-обёртка: поток событий обслуживается асинхронно, остальные
+    запросы уходят в Django. Django 3.1 читает StreamingHttpResponse
+    синхронно прямо в цикле событий, поэтому под ASGI поток отдаётся здесь.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != reverse('events-stream'):
+            return await self.application(scope, receive, send)
+
+        request = ASGIRequest(scope, io.BytesIO())
+        user = await sync_to_async(authenticate, thread_sensitive=True)(request)
+        if user is None:
+            await send({'type': 'http.response.start', 'status': 403,
+                        'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body',
+                        'body': json.dumps({'detail': 'Доступ запрещён'}, ensure_ascii=False).encode()})
+            return
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        events = stream_async(get_last_event_id(request))
+        try:
+            async for chunk in events:
+                if disconnected.done():
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode(),
+                            'more_body': True})
+        finally:
+            disconnected.cancel()
+            await events.aclose()
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
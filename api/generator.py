@@ -0,0 +1,360 @@
+import datetime
+import math
+import random
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+
+from . import catalog, promocodes, reports, search
+from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, \
+    Employee, Client, Appointment, Purchase, PurchaseProduct
+
+
+GENERATED_MODELS = (News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service,
+                    Employee, Client, Appointment, Appointment.services.through,
+                    Purchase, PurchaseProduct)
+
+# сетка записей: двухчасовые окна с 10:00 до 20:00
+SLOT_HOURS = 2
+SLOTS_PER_DAY = 5
+HISTORY_DAYS = 730
+FUTURE_DAYS = 30
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Отключает auto_now/auto_now_add, чтобы bulk_create сохранил
+    сгенерированные даты вместо текущего времени.
+    """
+    fields = [field for model in models for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def coprime_step(total):
+    step = int(total * 0.618) | 1
+    while math.gcd(step, total) != 1:
+        step += 2
+    return step
+
+
+class DataGenerator:
+    """
+    Массово создаёт правдоподобные данные для нагрузочных тестов.
+    Первичные ключи назначаются заранее, поэтому связи и M2M вставляются
+    через bulk_create без обратного чтения id, а пароль хешируется один раз.
+    """
+
+    def __init__(self, batch_size=5000, seed=None, stdout=None):
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.faker = Faker('ru_RU')
+        self.faker.seed_instance(seed)
+        self.stdout = stdout
+        self.now = timezone.now()
+        self.password = make_password('password')
+        self.first_names = [self.faker.first_name() for _ in range(500)]
+        self.last_names = [self.faker.last_name() for _ in range(500)]
+        self.streets = [self.faker.street_address() for _ in range(500)]
+        self.words = [self.faker.word() for _ in range(500)]
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def next_id(self, model):
+        last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+        return (last or 0) + 1
+
+    def insert(self, model, objects):
+        batch = []
+        count = 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+            count += len(batch)
+        self.log('%s: %s' % (model._meta.verbose_name_plural, count))
+        return count
+
+    def text(self, words=8):
+        return ' '.join(self.random.choice(self.words) for _ in range(words)).capitalize()
+
+    def price(self, median):
+        return int(round(self.random.lognormvariate(math.log(median), 0.5), -1))
+
+    # ============================================
+    # СПРАВОЧНИКИ
+    # ============================================
+
+    def create_catalog(self, services, products):
+        discount_id = self.next_id(Discount)
+        self.discounts = {discount_id + index: self.random.choice((5, 10, 15, 20))
+                          for index in range(20)}
+        self.insert(Discount, (
+            Discount(id=pk, discountAmount=amount, promoCode='G%05d' % pk)
+            for pk, amount in self.discounts.items()))
+
+        group_count = max(1, services // 10)
+        group_id = self.next_id(ServiceGroup)
+        self.insert(ServiceGroup, (
+            ServiceGroup(id=group_id + index, title='Группа услуг %s' % (group_id + index),
+                         description=self.text())
+            for index in range(group_count)))
+        self.group_ids = list(range(group_id, group_id + group_count))
+
+        service_id = self.next_id(Service)
+        self.services = {}
+        rows = []
+        for index in range(services):
+            service = Service(
+                id=service_id + index, serviceGroup_id=self.random.choice(self.group_ids),
+                title='Услуга %s' % (service_id + index), description=self.text(20),
+                price=self.price(1500), percToEmpl=self.random.choice((20, 30, 40)),
+                duration=self.random.choice((30, 60, 60)))
+            self.services[service.id] = (service.price, service.duration, service.serviceGroup_id)
+            rows.append(service)
+        self.insert(Service, rows)
+
+        type_id = self.next_id(ProductType)
+        type_count = max(1, products // 25)
+        self.insert(ProductType, (
+            ProductType(id=type_id + index, title='Тип товаров %s' % (type_id + index),
+                        description=self.text())
+            for index in range(type_count)))
+
+        product_id = self.next_id(Product)
+        self.products = {}
+        rows = []
+        for index in range(products):
+            product = Product(
+                id=product_id + index, productType_id=type_id + self.random.randrange(type_count),
+                title='Товар %s' % (product_id + index), description=self.text(20),
+                price=self.price(800), countLeft=self.random.randint(0, 500))
+            self.products[product.id] = product.price
+            rows.append(product)
+        self.insert(Product, rows)
+
+    def create_news(self, count):
+        news_id = self.next_id(News)
+        rows = []
+        for index in range(count):
+            created = self.now - datetime.timedelta(
+                minutes=self.random.randrange(HISTORY_DAYS * 24 * 60))
+            published = self.random.random() < 0.8
+            rows.append(News(
+                id=news_id + index, title='Новость %s' % (news_id + index),
+                description=self.text(40), created_at=created,
+                status=News.PUBLISHED if published else News.DRAFT,
+                published_at=created + datetime.timedelta(hours=1) if published else None))
+        self.insert(News, rows)
+
+    # ============================================
+    # ЛЮДИ
+    # ============================================
+
+    def create_users(self, first_id, count, user_type):
+        self.insert(User, (
+            User(id=first_id + index, email='%s%s@example.com' % (user_type, first_id + index),
+                 password=self.password, userType=user_type,
+                 name=self.random.choice(self.first_names),
+                 surname=self.random.choice(self.last_names),
+                 date_joined=self.now - datetime.timedelta(
+                     days=self.random.randrange(HISTORY_DAYS)),
+                 last_login=self.now - datetime.timedelta(days=self.random.randrange(30)))
+            for index in range(count)))
+
+    def create_people(self, clients, employees):
+        user_id = self.next_id(User)
+        self.create_users(user_id, employees, User.EMPLOYEE)
+        self.create_users(user_id + employees, clients, User.CLIENT)
+
+        position_id = self.next_id(WorkPosition)
+        schedules = [choice for choice, label in WorkPosition.WORK_SCHEDULE]
+        self.insert(WorkPosition, (
+            WorkPosition(id=position_id + index, title='Мастер %s' % (position_id + index),
+                         serviceGroup_id=group_id, workSchedule=self.random.choice(schedules))
+            for index, group_id in enumerate(self.group_ids)))
+        positions = dict(zip(self.group_ids, range(position_id, position_id + len(self.group_ids))))
+
+        employee_id = self.next_id(Employee)
+        statuses = (Employee.WAITING_APPOINTMENT, Employee.ON_APPOINTMENT,
+                    Employee.NONWORKING_TIME, Employee.ON_VACATION, Employee.ON_SICK_LEAVE)
+        self.employees = {}
+        rows = []
+        for index in range(employees):
+            group_id = self.random.choice(self.group_ids)
+            employee = Employee(
+                id=employee_id + index, user_id=user_id + index,
+                workPosition_id=positions[group_id],
+                birthdate=datetime.date(1970, 1, 1) + datetime.timedelta(
+                    days=self.random.randrange(365 * 35)),
+                phone='+7950%07d' % (employee_id + index), address=self.random.choice(self.streets),
+                employeeStatus=self.random.choices(statuses, (40, 30, 20, 5, 5))[0])
+            self.employees[employee.id] = group_id
+            rows.append(employee)
+        self.insert(Employee, rows)
+
+        client_id = self.next_id(Client)
+        self.client_ids = range(client_id, client_id + clients)
+        self.insert(Client, (
+            Client(id=client_id + index, user_id=user_id + employees + index,
+                   phone='+7900%07d' % (client_id + index), address=self.random.choice(self.streets),
+                   birthdate=datetime.date(1960, 1, 1) + datetime.timedelta(
+                       days=self.random.randrange(365 * 45)))
+            for index in range(clients)))
+
+    # ============================================
+    # ЗАПИСИ И ПОКУПКИ
+    # ============================================
+
+    def pick_discount(self):
+        if self.discounts and self.random.random() < 0.1:
+            return self.random.choice(list(self.discounts))
+        return None
+
+    def apply_discount(self, subtotal, discount_id):
+        return subtotal * (100 - self.discounts.get(discount_id, 0)) // 100
+
+    def create_appointments(self, count):
+        employee_ids = list(self.employees)
+        services_by_group = {}
+        for service_id, (price, duration, group_id) in self.services.items():
+            services_by_group.setdefault(group_id, []).append(service_id)
+
+        # каждая запись получает своё окно (сотрудник, день, слот):
+        # шаг, взаимно простой с числом окон, обходит их без повторов
+        days = HISTORY_DAYS + FUTURE_DAYS
+        total = len(employee_ids) * days * SLOTS_PER_DAY
+        if count > total:
+            raise ValueError('Не хватает окон: увеличьте число сотрудников')
+        step = coprime_step(total)
+        first_day = timezone.localtime(self.now).replace(
+            hour=10, minute=0, second=0, microsecond=0) - datetime.timedelta(days=HISTORY_DAYS)
+
+        appointment_id = self.next_id(Appointment)
+        Through = Appointment.services.through
+        links = []
+        rows = []
+        for index in range(count):
+            window = (index * step) % total
+            employee_id = employee_ids[window % len(employee_ids)]
+            day, slot = divmod(window // len(employee_ids), SLOTS_PER_DAY)
+            scheduled = first_day + datetime.timedelta(days=day, hours=slot * SLOT_HOURS)
+
+            group_services = services_by_group.get(self.employees[employee_id]) or list(self.services)
+            chosen = self.random.sample(group_services, min(len(group_services),
+                                                            self.random.choice((1, 1, 2))))
+            duration = sum(self.services[service_id][1] for service_id in chosen)
+            subtotal = sum(self.services[service_id][0] for service_id in chosen)
+            discount_id = self.pick_discount()
+
+            if scheduled > self.now:
+                status = Appointment.EMPLOYEE_WAITING
+            else:
+                status = self.random.choices(
+                    (Appointment.COMPLETED, Appointment.CLIENT_CANCELED), (85, 15))[0]
+            client_id = self.random.choice(self.client_ids) if self.client_ids \
+                and self.random.random() < 0.9 else None
+
+            pk = appointment_id + index
+            rows.append(Appointment(
+                id=pk, client_id=client_id, employee_id=employee_id, discount_id=discount_id,
+                fullPrice=self.apply_discount(subtotal, discount_id),
+                unauthorizedUser=None if client_id else self.random.choice(self.first_names),
+                appointmentStatus=status, scheduledTime=scheduled,
+                endTime=scheduled + datetime.timedelta(minutes=duration),
+                created_at=scheduled - datetime.timedelta(
+                    hours=self.random.randrange(1, 24 * 14))))
+            links += [Through(appointment_id=pk, service_id=service_id) for service_id in chosen]
+
+            if len(rows) >= self.batch_size:
+                Appointment.objects.bulk_create(rows)
+                Through.objects.bulk_create(links)
+                rows, links = [], []
+        Appointment.objects.bulk_create(rows)
+        Through.objects.bulk_create(links)
+        self.log('%s: %s' % (Appointment._meta.verbose_name_plural, count))
+
+    def create_purchases(self, count):
+        product_ids = list(self.products)
+        purchase_id = self.next_id(Purchase)
+        item_id = self.next_id(PurchaseProduct)
+        items = []
+        rows = []
+        for index in range(count):
+            pk = purchase_id + index
+            created = self.now - datetime.timedelta(
+                minutes=self.random.randrange(HISTORY_DAYS * 24 * 60))
+            subtotal = 0
+            for product_id in self.random.sample(product_ids, min(len(product_ids),
+                                                                  self.random.randint(1, 4))):
+                quantity = self.random.choices((1, 2, 3), (70, 20, 10))[0]
+                unit_price = self.products[product_id]
+                items.append(PurchaseProduct(id=item_id, purchase_id=pk, product_id=product_id,
+                                             quantity=quantity, unitPrice=unit_price))
+                item_id += 1
+                subtotal += quantity * unit_price
+            discount_id = self.pick_discount()
+            if created > self.now - datetime.timedelta(days=2):
+                status = Purchase.IN_PROGRESS
+            else:
+                status = self.random.choices(
+                    (Purchase.COMPLETED, Purchase.CLIENT_CANCELED), (95, 5))[0]
+            client_id = self.random.choice(self.client_ids) if self.client_ids \
+                and self.random.random() < 0.8 else None
+            rows.append(Purchase(
+                id=pk, client_id=client_id, discount_id=discount_id,
+                fullPrice=self.apply_discount(subtotal, discount_id),
+                unauthorizedUser=None if client_id else self.random.choice(self.first_names),
+                purchaseStatus=status, created_at=created))
+
+            if len(rows) >= self.batch_size:
+                Purchase.objects.bulk_create(rows)
+                PurchaseProduct.objects.bulk_create(items)
+                rows, items = [], []
+        Purchase.objects.bulk_create(rows)
+        PurchaseProduct.objects.bulk_create(items)
+        self.log('%s: %s' % (Purchase._meta.verbose_name_plural, count))
+
+    def reset_sequences(self):
+        sql = connection.ops.sequence_reset_sql(no_style(), GENERATED_MODELS)
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
+
+    def generate(self, clients=10000, employees=50, services=100, products=500,
+                 appointments=100000, purchases=50000, news=1000):
+        with transaction.atomic(), explicit_timestamps(*GENERATED_MODELS):
+            self.create_catalog(services, products)
+            self.create_news(news)
+            self.create_people(clients, employees)
+            self.create_appointments(appointments)
+            self.create_purchases(purchases)
+            self.reset_sequences()
+        # bulk_create не отправляет сигналы, поэтому кэши сбрасываются вручную;
+        # цены не сбрасываются: генератор только добавляет строки, их в кэше ещё нет
+        promocodes.invalidate_promo_codes()
+        for model in (News, ProductType, Product, ServiceGroup, Service):
+            catalog.bump_version(model)
+        search.rebuild()
+        # сводки выручки тоже строятся сигналами, поэтому пересчитываются целиком
+        first_day, last_day = reports.get_data_range()
+        if first_day is not None:
+            self.log('сводки выручки: %s дней' % reports.rebuild_range(first_day, last_day))
@@ -0,0 +1,81 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.benchmark import SERVERS, benchmark_database, seed, create_scenarios, measure, \
+    get_environment, compare
+
+
+class Command(BaseCommand):
+    help = 'Замеряет запросы в секунду и перцентили задержки ключевых точек API ' \
+           'под WSGI и ASGI на отдельной заполненной базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Сколько записей создать генератором')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на точку и сервер')
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--server', action='append', choices=sorted(SERVERS),
+                            help='По умолчанию оба')
+        parser.add_argument('--endpoint', action='append',
+                            help='Только эти точки, например services.list')
+        parser.add_argument('--output', help='Файл результатов, по умолчанию в BENCHMARK_DIR')
+        parser.add_argument('--baseline', help='Прошлый прогон для поиска регрессий')
+        parser.add_argument('--threshold', type=float, default=settings.BENCHMARK_THRESHOLD,
+                            help='Допустимое ухудшение p95 и запросов в секунду, %%')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as source:
+                baseline = json.load(source)
+        if settings.DEBUG:
+            self.stdout.write(self.style.WARNING(
+                'DEBUG включён: запросы к базе записываются, цифры будут хуже боевых'))
+
+        with benchmark_database():
+            self.stdout.write(self.style.MIGRATE_HEADING('Заполнение базы'))
+            seed(options['rows'], self.stdout)
+            scenarios = [scenario for scenario in create_scenarios()
+                         if not options['endpoint'] or scenario.name in options['endpoint']]
+            if not scenarios:
+                raise CommandError('Нет таких точек: %s' % ', '.join(options['endpoint']))
+            environment = get_environment(options['rows'], options['requests'],
+                                          options['concurrency'])
+
+            self.stdout.write(self.style.MIGRATE_HEADING('Замеры'))
+            results = []
+            for server in options['server'] or sorted(SERVERS):
+                for scenario in scenarios:
+                    row = measure(server, scenario, options['requests'], options['concurrency'],
+                                  options['warmup'])
+                    results.append(row)
+                    self.stdout.write(
+                        '%(server)s %(endpoint)-20s %(rps)8.1f зап/с  p50 %(p50Ms)7.1f  '
+                        'p95 %(p95Ms)7.1f  p99 %(p99Ms)7.1f мс  ошибок %(errors)s' % row)
+
+        report = {'startedAt': timezone.now().isoformat(), 'environment': environment,
+                  'results': results}
+        if baseline is not None:
+            report['baseline'] = options['baseline']
+            report['regressions'] = compare(results, baseline, options['threshold'])
+        output = options['output'] or os.path.join(
+            settings.BENCHMARK_DIR, 'api-%s.json' % timezone.localtime().strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w') as target:
+            json.dump(report, target, ensure_ascii=False, indent=2)
+        self.stdout.write('Результаты: %s' % output)
+
+        if any(row['errors'] for row in results):
+            self.stdout.write(self.style.WARNING('Есть ответы с неожиданным статусом'))
+        for regression in report.get('regressions', []):
+            self.stdout.write(self.style.ERROR(
+                '%(server)s %(endpoint)s: p95 %(p95Change)+.1f%%, зап/с %(rpsChange)+.1f%%'
+                % regression))
+        if report.get('regressions'):
+            raise CommandError('Регрессии относительно %s' % options['baseline'])
@@ -0,0 +1,78 @@
+import datetime
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.generator import DataGenerator
+from api.models import News, User, Employee, Appointment, Purchase
+
+
+INDEXED_MODELS = (News, User, Employee, Appointment, Purchase)
+
+
+def hot_queries():
+    now = timezone.now()
+    employee_id = Employee.objects.values_list('id', flat=True).first()
+    return [
+        ('пересечение записей сотрудника', Appointment.objects
+            .filter(employee_id=employee_id, scheduledTime__lt=now + datetime.timedelta(hours=2),
+                    endTime__gt=now)
+            .exclude(appointmentStatus=Appointment.CLIENT_CANCELED)),
+        ('записи по статусу', Appointment.objects
+            .filter(appointmentStatus=Appointment.COMPLETED)
+            .order_by('-scheduledTime')[:100]),
+        ('страница записей', Appointment.objects.order_by('-created_at', '-id')[:50]),
+        ('покупки в обработке', Purchase.objects
+            .filter(purchaseStatus=Purchase.IN_PROGRESS)
+            .order_by('-created_at')[:100]),
+        ('опубликованные новости', News.objects
+            .filter(status=News.PUBLISHED)
+            .order_by('-created_at', '-id')[:50]),
+        ('доступные сотрудники', Employee.objects
+            .filter(employeeStatus=Employee.WAITING_APPOINTMENT)[:100]),
+        ('сотрудники среди пользователей', User.objects
+            .filter(userType=User.EMPLOYEE)[:100]),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает планы и время горячих запросов без индексов и с индексами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Сначала создать столько записей через generate_data')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'])
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for model in INDEXED_MODELS:
+                    for index in model._meta.indexes:
+                        cursor.execute('DROP INDEX %s' % connection.ops.quote_name(index.name))
+            self.run('Без индексов', options['repeat'])
+            # индексы возвращаются откатом транзакции
+            transaction.set_rollback(True)
+
+        self.run('С индексами', options['repeat'])
+
+    def run(self, title, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in hot_queries():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append(time.perf_counter() - started)
+            self.stdout.write('%s: %.2f мс' % (name, statistics.median(timings) * 1000))
+            self.stdout.write('    ' + queryset.explain().replace('\n', '\n    '))
+
+    def seed(self, count):
+        DataGenerator(seed=0, stdout=self.stdout).generate(
+            clients=max(1000, count // 20), employees=max(50, count // 3000),
+            appointments=count, purchases=count // 2, news=count // 100)
@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import CHUNK_SIZE, FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Выгружает модель через ресурс import_export потоком в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Имя модели, например Appointment')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', default='-', help='Файл для записи, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model('api', options['model'])
+        except LookupError:
+            raise CommandError('Модель %s не найдена' % options['model'])
+        model_admin = admin.site._registry.get(model)
+        if not hasattr(model_admin, 'get_export_resource_class'):
+            raise CommandError('Для модели %s нет ресурса выгрузки' % model.__name__)
+
+        resource = model_admin.get_export_resource_class()()
+        lines = stream_export(resource, model.objects.all(), options['format'],
+                              options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            output.writelines(lines)
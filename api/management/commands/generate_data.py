@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.generator import DataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Создаёт синтетические данные для нагрузочных тестов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10000)
+        parser.add_argument('--employees', type=int, default=50)
+        parser.add_argument('--services', type=int, default=100)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--appointments', type=int, default=100000)
+        parser.add_argument('--purchases', type=int, default=50000)
+        parser.add_argument('--news', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Зерно генератора для воспроизводимых данных')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        generator = DataGenerator(batch_size=options['batch_size'], seed=options['seed'],
+                                  stdout=self.stdout)
+        generator.generate(
+            clients=options['clients'], employees=options['employees'],
+            services=options['services'], products=options['products'],
+            appointments=options['appointments'], purchases=options['purchases'],
+            news=options['news'])
+        self.stdout.write(self.style.SUCCESS(
+            'Готово за %.1f с' % (time.perf_counter() - started)))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры для картинок, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Пересобрать миниатюры у всех картинок')
+
+    def handle(self, *args, **options):
+        for model, field in thumbnails.IMAGE_FIELDS.items():
+            queryset = model.objects.exclude(**{field: ''}).exclude(**{field: None})
+            if not options['force']:
+                queryset = queryset.filter(**{thumbnails.thumbnails_field(model): {}})
+            built = 0
+            for pk, name in queryset.values_list('pk', field).iterator():
+                if thumbnails.generate(model, pk, name) is not None:
+                    built += 1
+            self.stdout.write('%s: %s' % (model._meta.verbose_name_plural, built))
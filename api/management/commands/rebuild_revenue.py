@@ -0,0 +1,28 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import reports
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводки выручки по дням и месяцам за период'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat,
+                            help='Первый день, по умолчанию день первого заказа')
+        parser.add_argument('--to', dest='date_to', type=datetime.date.fromisoformat,
+                            help='Последний день, по умолчанию день последнего заказа')
+
+    def handle(self, *args, **options):
+        first_day, last_day = reports.get_data_range()
+        date_from = options['date_from'] or first_day
+        date_to = options['date_to'] or last_day
+        if date_from is None or date_to is None:
+            self.stdout.write('Нет заказов для пересчёта')
+            return
+        if date_to < date_from:
+            raise CommandError('Дата окончания раньше даты начала')
+        days = reports.rebuild_range(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(
+            'Пересчитано дней: %s (%s — %s)' % (days, date_from, date_to)))
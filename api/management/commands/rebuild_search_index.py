@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Переиндексирует услуги, товары и новости для полнотекстового поиска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kinds', nargs='*', choices=sorted(search.SOURCES),
+                            help='Что переиндексировать, по умолчанию всё')
+
+    def handle(self, *args, **options):
+        kinds = options['kinds'] or sorted(search.SOURCES)
+        search.rebuild([search.SOURCES[kind].model for kind in kinds])
+        self.stdout.write(self.style.SUCCESS('Переиндексировано: %s' % ', '.join(kinds)))
@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework import serializers
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# ЗАМЕРЫ ЗАПРОСОВ
+# ============================================
+
+# Метрики копятся в памяти процесса: при нескольких воркерах каждый
+# отдаёт свои, а Prometheus складывает их по меткам instance.
+
+current_sample = ContextVar('metrics_sample', default=None)
+
+
+class Sample:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.sql = []
+
+
+def record_query(execute, sql, params, many, context):
+    # соединения живут по потокам, а sync_to_async переносит контекст в
+    # поток представления, поэтому замер ищется через ContextVar
+    sample = current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        sample.queries += 1
+        sample.db_time += duration
+        if len(sample.sql) < settings.METRICS_SLOW_SQL_LIMIT:
+            sample.sql.append((duration, sql))
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def timed_data(original):
+    """
+    Оборачивает Serializer.data: вложенные сериализаторы считаются
+    один раз в составе внешнего.
+    """
+    def data(self):
+        sample = current_sample.get()
+        if sample is None or sample.serializing:
+            return original.fget(self)
+        sample.serializing = True
+        started = time.perf_counter()
+        try:
+            return original.fget(self)
+        finally:
+            sample.serializer_time += time.perf_counter() - started
+            sample.serializing = False
+    return property(data)
+
+
+def instrument_serializers():
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(serializer_class.data, 'metrics_timed', False):
+            serializer_class.data = timed_data(serializer_class.data)
+            serializer_class.data.fget.metrics_timed = True
+
+
+def get_endpoint(request):
+    """
+    Метка точки: basename и action для viewset, имя маршрута для
+    остальных представлений.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    actions = getattr(match.func, 'actions', None)
+    initkwargs = getattr(match.func, 'initkwargs', None) or {}
+    if actions and initkwargs.get('basename'):
+        action = actions.get(request.method.lower(), request.method.lower())
+        return '%s.%s' % (initkwargs['basename'], action)
+    return match.view_name or match.func.__name__
+
+
+class PerformanceMiddleware:
+    """
+    Замеряет запрос целиком. Умеет работать и синхронно, и асинхронно,
+    чтобы под ASGI не переводить асинхронные представления в потоки.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        sample, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        return self.finish(request, response, sample, started)
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        sample, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        return self.finish(request, response, sample, started)
+
+    def start(self):
+        sample = Sample()
+        return sample, current_sample.set(sample), time.perf_counter()
+
+    def finish(self, request, response, sample, started):
+        duration = time.perf_counter() - started
+        size = 0 if response.streaming else len(response.content)
+        endpoint = get_endpoint(request)
+        registry.record(endpoint, response.status_code, duration, sample, size)
+        if duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            log_slow_request(request, endpoint, duration, sample)
+        return response
+
+
+def log_slow_request(request, endpoint, duration, sample):
+    logger.warning(
+        'Медленный запрос %s %s (%s): %.0f мс, SQL %s запросов за %.0f мс, '
+        'сериализация %.0f мс\n%s',
+        request.method, request.get_full_path(), endpoint, duration * 1000,
+        sample.queries, sample.db_time * 1000, sample.serializer_time * 1000,
+        '\n'.join('%8.1f мс  %s' % (query_time * 1000, sql) for query_time, sql in
+                  sorted(sample.sql, key=lambda item: item[0], reverse=True)))
+
+
+# ============================================
+# ХРАНИЛИЩЕ МЕТРИК
+# ============================================
+
+class EndpointStats:
+
+    def __init__(self, buckets, window):
+        self.count = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.size = 0
+        self.buckets = [0] * len(buckets)
+        self.recent = deque(maxlen=window)
+
+    def add(self, bucket, status, duration, sample, size):
+        self.count += 1
+        self.errors += status >= 500
+        self.duration += duration
+        self.queries += sample.queries
+        self.db_time += sample.db_time
+        self.serializer_time += sample.serializer_time
+        self.size += size
+        if bucket < len(self.buckets):
+            self.buckets[bucket] += 1
+        self.recent.append((duration, sample.queries, sample.db_time,
+                            sample.serializer_time, size))
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, status, duration, sample, size):
+        buckets = settings.METRICS_BUCKETS
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats(buckets, settings.METRICS_WINDOW)
+            stats.add(bisect_left(buckets, duration), status, duration, sample, size)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def summary(self):
+        """
+        Перцентили времени и средние по последним METRICS_WINDOW запросам
+        каждой точки, самые медленные по p95 первыми.
+        """
+        with self.lock:
+            recent = {endpoint: list(stats.recent) for endpoint, stats in self.endpoints.items()}
+        rows = []
+        for endpoint, samples in recent.items():
+            durations = sorted(sample[0] for sample in samples)
+            count = len(samples)
+            rows.append({
+                'endpoint': endpoint,
+                'count': count,
+                'p50Ms': round(percentile(durations, 0.5) * 1000, 2),
+                'p95Ms': round(percentile(durations, 0.95) * 1000, 2),
+                'p99Ms': round(percentile(durations, 0.99) * 1000, 2),
+                'queries': round(sum(sample[1] for sample in samples) / count, 2),
+                'dbMs': round(sum(sample[2] for sample in samples) / count * 1000, 2),
+                'serializerMs': round(sum(sample[3] for sample in samples) / count * 1000, 2),
+                'bytes': round(sum(sample[4] for sample in samples) / count),
+            })
+        return sorted(rows, key=lambda row: -row['p95Ms'])
+
+    def prometheus(self):
+        buckets = settings.METRICS_BUCKETS
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = [
+                '# HELP api_request_duration_seconds Время обработки запроса.',
+                '# TYPE api_request_duration_seconds histogram',
+            ]
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(buckets, stats.buckets):
+                    cumulative += count
+                    lines.append('api_request_duration_seconds_bucket{endpoint="%s",le="%s"} %s'
+                                 % (endpoint, bound, cumulative))
+                lines.append('api_request_duration_seconds_bucket{endpoint="%s",le="+Inf"} %s'
+                             % (endpoint, stats.count))
+                lines.append('api_request_duration_seconds_sum{endpoint="%s"} %.6f'
+                             % (endpoint, stats.duration))
+                lines.append('api_request_duration_seconds_count{endpoint="%s"} %s'
+                             % (endpoint, stats.count))
+            for name, kind, description, attribute in COUNTERS:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for endpoint, stats in endpoints:
+                    value = getattr(stats, attribute)
+                    lines.append('%s{endpoint="%s"} %s' % (
+                        name, endpoint, ('%.6f' % value) if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+
+COUNTERS = (
+    ('api_request_errors_total', 'counter', 'Ответы с кодом 5xx.', 'errors'),
+    ('api_db_queries_total', 'counter', 'Запросы к базе.', 'queries'),
+    ('api_db_duration_seconds_total', 'counter', 'Время запросов к базе.', 'db_time'),
+    ('api_serializer_duration_seconds_total', 'counter', 'Время сериализации.',
+     'serializer_time'),
+    ('api_response_bytes_total', 'counter', 'Размер ответов без потоковых.', 'size'),
+)
+
+registry = Registry()
+
+
+# ============================================
+# ТОЧКИ ДОСТУПА
+# ============================================
+
+class MetricsView(APIView):
+    """
+    Метрики в текстовом формате Prometheus.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.prometheus(),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsSummaryView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(registry.summary())
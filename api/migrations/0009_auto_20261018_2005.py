@@ -0,0 +1,44 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:05
+
+import datetime
+
+import django.core.validators
+from django.db import migrations, models
+
+# длительность записи без услуг на момент миграции (BOOKING_SLOT_MINUTES)
+SLOT_MINUTES = 60
+
+
+def fill_end_time(apps, schema_editor):
+    Appointment = apps.get_model('api', 'Appointment')
+    appointments = Appointment.objects \
+        .filter(scheduledTime__isnull=False) \
+        .annotate(minutes=models.Sum('services__duration')) \
+        .only('id', 'scheduledTime')
+    filled = []
+    for appointment in appointments.iterator():
+        appointment.endTime = appointment.scheduledTime + \
+            datetime.timedelta(minutes=appointment.minutes or SLOT_MINUTES)
+        filled.append(appointment)
+    Appointment.objects.bulk_update(filled, ['endTime'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_appointment_unauthorizedphone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='endTime',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Время окончания'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='duration',
+            field=models.PositiveIntegerField(default=60, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Длительность, мин'),
+        ),
+        migrations.RunPython(fill_end_time, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:07
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_auto_20261018_2005'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Стоимость товара'),
+        ),
+    ]
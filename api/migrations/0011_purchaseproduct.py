@@ -0,0 +1,58 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:08
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_unit_price(apps, schema_editor):
+    PurchaseProduct = apps.get_model('api', 'PurchaseProduct')
+    Product = apps.get_model('api', 'Product')
+    PurchaseProduct.objects.update(unitPrice=models.Subquery(
+        Product.objects.filter(pk=models.OuterRef('product_id')).values('price')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_product_price'),
+    ]
+
+    operations = [
+        # таблица api_purchase_products уже создана для M2M,
+        # промежуточная модель переиспользует её
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PurchaseProduct',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.product', verbose_name='Товар')),
+                        ('purchase', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='api.purchase', verbose_name='Покупка')),
+                    ],
+                    options={
+                        'verbose_name': 'товар в покупке',
+                        'verbose_name_plural': 'товары в покупке',
+                        'db_table': 'api_purchase_products',
+                        'unique_together': {('purchase', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='purchase',
+                    name='products',
+                    field=models.ManyToManyField(through='api.PurchaseProduct', to='api.Product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='purchaseproduct',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество'),
+        ),
+        migrations.AddField(
+            model_name='purchaseproduct',
+            name='unitPrice',
+            field=models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Цена за единицу'),
+        ),
+        migrations.RunPython(fill_unit_price, migrations.RunPython.noop),
+    ]
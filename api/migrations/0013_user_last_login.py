@@ -0,0 +1,18 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_login',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Был в сети'),
+        ),
+    ]
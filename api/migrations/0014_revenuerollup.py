@@ -0,0 +1,31 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_user_last_login'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'день'), ('month', 'месяц')], max_length=10, verbose_name='Период')),
+                ('periodStart', models.DateField(verbose_name='Начало периода')),
+                ('dimension', models.CharField(choices=[('service', 'услуга'), ('serviceGroup', 'группа услуг'), ('employee', 'сотрудник'), ('product', 'товар')], max_length=20, verbose_name='Разрез')),
+                ('objectId', models.PositiveIntegerField(default=0, verbose_name='Объект')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='Выручка')),
+                ('commission', models.BigIntegerField(default=0, verbose_name='Сотруднику')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+            ],
+            options={
+                'verbose_name': 'сводка выручки',
+                'verbose_name_plural': 'сводки выручки',
+                'unique_together': {('period', 'dimension', 'periodStart', 'objectId')},
+            },
+        ),
+    ]
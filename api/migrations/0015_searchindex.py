@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# таблица индекса не описывается моделью: у FTS5 и tsvector нет полей Django
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE api_searchindex USING fts5("
+        "visible UNINDEXED, title, body, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    ],
+    'postgresql': [
+        "CREATE TABLE api_searchindex ("
+        "id bigint PRIMARY KEY, visible boolean NOT NULL, document tsvector NOT NULL)",
+        "CREATE INDEX api_searchindex_document ON api_searchindex USING gin (document)",
+    ],
+}
+
+
+def create_index(apps, schema_editor):
+    for sql in CREATE_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute("DROP TABLE api_searchindex")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_revenuerollup'),
+    ]
+
+    operations = [
+        # индекс заполняет manage.py rebuild_search_index: нормализация текста
+        # живёт в api.search и меняется, а миграция должна работать и потом
+        migrations.RunPython(create_index, drop_index),
+    ]
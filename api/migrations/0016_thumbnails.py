@@ -0,0 +1,43 @@
+# Generated by Django 3.1.5 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_searchindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='photoThumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+        migrations.AddField(
+            model_name='news',
+            name='imageThumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='photoThumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+        migrations.AddField(
+            model_name='producttype',
+            name='imageThumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='imageThumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+        migrations.AddField(
+            model_name='servicegroup',
+            name='imageThumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Миниатюры'),
+        ),
+    ]
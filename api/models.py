@@ -23,6 +23,9 @@ class News(models.Model):
         verbose_name="Описание новости", blank=True)
     image = models.ImageField(
         verbose_name="Картинка новости", null=True, blank=True)
+    # имена миниатюр по размерам и форматам, заполняет api.thumbnails
+    imageThumbnails = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Миниатюры")
 
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=DRAFT,
                               verbose_name="Статус новости")
@@ -36,6 +39,10 @@ class News(models.Model):
     class Meta:
         verbose_name = "новость"
         verbose_name_plural = "новости"
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='news_status_created_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -70,6 +77,8 @@ class ProductType(models.Model):
         verbose_name="Описание типа", blank=True)
     image = models.ImageField(
         verbose_name="Картинка типа товаров", null=True, blank=True)
+    imageThumbnails = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Миниатюры")
 
     class Meta:
         verbose_name = "тип товаров"
@@ -93,8 +102,12 @@ class Product(models.Model):
         verbose_name="Описание товара", blank=True)
     photo = models.ImageField(
         verbose_name="Картинка товара", null=True, blank=True)
+    photoThumbnails = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Миниатюры")
     countLeft = models.IntegerField(
         default=0, validators=[MinValueValidator(0)], verbose_name="Кол-во в наличии")
+    price = models.IntegerField(
+        default=0, validators=[MinValueValidator(0)], verbose_name="Стоимость товара")
 
     class Meta:
         verbose_name = "товар"
@@ -159,7 +172,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(verbose_name="email", max_length=60, unique=True)
     date_joined = models.DateTimeField(
         auto_now_add=True, verbose_name="Зарегистрировался")
-    last_login = models.DateTimeField(auto_now=True, verbose_name="Был в сети")
+    last_login = models.DateTimeField(null=True, blank=True, verbose_name="Был в сети")
     is_admin = models.BooleanField(
         default=False, verbose_name="Может вносить изменения в данные")
     is_active = models.BooleanField(default=True)
@@ -182,6 +195,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = "пользователь"
         verbose_name_plural = "пользователи"
+        indexes = [
+            models.Index(fields=['userType'], name='user_type_idx'),
+        ]
 
     def __str__(self):
         return self.name + ' ' + self.surname
@@ -204,6 +220,8 @@ class ServiceGroup(models.Model):
         verbose_name="Описание группы услуг", blank=True)
     image = models.ImageField(
         verbose_name="Картинка группы", null=True, blank=True)
+    imageThumbnails = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Миниатюры")
 
     class Meta:
         verbose_name = "группа услуг"
@@ -260,10 +278,14 @@ class Service(models.Model):
         verbose_name="Описание услуг", blank=True)
     image = models.ImageField(
         verbose_name="Картинка услуги", null=True, blank=True)
+    imageThumbnails = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Миниатюры")
     price = models.IntegerField(
         default=0, verbose_name="Стоимость услуги")
     percToEmpl = models.IntegerField(
         default=0, validators=[MinValueValidator(0)], verbose_name="Процент сотруднику")
+    duration = models.PositiveIntegerField(
+        default=60, validators=[MinValueValidator(1)], verbose_name="Длительность, мин")
 
     class Meta:
         verbose_name = "услуга"
@@ -303,6 +325,8 @@ class Employee(models.Model):
         WorkPosition, models.SET_NULL, verbose_name="Рабочее место", null=True, blank=True, )
     photo = models.ImageField(
         verbose_name="Фото сотрудника", blank=True, null=True)
+    photoThumbnails = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="Миниатюры")
     birthdate = models.DateField(
         verbose_name="Дата рождения",)
     phone = PhoneNumberField(
@@ -315,6 +339,9 @@ class Employee(models.Model):
     class Meta:
         verbose_name = "сотрудник"
         verbose_name_plural = "сотрудники"
+        indexes = [
+            models.Index(fields=['employeeStatus'], name='employee_status_idx'),
+        ]
 
     def __str__(self):
         return str(self.user)
@@ -395,10 +422,21 @@ class Appointment(models.Model):
         auto_now_add=True, verbose_name="Время оформления")
     scheduledTime = models.DateTimeField(
         verbose_name="Назначенное время", null=True, blank=True,)
+    endTime = models.DateTimeField(
+        verbose_name="Время окончания", null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "запись"
         verbose_name_plural = "записи"
+        indexes = [
+            models.Index(fields=['employee', 'scheduledTime'],
+                         name='appointment_employee_time_idx'),
+            models.Index(fields=['appointmentStatus', 'scheduledTime'],
+                         name='appointment_status_time_idx'),
+            models.Index(fields=['scheduledTime'], name='appointment_time_idx'),
+            models.Index(fields=['created_at', 'id'],
+                         name='appointment_created_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -417,7 +455,7 @@ class Purchase(models.Model):
         (IN_PROGRESS, 'обработка'),
         (COMPLETED, 'выполнена'),
     )
-    products = models.ManyToManyField(Product)
+    products = models.ManyToManyField(Product, through='PurchaseProduct')
     client = models.ForeignKey(
         Client, models.SET_NULL, verbose_name="Клиент", null=True, blank=True, )
     discount = models.ForeignKey(
@@ -434,6 +472,77 @@ class Purchase(models.Model):
     class Meta:
         verbose_name = "покупка"
         verbose_name_plural = "покупки"
+        indexes = [
+            models.Index(fields=['purchaseStatus', 'created_at'],
+                         name='purchase_status_created_idx'),
+            models.Index(fields=['created_at', 'id'],
+                         name='purchase_created_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
+
+
+class PurchaseProduct(models.Model):
+    purchase = models.ForeignKey(
+        Purchase, models.CASCADE, related_name="items", verbose_name="Покупка")
+    product = models.ForeignKey(
+        Product, models.CASCADE, verbose_name="Товар")
+    quantity = models.PositiveIntegerField(
+        default=1, validators=[MinValueValidator(1)], verbose_name="Количество")
+    unitPrice = models.IntegerField(
+        null=True, blank=True, validators=[MinValueValidator(0)], verbose_name="Цена за единицу")
+
+    class Meta:
+        db_table = "api_purchase_products"
+        unique_together = ("purchase", "product")
+        verbose_name = "товар в покупке"
+        verbose_name_plural = "товары в покупке"
+
+    def __str__(self):
+        return str(self.product_id) + " x" + str(self.quantity)
+
+    def save(self, *args, **kwargs):
+        if self.unitPrice is None:
+            self.unitPrice = Product.objects.values_list(
+                'price', flat=True).get(pk=self.product_id)
+        super().save(*args, **kwargs)
+
+
+# ============================================
+# ОТЧЁТЫ
+# ============================================
+
+class RevenueRollup(models.Model):
+    DAY = 'day'
+    MONTH = 'month'
+    PERIOD_CHOICES = (
+        (DAY, 'день'),
+        (MONTH, 'месяц'),
+    )
+    SERVICE = 'service'
+    SERVICE_GROUP = 'serviceGroup'
+    EMPLOYEE = 'employee'
+    PRODUCT = 'product'
+    DIMENSION_CHOICES = (
+        (SERVICE, 'услуга'),
+        (SERVICE_GROUP, 'группа услуг'),
+        (EMPLOYEE, 'сотрудник'),
+        (PRODUCT, 'товар'),
+    )
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES, verbose_name="Период")
+    periodStart = models.DateField(verbose_name="Начало периода")
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES, verbose_name="Разрез")
+    # 0 — без группы или без сотрудника
+    objectId = models.PositiveIntegerField(default=0, verbose_name="Объект")
+    revenue = models.BigIntegerField(default=0, verbose_name="Выручка")
+    commission = models.BigIntegerField(default=0, verbose_name="Сотруднику")
+    count = models.PositiveIntegerField(default=0, verbose_name="Заказов")
+
+    class Meta:
+        verbose_name = "сводка выручки"
+        verbose_name_plural = "сводки выручки"
+        unique_together = ("period", "dimension", "periodStart", "objectId")
+
+    def __str__(self):
+        return '%s %s %s #%s' % (self.period, self.periodStart, self.dimension, self.objectId)
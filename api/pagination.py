@@ -0,0 +1,97 @@
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+# ============================================
+# ПАГИНАЦИЯ
+# ============================================
+
+class IdCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-id',)
+
+
+def reverse_ordering(ordering):
+    return tuple(name[1:] if name.startswith('-') else '-' + name for name in ordering)
+
+
+class KeysetCursorPagination(IdCursorPagination):
+    """
+    Курсор DRF хранит только первое поле ordering и смещение среди записей
+    с тем же значением, и на длинных сериях одинаковых значений страница
+    перечитывает их заново. Здесь позиция — значения всех полей ordering,
+    а следующая страница выбирается условием (a < x) OR (a = x AND b < y)
+    по составному индексу без смещения. Последнее поле должно быть
+    уникальным, тогда позиции записей не совпадают.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self.cursor.position if self.cursor else None
+
+        ordering = reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(ordering, self.parse_position(position)))
+            except (ValidationError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) \
+            if len(results) > len(self.page) else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def parse_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def after(self, ordering, values):
+        names = [name.lstrip('-') for name in ordering]
+        conditions = []
+        for index, name in enumerate(ordering):
+            lookup = '%s__%s' % (names[index], 'lt' if name.startswith('-') else 'gt')
+            equal = dict(zip(names[:index], values[:index]))
+            conditions.append(Q(**equal, **{lookup: values[index]}))
+        return reduce(lambda left, right: left | right, conditions)
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [instance[name.lstrip('-')] if isinstance(instance, dict)
+                  else getattr(instance, name.lstrip('-')) for name in ordering]
+        return json.dumps([str(value) for value in values])
+
+
+class CreatedAtCursorPagination(KeysetCursorPagination):
+    # индексы (created_at, id) из 0012 покрывают условие курсора
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,144 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+
+from .models import Product, Service, Appointment, Purchase, PurchaseProduct
+
+
+# записи и покупки, цена которых ещё может меняться
+OPEN_APPOINTMENT_STATUSES = (Appointment.EMPLOYEE_WAITING, Appointment.IN_PROGRESS)
+OPEN_PURCHASE_STATUSES = (Purchase.IN_PROGRESS,)
+
+
+# ============================================
+# КЭШ ЦЕН
+# ============================================
+
+# Цены кэшируются поштучно: расчёт читает только свои услуги или товары,
+# а не весь каталог. Срок жизни ограничен PRICE_CACHE_TIMEOUT — на
+# локальном кэше это предел, за который изменение цены доходит до
+# остальных процессов.
+
+def get_cache():
+    return caches[settings.PRICE_CACHE_ALIAS]
+
+
+def price_key(model, pk):
+    return 'pricing:%s:%s' % (model._meta.model_name, pk)
+
+
+def get_prices(model, ids):
+    """
+    {id: цена} для ids: промахи кэша читаются одним запросом.
+    """
+    keys = {price_key(model, pk): pk for pk in set(ids)}
+    cache = get_cache()
+    prices = {keys[key]: price for key, price in cache.get_many(list(keys)).items()}
+    missing = set(keys.values()) - set(prices)
+    if missing:
+        loaded = dict(model.objects.filter(pk__in=missing).values_list('id', 'price'))
+        cache.set_many({price_key(model, pk): price for pk, price in loaded.items()},
+                       settings.PRICE_CACHE_TIMEOUT)
+        prices.update(loaded)
+    return prices
+
+
+def invalidate_prices(model, ids):
+    keys = [price_key(model, pk) for pk in ids]
+    if not keys:
+        return
+    get_cache().delete_many(keys)
+    # и ещё раз после фиксации: иначе параллельный запрос успеет положить
+    # в кэш цену, прочитанную до неё
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+# ============================================
+# РАСЧЁТ СТОИМОСТИ
+# ============================================
+
+def apply_discount(subtotal, discount_amount):
+    return (subtotal or 0) * (100 - (discount_amount or 0)) // 100
+
+
+def get_discount_amount(discount):
+    return discount.discountAmount if discount is not None else 0
+
+
+def get_appointment_price(service_ids, discount=None):
+    prices = get_prices(Service, service_ids)
+    subtotal = sum(prices.get(service_id, 0) for service_id in service_ids)
+    return apply_discount(subtotal, get_discount_amount(discount))
+
+
+def get_purchase_price(items, discount=None):
+    """
+    items — пары (id товара, количество).
+    """
+    items = list(items)
+    prices = get_prices(Product, [product_id for product_id, _ in items])
+    subtotal = sum(prices.get(product_id, 0) * quantity
+                   for product_id, quantity in items)
+    return apply_discount(subtotal, get_discount_amount(discount))
+
+
+def calculate_totals(queryset, price_lookup):
+    """
+    Одним запросом с GROUP BY считает [(id, новая стоимость, текущая стоимость)].
+    """
+    rows = queryset \
+        .annotate(subtotal=Sum(price_lookup)) \
+        .values_list('id', 'subtotal', 'discount__discountAmount', 'fullPrice')
+    return [(pk, apply_discount(subtotal, discount_amount), full_price)
+            for pk, subtotal, discount_amount, full_price in rows]
+
+
+def recalculate(queryset, price_lookup, batch_size=1000):
+    model = queryset.model
+    changed = [model(id=pk, fullPrice=total)
+               for pk, total, full_price in calculate_totals(queryset, price_lookup)
+               if total != full_price]
+    model.objects.bulk_update(changed, ['fullPrice'], batch_size=batch_size)
+    return len(changed)
+
+
+def recalculate_appointments(queryset):
+    return recalculate(queryset, 'services__price')
+
+
+def recalculate_purchases(queryset):
+    return recalculate(queryset, F('items__quantity') * F('items__unitPrice'))
+
+
+# фильтр по услуге идёт подзапросом: иначе Sum() посчитал бы
+# только эту услугу из общего JOIN
+def recalculate_open_orders_for_service(service):
+    return recalculate_open_orders_for_services([service.pk])
+
+
+def recalculate_open_orders_for_services(service_ids):
+    return recalculate_appointments(Appointment.objects.filter(
+        pk__in=Appointment.objects.filter(services__in=service_ids).values('pk'),
+        appointmentStatus__in=OPEN_APPOINTMENT_STATUSES))
+
+
+def recalculate_open_orders_for_product(product):
+    return recalculate_open_orders_for_products([product.pk])
+
+
+def recalculate_open_orders_for_products(product_ids):
+    open_purchases = Purchase.objects.filter(
+        pk__in=Purchase.objects.filter(products__in=product_ids).values('pk'),
+        purchaseStatus__in=OPEN_PURCHASE_STATUSES)
+    fill_unit_prices(PurchaseProduct.objects.filter(
+        product__in=product_ids, purchase__in=open_purchases))
+    return recalculate_purchases(open_purchases)
+
+
+def fill_unit_prices(items):
+    """
+    Проставляет строкам покупок текущую цену товара одним UPDATE.
+    """
+    return items.update(unitPrice=Subquery(
+        Product.objects.filter(pk=OuterRef('product')).values('price')[:1]))
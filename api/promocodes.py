@@ -0,0 +1,79 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Discount
+
+
+# ============================================
+# ПРОМОКОДЫ
+# ============================================
+
+# Словари промокодов хранятся в каждом процессе, а их версия — в кэше
+# PROMO_CODES_CACHE_ALIAS. На общем кэше изменение скидки в одном процессе
+# сразу сбрасывает словари во всех остальных; на локальном остальные
+# процессы перечитывают промокоды не позже чем через PROMO_CODES_TIMEOUT.
+# Версия случайная: после вытеснения ключа из кэша словари тоже перечитываются
+VERSION_KEY = 'promocodes:version'
+
+_lock = threading.Lock()
+_promo_codes = {}
+_version = None
+_loaded_at = 0
+
+
+def get_cache():
+    return caches[settings.PROMO_CODES_CACHE_ALIAS]
+
+
+def get_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def is_stale(version):
+    return version != _version or \
+        time.monotonic() - _loaded_at >= settings.PROMO_CODES_TIMEOUT
+
+
+def load_promo_codes():
+    return {promo_code: Discount(id=pk, discountAmount=amount, promoCode=promo_code)
+            for pk, amount, promo_code
+            in Discount.objects.values_list('id', 'discountAmount', 'promoCode')}
+
+
+def get_promo_codes():
+    global _promo_codes, _version, _loaded_at
+    version = get_version()
+    if is_stale(version):
+        with _lock:
+            if is_stale(version):
+                _promo_codes = load_promo_codes()
+                _version = version
+                _loaded_at = time.monotonic()
+    return _promo_codes
+
+
+def get_discount(promo_code):
+    return get_promo_codes().get((promo_code or '').strip().upper())
+
+
+def bump_version():
+    global _version
+    get_cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+    _version = None
+
+
+def invalidate_promo_codes():
+    # и ещё раз после фиксации: иначе параллельный запрос успеет
+    # загрузить промокоды, прочитанные до неё, под новой версией
+    bump_version()
+    transaction.on_commit(bump_version)
@@ -0,0 +1,198 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+
+
+# ============================================
+# ПЛАНИРОВЩИК ЗАПРОСОВ
+# ============================================
+
+class QueryPlan:
+    """
+    Набор select_related / prefetch_related / only(), нужный сериализатору,
+    чтобы отрисовать список за постоянное число запросов.
+    """
+
+    def __init__(self):
+        self.select = []
+        self.prefetch = []
+        self.only = []
+        self.deferrable = True
+
+    def merge(self, other, prefix):
+        self.select += [prefix + path for path in other.select]
+        self.prefetch += [(prefix + lookup, model, plan)
+                          for lookup, model, plan in other.prefetch]
+        self.only += [prefix + name for name in other.only]
+        self.deferrable = self.deferrable and other.deferrable
+
+    def apply(self, queryset, defer=True, extra_only=()):
+        if self.select:
+            queryset = queryset.select_related(*self.select)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*[
+                Prefetch(lookup, queryset=plan.apply(
+                    model._default_manager.all(), defer=defer))
+                for lookup, model, plan in self.prefetch])
+        if defer and self.deferrable and self.only:
+            queryset = queryset.only(*self.only, *extra_only)
+        return queryset
+
+
+def _nested_serializer(field):
+    if isinstance(field, serializers.ListSerializer):
+        return field.child, True
+    if isinstance(field, serializers.BaseSerializer):
+        return field, False
+    return None, False
+
+
+def build_query_plan(serializer, model):
+    plan = QueryPlan()
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        nested, many = _nested_serializer(field)
+
+        if not field.source_attrs:
+            # source='*' — вложенный сериализатор читает тот же объект
+            if nested is not None:
+                plan.merge(build_query_plan(nested, model), '')
+            else:
+                plan.deferrable = False
+            continue
+
+        if len(field.source_attrs) > 1:
+            plan.deferrable = False
+            continue
+
+        name = field.source_attrs[0]
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # свойство или метод модели: неизвестно, какие колонки нужны
+            plan.deferrable = False
+            continue
+
+        if not model_field.is_relation:
+            plan.only.append(name)
+            continue
+
+        related_model = model_field.related_model
+
+        if model_field.many_to_many or model_field.one_to_many:
+            if nested is not None:
+                child = build_query_plan(nested, related_model)
+            elif isinstance(field, ManyRelatedField):
+                child = QueryPlan()
+                child.only.append(related_model._meta.pk.name)
+            else:
+                plan.deferrable = False
+                continue
+            if model_field.one_to_many:
+                # обратный внешний ключ нужен для сопоставления строк
+                child.only.append(model_field.field.name)
+            plan.prefetch.append((name, related_model, child))
+            continue
+
+        if nested is not None and not many:
+            plan.select.append(name)
+            if model_field.concrete:
+                plan.only.append(name)
+            plan.merge(build_query_plan(nested, related_model), name + '__')
+        elif isinstance(field, PrimaryKeyRelatedField) and model_field.concrete:
+            plan.only.append(name)
+        else:
+            plan.select.append(name)
+            plan.deferrable = False
+
+    return plan
+
+
+_query_plans = {}
+
+
+def get_query_plan(serializer_class, model, **sparse):
+    key = (serializer_class, model, tuple(sorted(sparse.items())))
+    plan = _query_plans.get(key)
+    if plan is None:
+        plan = build_query_plan(serializer_class(**sparse), model)
+        _query_plans[key] = plan
+    return plan
+
+
+# ============================================
+# ПОЛЯ ПО ЗАПРОСУ
+# ============================================
+
+class SparseFieldsMixin:
+    """
+    fields оставляет в сериализаторе только перечисленные поля, expand
+    подставляет вложенный объект из expandable вместо id связи. План
+    запроса строится по уже урезанному сериализатору, поэтому лишние
+    колонки не читаются, а раскрытые связи приходят тем же запросом.
+    """
+    expandable = {}
+
+    def __init__(self, *args, fields=(), expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        unknown = set(expand) - set(self.expandable)
+        if unknown:
+            raise ValidationError({'expand': 'Нельзя раскрыть: %s' % ', '.join(sorted(unknown))})
+        opts = self.Meta.model._meta
+        for name in expand:
+            model_field = opts.get_field(name)
+            self.fields[name] = self.expandable[name](
+                read_only=True, many=model_field.many_to_many or model_field.one_to_many)
+        if fields:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise ValidationError({'fields': 'Нет полей: %s' % ', '.join(sorted(unknown))})
+            for name in list(self.fields):
+                if name not in fields and name not in expand:
+                    self.fields.pop(name)
+
+
+class QueryPlannerMixin:
+    """
+    Строит queryset по дереву сериализатора, выбранного в get_serializer_class.
+    only() применяется только к действиям из planned_actions: при изменении
+    объекта нужны все поля модели.
+    """
+    planned_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        """
+        ?fields= и ?expand= через запятую; действуют только на чтение.
+        """
+        request = getattr(self, 'request', None)
+        if request is None or self.action not in self.planned_actions \
+                or not issubclass(self.get_serializer_class(), SparseFieldsMixin):
+            return {}
+        sparse = {}
+        for param in ('fields', 'expand'):
+            names = {name.strip() for name in request.query_params.get(param, '').split(',')}
+            names.discard('')
+            if names:
+                sparse[param] = tuple(sorted(names))
+        return sparse
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_sparse_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_query_plan(self, serializer_class):
+        return get_query_plan(serializer_class, self.queryset.model, **self.get_sparse_fields())
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        plan = self.get_query_plan(self.get_serializer_class())
+        # поля сортировки пагинатора читаются из каждой строки для курсора
+        ordering = [name.lstrip('-')
+                    for name in getattr(self.paginator, 'ordering', None) or ()]
+        return plan.apply(queryset, defer=self.action in self.planned_actions,
+                          extra_only=ordering)
@@ -0,0 +1,283 @@
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Max, Min, Q, Sum
+from django.utils import timezone
+
+from .models import ServiceGroup, Service, Employee, Product, Appointment, Purchase, \
+    PurchaseProduct, RevenueRollup
+
+
+# ============================================
+# СВОДКИ ВЫРУЧКИ
+# ============================================
+
+# Сводки пересчитываются по дням: любое изменение выполненной записи или
+# покупки пересчитывает её день из исходных строк (по индексу статус+время),
+# а месяц — из дневных сводок. Повторный пересчёт безопасен, поэтому
+# порядок и число сигналов не важны.
+
+def local_day(value):
+    return timezone.localtime(value).date()
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+    return start, start + datetime.timedelta(days=1)
+
+
+def appointment_day(scheduled_time, created_at):
+    return local_day(scheduled_time or created_at)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def split(total, weights):
+    """
+    Делит total пропорционально weights целыми частями без потери копеек.
+    """
+    if not weights:
+        return []
+    weight_sum = sum(weights)
+    if not weight_sum:
+        weights, weight_sum = [1] * len(weights), len(weights)
+    shares = [total * weight // weight_sum for weight in weights]
+    shares[-1] += total - sum(shares)
+    return shares
+
+
+class DayTotals:
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: {'revenue': 0, 'commission': 0, 'orders': set()})
+
+    def add(self, dimension, object_id, order, revenue, commission=0):
+        row = self.rows[dimension, object_id or 0]
+        row['revenue'] += revenue
+        row['commission'] += commission
+        row['orders'].add(order)
+
+    def rollups(self, day):
+        return [(day, dimension, object_id, row['revenue'], row['commission'], len(row['orders']))
+                for (dimension, object_id), row in self.rows.items()]
+
+
+def add_appointments(days, start, end):
+    completed = Appointment.objects \
+        .filter(appointmentStatus=Appointment.COMPLETED) \
+        .filter(Q(scheduledTime__gte=start, scheduledTime__lt=end) |
+                Q(scheduledTime__isnull=True, created_at__gte=start, created_at__lt=end))
+    # цены услуг в записи не фиксируются, поэтому fullPrice делится по
+    # текущим ценам: сумма по записи и сотруднику точная, а доли услуг после
+    # смены цены пересчитываются по новому соотношению — так и задумано
+    services = defaultdict(list)
+    for row in (Appointment.services.through.objects
+                .filter(appointment__in=completed.values('pk'))
+                .values_list('appointment_id', 'service_id', 'service__price',
+                             'service__percToEmpl', 'service__serviceGroup_id')):
+        services[row[0]].append(row[1:])
+
+    for appointment_id, full_price, employee_id, scheduled_time, created_at in \
+            completed.values_list('id', 'fullPrice', 'employee_id', 'scheduledTime', 'created_at'):
+        totals = days[appointment_day(scheduled_time, created_at)]
+        lines = services[appointment_id]
+        commission = 0
+        for (service_id, price, percent, group_id), share in zip(
+                lines, split(full_price, [line[1] for line in lines])):
+            service_commission = share * percent // 100
+            commission += service_commission
+            totals.add(RevenueRollup.SERVICE, service_id, appointment_id, share, service_commission)
+            totals.add(RevenueRollup.SERVICE_GROUP, group_id, appointment_id, share,
+                       service_commission)
+        totals.add(RevenueRollup.EMPLOYEE, employee_id, appointment_id, full_price, commission)
+
+
+def add_purchases(days, start, end):
+    completed = Purchase.objects.filter(purchaseStatus=Purchase.COMPLETED,
+                                        created_at__gte=start, created_at__lt=end)
+    items = defaultdict(list)
+    for purchase_id, product_id, quantity, unit_price in (
+            PurchaseProduct.objects
+            .filter(purchase__in=completed.values('pk'))
+            .values_list('purchase_id', 'product_id', 'quantity', 'unitPrice')):
+        items[purchase_id].append((product_id, quantity * (unit_price or 0)))
+
+    for purchase_id, full_price, created_at in completed.values_list('id', 'fullPrice', 'created_at'):
+        totals = days[local_day(created_at)]
+        lines = items[purchase_id]
+        for (product_id, _), share in zip(lines, split(full_price, [line[1] for line in lines])):
+            totals.add(RevenueRollup.PRODUCT, product_id, purchase_id, share)
+
+
+def collect(first_day, last_day):
+    """
+    Считает дневные сводки за дни first_day..last_day четырьмя запросами.
+    """
+    days = defaultdict(DayTotals)
+    start, _ = day_bounds(first_day)
+    _, end = day_bounds(last_day)
+    add_appointments(days, start, end)
+    add_purchases(days, start, end)
+    return [row for day, totals in days.items() for row in totals.rollups(day)]
+
+
+def rollup_sql(statement):
+    quote = connection.ops.quote_name
+    opts = RevenueRollup._meta
+    return statement.format(table=quote(opts.db_table), **{
+        field.name: quote(field.column) for field in opts.concrete_fields})
+
+
+# сводки пишутся сырым SQL: на полной истории это сотни тысяч строк, и
+# сборка bulk_create занимает больше времени, чем сама запись
+INSERT_DAYS = """
+    INSERT INTO {table} ({period}, {periodStart}, {dimension}, {objectId},
+                         {revenue}, {commission}, {count})
+    VALUES (%s, %s, %s, %s, %s, %s, %s)"""
+
+INSERT_MONTH = """
+    INSERT INTO {table} ({period}, {periodStart}, {dimension}, {objectId},
+                         {revenue}, {commission}, {count})
+    SELECT %s, %s, {dimension}, {objectId}, SUM({revenue}), SUM({commission}), SUM({count})
+    FROM {table}
+    WHERE {period} = %s AND {periodStart} >= %s AND {periodStart} < %s
+    GROUP BY {dimension}, {objectId}"""
+
+
+def save_days(days, rows):
+    adapt = connection.ops.adapt_datefield_value
+    RevenueRollup.objects.filter(period=RevenueRollup.DAY, periodStart__in=days).delete()
+    with connection.cursor() as cursor:
+        cursor.executemany(rollup_sql(INSERT_DAYS), [
+            (RevenueRollup.DAY, adapt(day), *values) for day, *values in rows])
+    rebuild_months({month_start(day) for day in days})
+
+
+def rebuild_days(days):
+    days = set(day for day in days if day is not None)
+    if not days:
+        return
+    with transaction.atomic():
+        rows = []
+        for day in days:
+            rows += collect(day, day)
+        save_days(days, rows)
+
+
+def rebuild_months(months):
+    adapt = connection.ops.adapt_datefield_value
+    RevenueRollup.objects.filter(period=RevenueRollup.MONTH, periodStart__in=months).delete()
+    with connection.cursor() as cursor:
+        for month in months:
+            next_month = month_start(month + datetime.timedelta(days=31))
+            cursor.execute(rollup_sql(INSERT_MONTH), [
+                RevenueRollup.MONTH, adapt(month), RevenueRollup.DAY,
+                adapt(month), adapt(next_month)])
+
+
+def rebuild_appointments(appointment_ids):
+    rebuild_days(appointment_day(scheduled_time, created_at) for scheduled_time, created_at in
+                 Appointment.objects.filter(pk__in=appointment_ids)
+                 .values_list('scheduledTime', 'created_at'))
+
+
+def rebuild_purchases(purchase_ids):
+    rebuild_days(local_day(created_at) for created_at in
+                 Purchase.objects.filter(pk__in=purchase_ids)
+                 .values_list('created_at', flat=True))
+
+
+def rebuild_range(date_from, date_to):
+    """
+    Полный пересчёт периода: исходные строки читаются помесячно, а не по
+    дням, поэтому годы истории пересчитываются за секунды.
+    """
+    with transaction.atomic():
+        month = date_from
+        while month <= date_to:
+            last_day = min(month_start(month + datetime.timedelta(days=31)) -
+                           datetime.timedelta(days=1), date_to)
+            days = [month + datetime.timedelta(days=offset)
+                    for offset in range((last_day - month).days + 1)]
+            save_days(days, collect(month, last_day))
+            month = last_day + datetime.timedelta(days=1)
+    return (date_to - date_from).days + 1
+
+
+def get_data_range():
+    """
+    Первый и последний день, в которые есть записи или покупки.
+    """
+    bounds = [value for row in (
+        Appointment.objects.aggregate(Min('scheduledTime'), Max('scheduledTime'),
+                                      Min('created_at'), Max('created_at')),
+        Purchase.objects.aggregate(Min('created_at'), Max('created_at')),
+    ) for value in row.values() if value is not None]
+    if not bounds:
+        return None, None
+    return local_day(min(bounds)), local_day(max(bounds))
+
+
+# ============================================
+# ЗАПРОСЫ ПО ДИАПАЗОНУ
+# ============================================
+
+TITLE_MODELS = {
+    RevenueRollup.SERVICE: Service,
+    RevenueRollup.SERVICE_GROUP: ServiceGroup,
+    RevenueRollup.EMPLOYEE: Employee,
+    RevenueRollup.PRODUCT: Product,
+}
+
+
+def range_filter(date_from, date_to):
+    """
+    Полные месяцы диапазона берутся из месячных сводок, края — из дневных.
+    """
+    first_month = month_start(date_from)
+    if first_month != date_from:
+        first_month = month_start(first_month + datetime.timedelta(days=31))
+    last_month = month_start(date_to + datetime.timedelta(days=1))
+    if first_month >= last_month:
+        return Q(period=RevenueRollup.DAY, periodStart__gte=date_from, periodStart__lte=date_to)
+    return Q(period=RevenueRollup.MONTH, periodStart__gte=first_month, periodStart__lt=last_month) | \
+        Q(period=RevenueRollup.DAY, periodStart__gte=date_from, periodStart__lt=first_month) | \
+        Q(period=RevenueRollup.DAY, periodStart__gte=last_month, periodStart__lte=date_to)
+
+
+def with_titles(dimension, rows):
+    objects = TITLE_MODELS[dimension].objects.all()
+    if dimension == RevenueRollup.EMPLOYEE:
+        objects = objects.select_related('user')
+    objects = objects.in_bulk([row['objectId'] for row in rows if row['objectId']])
+    for row in rows:
+        obj = objects.get(row['objectId'])
+        row['title'] = str(obj) if obj is not None else None
+    return rows
+
+
+def get_totals(dimension, date_from, date_to):
+    rows = (RevenueRollup.objects
+            .filter(range_filter(date_from, date_to), dimension=dimension)
+            .values('objectId')
+            .annotate(revenue_sum=Sum('revenue'), commission_sum=Sum('commission'),
+                      count_sum=Sum('count'))
+            .order_by('-revenue_sum', 'objectId'))
+    return with_titles(dimension, [
+        {'objectId': row['objectId'], 'revenue': row['revenue_sum'],
+         'commission': row['commission_sum'], 'count': row['count_sum']}
+        for row in rows])
+
+
+def get_series(dimension, period, date_from, date_to):
+    if period == RevenueRollup.MONTH:
+        date_from = month_start(date_from)
+    rows = list(RevenueRollup.objects
+                .filter(dimension=dimension, period=period,
+                        periodStart__gte=date_from, periodStart__lte=date_to)
+                .values('periodStart', 'objectId', 'revenue', 'commission', 'count')
+                .order_by('periodStart', '-revenue', 'objectId'))
+    return with_titles(dimension, rows)
@@ -0,0 +1,325 @@
+import copy
+import logging
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import News, Product, Service
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# НОРМАЛИЗАЦИЯ ТЕКСТА
+# ============================================
+
+# Лёгкий стеммер для русского: отрезает самое длинное окончание, оставляя
+# основу не короче трёх букв. Индекс хранит основы, а запрос ищет их как
+# префиксы, поэтому «стрижки», «стрижкой» и «стрижка» находят друг друга.
+ENDINGS = sorted(set("""
+    а я о е ы и у ю ь й
+    ой ей ий ый ая яя ое ее ие ые ую юю ом ем ам ям ах ях ых их ым им ов ев ью ия ию
+    ому ему ого его ыми ими ами ями иям иях ией ость ости остью
+    ешь ет ете ут ют ит ат ят ишь ите ла ло ли ть ти ешься ется ются
+""".split()), key=len, reverse=True)
+
+WORD = re.compile(r'\w+')
+CYRILLIC = re.compile('[а-я]')
+DIGIT = re.compile(r'\d')
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC.search(word):
+        return word
+    if word.endswith(('ся', 'сь')) and len(word) > 5:
+        word = word[:-2]
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize(text):
+    return ' '.join(stem(word) for word in WORD.findall(text or ''))
+
+
+def query_terms(query):
+    return [stem(word) for word in WORD.findall(query or '')]
+
+
+# ============================================
+# ДОКУМЕНТЫ
+# ============================================
+
+class Source:
+    """
+    Что и как индексируется для модели: заголовок весит больше текста,
+    а visible отделяет то, что можно показывать в публичном поиске.
+    """
+
+    def __init__(self, kind, code, model, related=()):
+        self.kind = kind
+        self.code = code
+        self.model = model
+        self.related = related
+
+    def get_queryset(self):
+        return self.model.objects.select_related(*self.related)
+
+    def document(self, obj):
+        parts = [obj.description] + [getattr(obj, name).title for name in self.related
+                                     if getattr(obj, name)]
+        visible = obj.status == News.PUBLISHED if self.model is News else True
+        return obj.pk, obj.title, ' '.join(parts), visible
+
+
+SOURCES = {source.kind: source for source in (
+    Source('service', 1, Service, ('serviceGroup',)),
+    Source('product', 2, Product, ('productType',)),
+    Source('news', 3, News),
+)}
+MODEL_SOURCES = {source.model: source for source in SOURCES.values()}
+CODE_SOURCES = {source.code: source for source in SOURCES.values()}
+# rowid документа — id объекта и код модели, чтобы удалять по индексу
+CODE_BITS = 4
+CODE_MASK = (1 << CODE_BITS) - 1
+
+
+def document_id(source, pk):
+    return pk << CODE_BITS | source.code
+
+
+def split_document_id(rowid):
+    return CODE_SOURCES[rowid & CODE_MASK], rowid >> CODE_BITS
+
+
+# ============================================
+# ХРАНИЛИЩА ИНДЕКСА
+# ============================================
+
+class SQLiteSearchBackend:
+    """
+    Виртуальная таблица FTS5 с ранжированием bm25. Стемминг делает
+    normalize: у FTS5 нет русского стеммера.
+    """
+    table = 'api_searchindex'
+
+    def replace(self, source, documents):
+        documents = list(documents)
+        self.remove(source, [pk for pk, *_ in documents])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, visible, title, body) VALUES (%%s, %%s, %%s, %%s)' % self.table,
+                [(document_id(source, pk), int(visible), normalize(title), normalize(body))
+                 for pk, title, body, visible in documents])
+
+    def remove(self, source, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % self.table,
+                               [(document_id(source, pk),) for pk in ids])
+
+    def clear(self, source):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE (rowid & %%s) = %%s' % self.table,
+                           [CODE_MASK, source.code])
+
+    def search(self, terms, sources, public, limit):
+        # bm25 возвращает отрицательный ранг: чем меньше, тем лучше;
+        # веса по колонкам visible, title, body
+        sql = 'SELECT rowid, -bm25(%s, 0, 10, 1) FROM %s WHERE %s MATCH %%s' % (
+            (self.table,) * 3)
+        params = [' '.join('"%s"*' % term for term in terms)]
+        if public:
+            sql += ' AND visible = 1'
+        sql += ' AND (rowid & %s) IN (%s)' % (CODE_MASK, ', '.join(
+            str(source.code) for source in sources))
+        sql += ' ORDER BY bm25(%s, 0, 10, 1) LIMIT %%s' % self.table
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(*split_document_id(rowid), score) for rowid, score in cursor.fetchall()]
+
+    def ids_sql(self, terms, source, public):
+        sql = 'SELECT rowid >> %s FROM %s WHERE %s MATCH %%s AND (rowid & %s) = %s' % (
+            CODE_BITS, self.table, self.table, CODE_MASK, source.code)
+        if public:
+            sql += ' AND visible = 1'
+        return sql, [' '.join('"%s"*' % term for term in terms)]
+
+
+class PostgresSearchBackend:
+    """
+    Таблица с tsvector и GIN-индексом; морфологию даёт словарь russian.
+    """
+    table = 'api_searchindex'
+
+    def replace(self, source, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO {table} (id, visible, document) VALUES (%s, %s, "
+                "setweight(to_tsvector('russian', %s), 'A') || "
+                "setweight(to_tsvector('russian', %s), 'B')) "
+                "ON CONFLICT (id) DO UPDATE SET visible = EXCLUDED.visible, "
+                "document = EXCLUDED.document".format(table=self.table),
+                [(document_id(source, pk), visible, title, body)
+                 for pk, title, body, visible in documents])
+
+    def remove(self, source, ids):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE id = ANY(%%s)' % self.table,
+                           [[document_id(source, pk) for pk in ids]])
+
+    def clear(self, source):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE (id & %%s) = %%s' % self.table,
+                           [CODE_MASK, source.code])
+
+    def search(self, terms, sources, public, limit):
+        sql = "SELECT id, ts_rank(document, query) FROM {table}, to_tsquery('russian', %s) query " \
+              "WHERE document @@ query AND (id & %s) = ANY(%s)".format(table=self.table)
+        params = [' & '.join('%s:*' % term for term in terms), CODE_MASK,
+                  [source.code for source in sources]]
+        if public:
+            sql += ' AND visible'
+        sql += ' ORDER BY 2 DESC LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(*split_document_id(rowid), score) for rowid, score in cursor.fetchall()]
+
+    def ids_sql(self, terms, source, public):
+        sql = "SELECT id >> %s FROM {table} WHERE document @@ to_tsquery('russian', %s) " \
+              "AND (id & %s) = %s".format(table=self.table)
+        if public:
+            sql += ' AND visible'
+        return sql, [CODE_BITS, ' & '.join('%s:*' % term for term in terms), CODE_MASK, source.code]
+
+
+class NullSearchBackend:
+    """
+    Заглушка для баз без поискового индекса: сохранение каталога не
+    ломается, публичный поиск ничего не находит, а админка ищет обычным
+    поиском по search_fields.
+    """
+    indexed = False
+
+    def replace(self, source, documents):
+        pass
+
+    def remove(self, source, ids):
+        pass
+
+    def clear(self, source):
+        pass
+
+    def search(self, terms, sources, public, limit):
+        return []
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+warned_vendors = set()
+
+
+def get_backend():
+    if settings.SEARCH_BACKEND:
+        return import_string(settings.SEARCH_BACKEND)()
+    if connection.vendor not in BACKENDS:
+        if connection.vendor not in warned_vendors:
+            warned_vendors.add(connection.vendor)
+            logger.warning('Нет поискового индекса для базы %s, поиск отключён; '
+                           'укажите SEARCH_BACKEND', connection.vendor)
+        return NullSearchBackend()
+    return BACKENDS[connection.vendor]()
+
+
+# ============================================
+# ОБНОВЛЕНИЕ И ПОИСК
+# ============================================
+
+def index(objects):
+    by_source = defaultdict(list)
+    for obj in objects:
+        source = MODEL_SOURCES[type(obj)]
+        by_source[source].append(source.document(obj))
+    backend = get_backend()
+    for source, documents in by_source.items():
+        backend.replace(source, documents)
+
+
+def index_queryset(queryset):
+    source = MODEL_SOURCES[queryset.model]
+    get_backend().replace(source, (
+        source.document(obj) for obj in
+        queryset.select_related(*source.related).iterator(chunk_size=settings.SEARCH_BATCH_SIZE)))
+
+
+def remove(obj):
+    get_backend().remove(MODEL_SOURCES[type(obj)], [obj.pk])
+
+
+def rebuild(models=None):
+    """
+    Переиндексирует модели целиком, например после bulk_create без сигналов.
+    """
+    backend = get_backend()
+    for source in SOURCES.values():
+        if models is None or source.model in models:
+            backend.clear(source)
+            index_queryset(source.get_queryset())
+
+
+def search(query, kinds=None, public=True, limit=None):
+    """
+    Возвращает [(модель, id, вес)] по убыванию веса.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    sources = [SOURCES[kind] for kind in kinds] if kinds else list(SOURCES.values())
+    return [(source.model, pk, score) for source, pk, score in get_backend().search(
+        terms, sources, public, limit or settings.SEARCH_MAX_RESULTS)]
+
+
+def search_ids(model, query, public=False, limit=None):
+    return [pk for _, pk, _ in search(query, [MODEL_SOURCES[model].kind], public, limit)]
+
+
+def search_queryset(queryset, query, public=False):
+    """
+    Сужает queryset до найденных объектов без ограничения на их число:
+    индекс подставляется подзапросом, а не списком id.
+    """
+    sql, params = get_backend().ids_sql(query_terms(query), MODEL_SOURCES[queryset.model], public)
+    return queryset.filter(pk__in=RawSQL(sql, params))
+
+
+class FullTextSearchAdminMixin:
+    """
+    Поиск в списке админки: заголовок и описание ищутся по индексу вместо
+    icontains, остальные search_fields — обычным поиском админки. Запрос
+    с цифрами (артикул, телефон, объём) ищется обычным поиском по всем
+    полям: индекс находит слова только с начала, а номер вводят и куском.
+    """
+    indexed_search_fields = ('title', 'description')
+
+    def get_search_results(self, request, queryset, search_term):
+        terms = query_terms(search_term)
+        if not terms or any(DIGIT.search(term) for term in terms) \
+                or not getattr(get_backend(), 'indexed', True):
+            return super().get_search_results(request, queryset, search_term)
+        found = search_queryset(queryset, search_term)
+        plain = copy.copy(self)
+        plain.search_fields = [field for field in self.get_search_fields(request)
+                               if field not in self.indexed_search_fields]
+        if not plain.search_fields:
+            return found, False
+        matched, use_distinct = super(FullTextSearchAdminMixin, plain).get_search_results(
+            request, queryset, search_term)
+        return found | matched, use_distinct
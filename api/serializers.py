@@ -3,7 +3,16 @@ from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import BaseUserManager
 from rest_framework import serializers
-from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, Employee, Client, Appointment, Purchase
+from django.conf import settings
+from django.db import transaction
+from .booking import booking_transaction, save_appointment, check_employee_free
+from .stock import complete_purchases
+from .promocodes import get_discount
+from .events import publish_on_commit
+from .search import SOURCES as SEARCH_SOURCES
+from .thumbnails import ThumbnailsField
+from .queryplan import SparseFieldsMixin
+from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, Employee, Client, Appointment, Purchase, PurchaseProduct, RevenueRollup
 
 
 User = get_user_model()
@@ -40,13 +49,15 @@ class UserCreateSerializer(UserCreateSerializer):
 # ============================================
 
 
-class ServiceGroupSerializer(serializers.ModelSerializer):
+class ServiceGroupSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_thumbnails = ThumbnailsField(source="imageThumbnails")
+
     class Meta:
         model = ServiceGroup
-        fields = ["id", "title", "description", "image"]
+        fields = ["id", "title", "description", "image", "image_thumbnails"]
 
 
-class ServiceGroupShortSerializer(serializers.ModelSerializer):
+class ServiceGroupShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ServiceGroup
         fields = ["id", "title"]
@@ -56,19 +67,22 @@ class ServiceGroupShortSerializer(serializers.ModelSerializer):
 # ============================================
 
 
-class ServiceSerializer(serializers.ModelSerializer):
-    serviceGroup_details = UserShortSerializer(source="serviceGroup")
+class ServiceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    serviceGroup_details = ServiceGroupShortSerializer(source="serviceGroup")
+    image_thumbnails = ThumbnailsField(source="imageThumbnails")
 
     class Meta:
         model = Service
         fields = ["id", "serviceGroup_details", "title",
-                  "description", "image", "price", "percToEmpl"]
+                  "description", "image", "image_thumbnails", "price", "percToEmpl", "duration"]
+
 
+class ServiceShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable = {"serviceGroup": ServiceGroupShortSerializer}
 
-class ServiceShortSerializer(serializers.ModelSerializer):
     class Meta:
         model = Service
-        fields = ["id", "title", "description", "price"]
+        fields = ["id", "title", "description", "price", "duration"]
 
 # ============================================
 # РАБОЧИЕ МЕСТА
@@ -76,7 +90,7 @@ class ServiceShortSerializer(serializers.ModelSerializer):
 
 
 class WorkPositionSerializer(serializers.ModelSerializer):
-    serviceGroup_details = UserShortSerializer(source="serviceGroup")
+    serviceGroup_details = ServiceGroupShortSerializer(source="serviceGroup")
 
     class Meta:
         model = WorkPosition
@@ -95,13 +109,15 @@ class WorkPositionShortSerializer(serializers.ModelSerializer):
 # ============================================
 
 
-class NewsSerializer(serializers.ModelSerializer):
+class NewsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_thumbnails = ThumbnailsField(source="imageThumbnails")
+
     class Meta:
         model = News
-        fields = ["id", "title", "image", "description", "created_at"]
+        fields = ["id", "title", "image", "image_thumbnails", "description", "created_at"]
 
 
-class NewsShortSerializer(serializers.ModelSerializer):
+class NewsShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = News
         fields = ["id", "title", "created_at"]
@@ -116,53 +132,84 @@ class DiscountSerializer(serializers.ModelSerializer):
         fields = ["id", "discountAmount", "promoCode"]
 
 
+class PromoCodeField(serializers.CharField):
+    """
+    Промокод без учёта регистра; в validated_data попадает его скидка.
+    """
+    default_error_messages = {"not_found": "Промокод не найден"}
+
+    def run_validation(self, data=serializers.empty):
+        # скидка ищется после проверки длины: валидаторы поля ждут строку
+        discount = get_discount(super().run_validation(data))
+        if discount is None:
+            self.fail("not_found")
+        return discount
+
+
+class PromoCodeSerializer(serializers.Serializer):
+    promoCode = PromoCodeField(max_length=6)
+
+
 # ============================================
 # ТИПЫ ТОВАРОВ
 # ============================================
-class ProductTypeSerializer(serializers.ModelSerializer):
+class ProductTypeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_thumbnails = ThumbnailsField(source="imageThumbnails")
+
     class Meta:
         model = ProductType
-        fields = ["id", "title", "description", "image"]
+        fields = ["id", "title", "description", "image", "image_thumbnails"]
+
 
+class ProductTypeShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image_thumbnails = ThumbnailsField(source="imageThumbnails")
 
-class ProductTypeShortSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductType
-        fields = ["id", "title", "image"]
+        fields = ["id", "title", "image", "image_thumbnails"]
 
 
 # ============================================
 # ТОВАРЫ
 # ============================================
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    photo_thumbnails = ThumbnailsField(source="photoThumbnails")
+    expandable = {"productType": ProductTypeShortSerializer}
+
     class Meta:
         model = Product
         fields = ["id", "productType", "title",
-                  "description", "photo", "countLeft"]
+                  "description", "photo", "photo_thumbnails", "countLeft", "price"]
+
 
+class ProductShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    photo_thumbnails = ThumbnailsField(source="photoThumbnails")
+    expandable = {"productType": ProductTypeShortSerializer}
 
-class ProductShortSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ["id", "title", "photo", "countLeft"]
+        fields = ["id", "title", "photo", "photo_thumbnails", "countLeft", "price"]
 
 
 # ============================================
 # СОТРУДНИКИ
 # ============================================
-class EmployeeSerializer(serializers.ModelSerializer):
+class EmployeeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     user_details = UserShortSerializer(source="user")
+    photo_thumbnails = ThumbnailsField(source="photoThumbnails")
+    expandable = {"workPosition": WorkPositionShortSerializer}
 
     class Meta:
         model = Employee
-        fields = ["id", "user_details", "workPosition", "photo",
+        fields = ["id", "user_details", "workPosition", "photo", "photo_thumbnails",
                   "phone", "birthdate", "address", "employeeStatus"]
 
 
-class EmployeeShortSerializer(serializers.ModelSerializer):
+class EmployeeShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     user_details = UserShortSerializer(source="user")
+    expandable = {"workPosition": WorkPositionShortSerializer}
 
     class Meta:
         model = Employee
@@ -175,11 +222,17 @@ class EmployeeChangeStatusSerializer(serializers.ModelSerializer):
         model = Employee
         fields = ["employeeStatus", ]
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        publish_on_commit('employeeStatus', {
+            'id': instance.id, 'employeeStatus': instance.employeeStatus})
+        return instance
+
 
 # ============================================
 # КЛИЕНТЫ
 # ============================================
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     user_details = UserCreateSerializer(source="user")
 
@@ -188,8 +241,13 @@ class ClientSerializer(serializers.ModelSerializer):
         fields = ["id", "user_details", "birthdate",
                   "phone", "address"]
 
+    def create(self, validated_data):
+        with transaction.atomic():
+            user = self.fields["user_details"].create(validated_data.pop("user"))
+            return Client.objects.create(user=user, **validated_data)
 
-class ClientShortSerializer(serializers.ModelSerializer):
+
+class ClientShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     user_details = UserShortSerializer(source="user")
 
@@ -206,11 +264,28 @@ class AppointmentSerializer(serializers.ModelSerializer):
 
     # user = serializers.HiddenField(
     #     default=serializers.CurrentUserDefault())
+    promoCode = PromoCodeField(write_only=True, required=False)
 
     class Meta:
         model = Appointment
-        fields = ["id", "client", "discount", "employee", "fullPrice",
-                  "unauthorizedUser", "unauthorizedPhone", "created_at", "scheduledTime"]
+        fields = ["id", "client", "discount", "promoCode", "employee", "services", "fullPrice",
+                  "unauthorizedUser", "unauthorizedPhone", "created_at", "scheduledTime", "endTime"]
+        read_only_fields = ["fullPrice"]
+
+    def validate(self, data):
+        if "promoCode" in data:
+            data["discount"] = data.pop("promoCode")
+        return data
+
+    def create(self, validated_data):
+        services = validated_data.pop("services", [])
+        return save_appointment(Appointment(**validated_data), services)
+
+    def update(self, instance, validated_data):
+        services = validated_data.pop("services", None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        return save_appointment(instance, services)
 
 
 class AppointmentChangeStatusSerializer(serializers.ModelSerializer):
@@ -219,32 +294,174 @@ class AppointmentChangeStatusSerializer(serializers.ModelSerializer):
         model = Appointment
         fields = ["appointmentStatus", ]
 
+    def update(self, instance, validated_data):
+        with booking_transaction():
+            # отменённая запись не держит время сотрудника, поэтому вернуть
+            # её можно, только если время ещё свободно
+            if instance.appointmentStatus == Appointment.CLIENT_CANCELED:
+                instance.appointmentStatus = validated_data.get(
+                    "appointmentStatus", instance.appointmentStatus)
+                check_employee_free(instance)
+            instance = super().update(instance, validated_data)
+        publish_on_commit('appointmentStatus', {
+            'id': instance.id, 'appointmentStatus': instance.appointmentStatus,
+            'employee': instance.employee_id, 'scheduledTime': instance.scheduledTime})
+        return instance
+
 
-class AppointmentListSerializer(serializers.ModelSerializer):
+class AppointmentListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     client_details = ClientShortSerializer(source="client", read_only=True)
     employee_details = EmployeeShortSerializer(
         source="employee", read_only=True)
     discount_details = DiscountSerializer(source="discount", read_only=True)
+    expandable = {"services": ServiceShortSerializer}
 
     class Meta:
         model = Appointment
         fields = ["id", "client_details", "employee_details", "discount_details",
-                  "fullPrice", "unauthorizedUser", "appointmentStatus", "created_at", "scheduledTime"]
+                  "fullPrice", "unauthorizedUser", "appointmentStatus", "created_at", "scheduledTime", "endTime"]
+
+
+# ============================================
+# СВОБОДНОЕ ВРЕМЯ
+# ============================================
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    service = serializers.PrimaryKeyRelatedField(
+        queryset=Service.objects.select_related("serviceGroup"), required=False)
+    serviceGroup = serializers.PrimaryKeyRelatedField(
+        queryset=ServiceGroup.objects.all(), required=False)
+    dateFrom = serializers.DateField()
+    dateTo = serializers.DateField()
+
+    def validate(self, data):
+        if 'service' in data:
+            data['serviceGroup'] = data['service'].serviceGroup
+        if data.get('serviceGroup') is None:
+            raise serializers.ValidationError(
+                "Укажите услугу из группы услуг или группу услуг")
+        if data['dateTo'] < data['dateFrom']:
+            raise serializers.ValidationError(
+                "Дата окончания раньше даты начала")
+        if (data['dateTo'] - data['dateFrom']).days >= settings.BOOKING_MAX_RANGE_DAYS:
+            raise serializers.ValidationError(
+                "Период не может быть больше %s дней" % settings.BOOKING_MAX_RANGE_DAYS)
+        return data
+
+
+class EmployeeAvailabilitySerializer(serializers.Serializer):
+    employee_details = EmployeeShortSerializer(source="employee")
+    slots = serializers.ListField(child=serializers.DateTimeField())
 
 
 # ============================================
 # ПОКУПКИ
 # ============================================
-class PurchaseSerializer(serializers.ModelSerializer):
+class PurchaseProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PurchaseProduct
+        fields = ["product", "quantity", "unitPrice"]
+
+
+class PurchaseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     client_details = ClientShortSerializer(source="client", read_only=True)
     product_details = ProductShortSerializer(
         source="products", read_only=True, many=True)
+    items = PurchaseProductSerializer(read_only=True, many=True)
     # checkboxes = serializers.ListField(child=serializers.CharField(write_only=True), write_only=True)
     discount_details = DiscountSerializer(source="discount", read_only=True)
 
     class Meta:
         model = Purchase
-        fields = ["id", "client_details", "product_details", "discount_details",
+        fields = ["id", "client_details", "product_details", "items", "discount_details",
+                  "unauthorizedUser", "purchaseStatus", "fullPrice", "created_at"]
+        read_only_fields = ["fullPrice"]
+
+    def update(self, instance, validated_data):
+        completing = validated_data.get("purchaseStatus") == Purchase.COMPLETED \
+            and instance.purchaseStatus != Purchase.COMPLETED
+        if completing:
+            validated_data.pop("purchaseStatus")
+        # при нехватке товара откатываются и остальные поля запроса
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            if completing:
+                # complete_purchases берёт только покупки в работе: отменённая
+                # осталась бы отменённой, а ответ сообщил бы о выполнении
+                if not complete_purchases(Purchase.objects.filter(pk=instance.pk)):
+                    raise serializers.ValidationError(
+                        {'purchaseStatus': ['Выполнить можно только покупку в работе']})
+                instance.purchaseStatus = Purchase.COMPLETED
+        return instance
+
+
+class PurchaseListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # в списке товары покупки — только id в items: сами товары отдаются
+    # один раз на страницу в products рядом с results
+
+    client_details = ClientShortSerializer(source="client", read_only=True)
+    items = PurchaseProductSerializer(read_only=True, many=True)
+    discount_details = DiscountSerializer(source="discount", read_only=True)
+
+    class Meta:
+        model = Purchase
+        fields = ["id", "client_details", "items", "discount_details",
                   "unauthorizedUser", "purchaseStatus", "fullPrice", "created_at"]
+
+
+# ============================================
+# ПОИСК
+# ============================================
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    type = serializers.MultipleChoiceField(choices=sorted(SEARCH_SOURCES), required=False)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.SEARCH_MAX_RESULTS, default=20)
+
+
+class SearchHitSerializer(serializers.Serializer):
+    SERIALIZERS = {
+        Service: ServiceShortSerializer,
+        Product: ProductShortSerializer,
+        News: NewsShortSerializer,
+    }
+
+    type = serializers.CharField()
+    score = serializers.FloatField()
+    object = serializers.SerializerMethodField()
+
+    def get_object(self, hit):
+        obj = hit['object']
+        return self.SERIALIZERS[type(obj)](obj, context=self.context).data
+
+
+# ============================================
+# ОТЧЁТЫ
+# ============================================
+class RevenueReportQuerySerializer(serializers.Serializer):
+    dimension = serializers.ChoiceField(choices=RevenueRollup.DIMENSION_CHOICES)
+    period = serializers.ChoiceField(choices=RevenueRollup.PERIOD_CHOICES, required=False)
+    dateFrom = serializers.DateField()
+    dateTo = serializers.DateField()
+
+    def validate(self, data):
+        if data['dateTo'] < data['dateFrom']:
+            raise serializers.ValidationError(
+                "Дата окончания раньше даты начала")
+        if data.get('period') == RevenueRollup.DAY and \
+                (data['dateTo'] - data['dateFrom']).days >= settings.REPORT_MAX_DAYS:
+            raise serializers.ValidationError(
+                "Период по дням не может быть больше %s дней" % settings.REPORT_MAX_DAYS)
+        return data
+
+
+class RevenueRowSerializer(serializers.Serializer):
+    periodStart = serializers.DateField(required=False)
+    objectId = serializers.IntegerField()
+    title = serializers.CharField(allow_null=True)
+    revenue = serializers.IntegerField()
+    commission = serializers.IntegerField()
+    count = serializers.IntegerField()
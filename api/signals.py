@@ -0,0 +1,238 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import News, Discount, ProductType, Product, ServiceGroup, Service, User, \
+    Appointment, Purchase, PurchaseProduct
+from . import authentication, catalog, pricing, promocodes, reports, search, thumbnails
+
+
+# ============================================
+# ЦЕНЫ
+# ============================================
+
+@receiver(pre_save, sender=Service)
+@receiver(pre_save, sender=Product)
+def remember_price_change(sender, instance, **kwargs):
+    instance._price_changed = instance.pk is None or \
+        sender.objects.filter(pk=instance.pk).exclude(price=instance.price).exists()
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Product)
+def update_prices(sender, instance, created, **kwargs):
+    if not getattr(instance, '_price_changed', True):
+        return
+    pricing.invalidate_prices(sender, [instance.pk])
+    if created:
+        return
+    if sender is Service:
+        pricing.recalculate_open_orders_for_service(instance)
+    else:
+        pricing.recalculate_open_orders_for_product(instance)
+
+
+@receiver(post_delete, sender=Service)
+@receiver(post_delete, sender=Product)
+def forget_prices(sender, instance, **kwargs):
+    pricing.invalidate_prices(sender, [instance.pk])
+
+
+@receiver(m2m_changed, sender=Purchase.products.through)
+def fill_purchase_item_prices(sender, instance, action, reverse, pk_set, **kwargs):
+    # add() и set() пишут строки покупки через bulk_create без save(),
+    # поэтому цена за единицу и стоимость покупки считаются здесь
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        purchase_ids = pk_set
+        items = PurchaseProduct.objects.filter(product=instance, purchase__in=pk_set)
+    else:
+        purchase_ids = [instance.pk]
+        items = PurchaseProduct.objects.filter(purchase=instance, product__in=pk_set)
+    pricing.fill_unit_prices(items.filter(unitPrice__isnull=True))
+    pricing.recalculate_purchases(Purchase.objects.filter(pk__in=purchase_ids))
+    reports.rebuild_purchases(Purchase.objects.filter(
+        pk__in=purchase_ids, purchaseStatus=Purchase.COMPLETED).values('pk'))
+
+
+# ============================================
+# ПРОМОКОДЫ
+# ============================================
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def forget_promo_codes(sender, instance, **kwargs):
+    promocodes.invalidate_promo_codes()
+
+
+# ============================================
+# КАТАЛОГ
+# ============================================
+
+CATALOG_MODELS = (News, ProductType, Product, ServiceGroup, Service)
+
+
+def bump_catalog_version(sender, **kwargs):
+    catalog.bump_version_on_commit(sender)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(bump_catalog_version, sender=model,
+                      dispatch_uid='catalog_save_%s' % model._meta.label_lower)
+    post_delete.connect(bump_catalog_version, sender=model,
+                        dispatch_uid='catalog_delete_%s' % model._meta.label_lower)
+
+
+# ============================================
+# АВТОРИЗАЦИЯ
+# ============================================
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_credentials(sender, instance, **kwargs):
+    authentication.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    authentication.invalidate_user(instance.user_id)
+
+
+@receiver(user_logged_out)
+def forget_credentials_on_logout(sender, user, **kwargs):
+    if user is not None:
+        authentication.invalidate_user(user.pk)
+
+
+# ============================================
+# МИНИАТЮРЫ
+# ============================================
+
+def remember_image(sender, instance, **kwargs):
+    field, thumbnails_field = thumbnails.IMAGE_FIELDS[sender], thumbnails.thumbnails_field(sender)
+    old = sender.objects.filter(pk=instance.pk).values_list(field, thumbnails_field).first() \
+        if instance.pk else None
+    old_name, old_thumbnails = old or (None, {})
+    instance._image_changed = (old_name or '') != (getattr(instance, field).name or '')
+    if instance._image_changed:
+        # старые миниатюры не должны попасть в ответы, пока строятся новые
+        setattr(instance, thumbnails_field, {})
+        thumbnails.delete_on_commit(old_thumbnails)
+
+
+def build_thumbnails(sender, instance, **kwargs):
+    name = getattr(instance, thumbnails.IMAGE_FIELDS[sender]).name
+    if getattr(instance, '_image_changed', False) and name:
+        thumbnails.schedule(sender, instance.pk, name)
+
+
+def delete_thumbnails(sender, instance, **kwargs):
+    thumbnails.delete_on_commit(getattr(instance, thumbnails.thumbnails_field(sender)))
+
+
+for model in thumbnails.IMAGE_FIELDS:
+    pre_save.connect(remember_image, sender=model,
+                     dispatch_uid='thumbnails_remember_%s' % model._meta.label_lower)
+    post_save.connect(build_thumbnails, sender=model,
+                      dispatch_uid='thumbnails_build_%s' % model._meta.label_lower)
+    post_delete.connect(delete_thumbnails, sender=model,
+                        dispatch_uid='thumbnails_delete_%s' % model._meta.label_lower)
+
+
+# ============================================
+# ПОИСК
+# ============================================
+
+@receiver(post_save, sender=News)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Service)
+def index_document(sender, instance, **kwargs):
+    search.index([instance])
+
+
+@receiver(post_delete, sender=News)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Service)
+def remove_document(sender, instance, **kwargs):
+    search.remove(instance)
+
+
+# название группы входит в документы услуг и товаров, а при удалении
+# группы Django обнуляет ссылку UPDATE-ом без сигналов
+SEARCH_PARENTS = {ServiceGroup: (Service, 'serviceGroup'), ProductType: (Product, 'productType')}
+
+
+@receiver(pre_save, sender=ServiceGroup)
+@receiver(pre_save, sender=ProductType)
+@receiver(pre_delete, sender=ServiceGroup)
+@receiver(pre_delete, sender=ProductType)
+def remember_search_children(sender, instance, **kwargs):
+    model, field = SEARCH_PARENTS[sender]
+    changed = instance.pk is not None and (
+        kwargs.get('signal') is pre_delete or
+        sender.objects.filter(pk=instance.pk).exclude(title=instance.title).exists())
+    instance._search_children = list(model.objects.filter(**{field: instance})
+                                     .values_list('pk', flat=True)) if changed else []
+
+
+@receiver(post_save, sender=ServiceGroup)
+@receiver(post_save, sender=ProductType)
+@receiver(post_delete, sender=ServiceGroup)
+@receiver(post_delete, sender=ProductType)
+def reindex_search_children(sender, instance, **kwargs):
+    children = getattr(instance, '_search_children', [])
+    if children:
+        model, _ = SEARCH_PARENTS[sender]
+        search.index_queryset(model.objects.filter(pk__in=children))
+
+
+# ============================================
+# ОТЧЁТЫ
+# ============================================
+
+@receiver(pre_save, sender=Appointment)
+def remember_appointment_day(sender, instance, **kwargs):
+    completed = sender.objects.filter(pk=instance.pk, appointmentStatus=Appointment.COMPLETED) \
+        .values_list('scheduledTime', 'created_at').first() if instance.pk else None
+    instance._report_day = reports.appointment_day(*completed) if completed else None
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def update_appointment_reports(sender, instance, **kwargs):
+    days = {getattr(instance, '_report_day', None)}
+    if instance.appointmentStatus == Appointment.COMPLETED:
+        days.add(reports.appointment_day(instance.scheduledTime, instance.created_at))
+    reports.rebuild_days(days)
+
+
+@receiver(m2m_changed, sender=Appointment.services.through)
+def update_appointment_services_reports(sender, instance, action, **kwargs):
+    if action.startswith('post_') and isinstance(instance, Appointment) and \
+            instance.appointmentStatus == Appointment.COMPLETED:
+        reports.rebuild_appointments([instance.pk])
+
+
+@receiver(pre_save, sender=Purchase)
+def remember_purchase_day(sender, instance, **kwargs):
+    created_at = sender.objects.filter(pk=instance.pk, purchaseStatus=Purchase.COMPLETED) \
+        .values_list('created_at', flat=True).first() if instance.pk else None
+    instance._report_day = reports.local_day(created_at) if created_at else None
+
+
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+def update_purchase_reports(sender, instance, **kwargs):
+    days = {getattr(instance, '_report_day', None)}
+    if instance.purchaseStatus == Purchase.COMPLETED:
+        days.add(reports.local_day(instance.created_at))
+    reports.rebuild_days(days)
+
+
+@receiver(post_save, sender=PurchaseProduct)
+@receiver(post_delete, sender=PurchaseProduct)
+def update_purchase_item_reports(sender, instance, **kwargs):
+    reports.rebuild_purchases(Purchase.objects.filter(
+        pk=instance.purchase_id, purchaseStatus=Purchase.COMPLETED).values('pk'))
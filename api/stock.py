@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from rest_framework import serializers
+
+from .models import Product, Purchase, PurchaseProduct
+from . import catalog, reports
+
+
+# ============================================
+# СПИСАНИЕ ТОВАРОВ
+# ============================================
+
+class OutOfStock(Exception):
+    pass
+
+
+def get_required_quantities(purchase_ids):
+    return dict(PurchaseProduct.objects
+                .filter(purchase_id__in=purchase_ids)
+                .values_list('product_id')
+                .annotate(total=Sum('quantity'))
+                .order_by('product_id'))
+
+
+def decrement_stock(required, batch_size=500):
+    """
+    Списывает {id товара: количество} одним UPDATE ... CASE на пачку.
+    Условие countLeft >= количество проверяется в том же UPDATE, поэтому
+    параллельные покупки не уводят остаток в минус.
+    """
+    items = list(required.items())
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        enough = Q()
+        for product_id, quantity in batch:
+            enough |= Q(pk=product_id, countLeft__gte=quantity)
+        updated = Product.objects.filter(enough).update(countLeft=F('countLeft') - Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in batch]))
+        if updated != len(batch):
+            raise OutOfStock()
+
+
+def complete_purchases(queryset):
+    """
+    Переводит покупки в статус «выполнена» и списывает товары.
+    При нехватке любого товара ничего не меняется. Остаток входит в ответы
+    каталога, а UPDATE не отправляет сигналов, поэтому версия каталога
+    товаров меняется здесь.
+    """
+    try:
+        with transaction.atomic():
+            purchase_ids = list(queryset
+                                .select_for_update()
+                                .filter(purchaseStatus=Purchase.IN_PROGRESS)
+                                .values_list('id', flat=True))
+            required = get_required_quantities(purchase_ids)
+            decrement_stock(required)
+            if required:
+                catalog.bump_version_on_commit(Product)
+            updated = Purchase.objects.filter(pk__in=purchase_ids) \
+                .update(purchaseStatus=Purchase.COMPLETED)
+            reports.rebuild_purchases(purchase_ids)
+            return updated
+    except OutOfStock:
+        missing = [product.title for product in Product.objects.filter(pk__in=required)
+                   if product.countLeft < required[product.pk]]
+        raise serializers.ValidationError(
+            {'purchaseStatus': ['Недостаточно товара на складе: ' + ', '.join(missing)]})
@@ -1,3 +1,1527 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.models import LogEntry
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory
+from PIL import Image
+import tablib
+
+from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, Employee, Client, Appointment, Purchase, PurchaseProduct, RevenueRollup
+from . import benchmark, booking, pricing, reports, search
+from .stock import complete_purchases
+from .generator import DataGenerator
+from .export import stream_export
+from .admin import AppointmentResource, ProductAdmin, ProductResource
+from .events import Broker, broker
+from .authentication import CachedBasicAuthentication, CachedTokenAuthentication
+from .activity import LastLoginTracker
+from .metrics import registry
+from .urls import router
+from core.asgi import application
+
+
+def create_user(email, **extra_fields):
+    return User.objects.create_user(
+        email=email, name='Имя', surname='Фамилия', password='password', **extra_fields)
+
+
+def create_client(index):
+    return Client.objects.create(
+        user=create_user('client%s@example.com' % index),
+        phone='+7900100%04d' % index, address='Москва')
+
+
+def create_employee(index, **extra_fields):
+    return Employee.objects.create(
+        user=create_user('employee%s@example.com' % index), **extra_fields,
+        birthdate=datetime.date(1990, 1, 1),
+        phone='+7900200%04d' % index, address='Москва')
+
+
+@contextmanager
+def run_on_commit():
+    """
+    TestCase не фиксирует транзакцию, поэтому колбэки on_commit,
+    добавленные внутри блока, выполняются при выходе из него.
+    """
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for _, callback in callbacks:
+        callback()
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.admin = create_user('admin@example.com', is_staff=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+
+# ============================================
+# ЗАПИСИ
+# ============================================
+
+class AppointmentQueryBudgetTests(ApiTestCase):
+
+    def create_appointments(self, count):
+        discount = Discount.objects.create(discountAmount=10, promoCode='SALE10')
+        for index in range(count):
+            Appointment.objects.create(
+                client=create_client(index), employee=create_employee(index),
+                discount=discount, fullPrice=1000,
+                scheduledTime=timezone.now() + datetime.timedelta(hours=index))
+
+    def test_list_queries_do_not_depend_on_row_count(self):
+        self.create_appointments(10)
+        with self.assertNumQueries(1):
+            response = self.api.get('/api/v1/appointments/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(
+            response.data['results'][0]['employee_details']['user_details']['name'], 'Имя')
+
+    def test_retrieve_is_single_query(self):
+        self.create_appointments(1)
+        appointment = Appointment.objects.get()
+        with self.assertNumQueries(1):
+            response = self.api.get('/api/v1/appointments/%s/' % appointment.id)
+        self.assertEqual(response.data['discount_details']['promoCode'], 'SALE10')
+
+
+class BookingTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.employee = create_employee(1)
+        self.service = Service.objects.create(title='Стрижка', duration=90)
+        self.start = timezone.now().replace(microsecond=0) + datetime.timedelta(days=1)
+
+    def book(self, start):
+        return self.api.post('/api/v1/appointments/', {
+            'employee': self.employee.id, 'services': [self.service.id],
+            'scheduledTime': start.isoformat()})
+
+    def test_end_time_is_computed_from_service_duration(self):
+        response = self.book(self.start)
+        self.assertEqual(response.status_code, 201)
+        appointment = Appointment.objects.get()
+        self.assertEqual(appointment.endTime - appointment.scheduledTime,
+                         datetime.timedelta(minutes=90))
+
+    def test_overlapping_booking_is_rejected(self):
+        self.assertEqual(self.book(self.start).status_code, 201)
+        response = self.book(self.start + datetime.timedelta(minutes=60))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('scheduledTime', response.data)
+        self.assertEqual(
+            self.book(self.start + datetime.timedelta(minutes=90)).status_code, 201)
+
+    def test_overlap_is_checked_under_employee_lock(self):
+        # SQLite не блокирует строки, поэтому здесь проверяется порядок:
+        # сначала блокировка сотрудника, потом поиск пересечений
+        calls = mock.Mock()
+        with mock.patch.object(booking, 'lock_employee', wraps=booking.lock_employee) as lock, \
+                mock.patch.object(booking, 'get_overlapping',
+                                  wraps=booking.get_overlapping) as overlapping:
+            calls.attach_mock(lock, 'lock')
+            calls.attach_mock(overlapping, 'overlapping')
+            self.assertEqual(self.book(self.start).status_code, 201)
+        self.assertEqual([name for name, args, kwargs in calls.mock_calls], ['lock', 'overlapping'])
+        self.assertEqual(calls.mock_calls[0], mock.call.lock(self.employee.id))
+
+    def test_reopening_canceled_appointment_checks_overlap(self):
+        canceled = Appointment.objects.create(
+            employee=self.employee, scheduledTime=self.start,
+            endTime=self.start + datetime.timedelta(minutes=90),
+            appointmentStatus=Appointment.CLIENT_CANCELED)
+        self.assertEqual(self.book(self.start).status_code, 201)
+        response = self.api.put('/api/v1/appointments/%s/' % canceled.id,
+                                {'appointmentStatus': Appointment.EMPLOYEE_WAITING})
+        self.assertEqual(response.status_code, 400)
+        canceled.refresh_from_db()
+        self.assertEqual(canceled.appointmentStatus, Appointment.CLIENT_CANCELED)
+
+    def test_admin_rejects_overlapping_appointment(self):
+        self.assertEqual(self.book(self.start).status_code, 201)
+        request = APIRequestFactory().get('/')
+        request.user = self.admin
+        form_class = admin.site._registry[Appointment].get_form(request)
+
+        def form(start):
+            start = timezone.localtime(start)
+            return form_class(data={
+                'employee': self.employee.id, 'services': [self.service.id],
+                'appointmentStatus': Appointment.EMPLOYEE_WAITING,
+                'scheduledTime_0': start.strftime('%Y-%m-%d'),
+                'scheduledTime_1': start.strftime('%H:%M:%S')})
+
+        busy = form(self.start + datetime.timedelta(minutes=30))
+        self.assertFalse(busy.is_valid())
+        self.assertIn('scheduledTime', busy.errors)
+        self.assertTrue(form(self.start + datetime.timedelta(minutes=90)).is_valid())
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """
+    На PostgreSQL запросы ждут блокировку строки сотрудника, на SQLite —
+    блокировку процесса в booking_transaction.
+    """
+
+    def test_parallel_bookings_produce_one_appointment(self):
+        admin = create_user('admin@example.com', is_staff=True)
+        employee = create_employee(1)
+        service = Service.objects.create(title='Стрижка', price=1000, duration=90)
+        start = timezone.now() + datetime.timedelta(days=1)
+        statuses = []
+
+        def book():
+            api = APIClient()
+            api.force_authenticate(admin)
+            try:
+                statuses.append(api.post('/api/v1/appointments/', {
+                    'employee': employee.id, 'services': [service.id],
+                    'scheduledTime': start.isoformat()}).status_code)
+            except Exception as e:
+                statuses.append(repr(e))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book) for _ in range(100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses, key=str), [201] + [400] * 99)
+        appointment = Appointment.objects.get()
+        self.assertEqual(appointment.endTime - appointment.scheduledTime,
+                         datetime.timedelta(minutes=90))
+        self.assertEqual(appointment.fullPrice, 1000)
+
+
+# ============================================
+# СТОИМОСТЬ
+# ============================================
+
+class PricingTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.haircut = Service.objects.create(title='Стрижка', price=1000)
+        self.styling = Service.objects.create(title='Укладка', price=500)
+        self.discount = Discount.objects.create(discountAmount=10, promoCode='SALE10')
+
+    def test_booking_computes_full_price_with_discount(self):
+        response = self.api.post('/api/v1/appointments/', {
+            'services': [self.haircut.id, self.styling.id], 'discount': self.discount.id,
+            'fullPrice': 1, 'scheduledTime': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Appointment.objects.get().fullPrice, 1350)
+
+    def test_prices_are_cached_per_id(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(pricing.get_appointment_price([self.haircut.id]), 1000)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                pricing.get_appointment_price([self.haircut.id, self.styling.id]), 1500)
+        with self.assertNumQueries(0):
+            self.assertEqual(pricing.get_appointment_price([self.styling.id]), 500)
+
+    def test_price_is_invalidated_again_after_commit(self):
+        self.assertEqual(pricing.get_appointment_price([self.haircut.id]), 1000)
+        with run_on_commit():
+            self.haircut.price = 2000
+            self.haircut.save()
+            # параллельный запрос до фиксации прочитал бы старую цену
+            pricing.get_cache().set(pricing.price_key(Service, self.haircut.id), 1000)
+        self.assertEqual(pricing.get_appointment_price([self.haircut.id]), 2000)
+
+    def test_price_change_recalculates_open_appointments(self):
+        open_appointment = Appointment.objects.create(discount=self.discount)
+        completed = Appointment.objects.create(
+            appointmentStatus=Appointment.COMPLETED, fullPrice=1500)
+        for appointment in (open_appointment, completed):
+            appointment.services.set([self.haircut, self.styling])
+
+        self.haircut.price = 2000
+        self.haircut.save()
+
+        open_appointment.refresh_from_db()
+        completed.refresh_from_db()
+        self.assertEqual(open_appointment.fullPrice, 2250)
+        self.assertEqual(completed.fullPrice, 1500)
+        self.assertEqual(pricing.get_appointment_price([self.haircut.id]), 2000)
+
+    def test_purchase_totals_are_one_query(self):
+        product = Product.objects.create(title='Шампунь', price=300)
+        for _ in range(3):
+            PurchaseProduct.objects.create(
+                purchase=Purchase.objects.create(discount=self.discount),
+                product=product, quantity=2)
+        with self.assertNumQueries(2):
+            self.assertEqual(pricing.recalculate_purchases(Purchase.objects.all()), 3)
+        self.assertEqual(set(Purchase.objects.values_list('fullPrice', flat=True)), {540})
+
+
+# ============================================
+# ПРОМОКОДЫ
+# ============================================
+
+class PromoCodeTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.discount = Discount.objects.create(discountAmount=15, promoCode='SPRING')
+
+    def validate(self, promo_code):
+        return self.api.post('/api/v1/promo-codes/validate/', {'promoCode': promo_code})
+
+    def test_validation_does_not_query_database_when_warm(self):
+        self.validate('SPRING')
+        with self.assertNumQueries(0):
+            response = self.validate('spring')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['discountAmount'], 15)
+        self.assertEqual(self.validate('WINTER').status_code, 400)
+
+    def test_cache_is_invalidated_on_save_and_delete(self):
+        self.validate('SPRING')
+        self.discount.discountAmount = 20
+        self.discount.save()
+        self.assertEqual(self.validate('SPRING').data['discountAmount'], 20)
+        self.discount.delete()
+        self.assertEqual(self.validate('SPRING').status_code, 400)
+
+    def test_table_is_reread_after_timeout(self):
+        # изменение в другом процессе при локальном кэше версии не видно
+        self.validate('SPRING')
+        Discount.objects.update(discountAmount=30)
+        self.assertEqual(self.validate('SPRING').data['discountAmount'], 15)
+        with override_settings(PROMO_CODES_TIMEOUT=0):
+            self.assertEqual(self.validate('SPRING').data['discountAmount'], 30)
+
+    def test_booking_with_promo_code(self):
+        service = Service.objects.create(title='Стрижка', price=1000)
+        response = self.api.post('/api/v1/appointments/', {
+            'services': [service.id], 'promoCode': 'SPRING',
+            'scheduledTime': timezone.now().isoformat()})
+        self.assertEqual(response.status_code, 201)
+        appointment = Appointment.objects.get()
+        self.assertEqual(appointment.discount_id, self.discount.id)
+        self.assertEqual(appointment.fullPrice, 850)
+
+
+# ============================================
+# СКЛАД
+# ============================================
+
+class StockTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shampoo = Product.objects.create(title='Шампунь', price=300, countLeft=5)
+        self.mask = Product.objects.create(title='Маска', price=700, countLeft=1)
+
+    def create_purchase(self, **quantities):
+        purchase = Purchase.objects.create()
+        for title, quantity in quantities.items():
+            PurchaseProduct.objects.create(
+                purchase=purchase, product=getattr(self, title), quantity=quantity)
+        return purchase
+
+    def test_completing_decrements_stock_in_one_update(self):
+        self.create_purchase(shampoo=2, mask=1)
+        self.create_purchase(shampoo=3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(complete_purchases(Purchase.objects.all()), 2)
+        stock_updates = [query for query in queries.captured_queries
+                         if query['sql'].startswith('UPDATE "api_product"')]
+        self.assertEqual(len(stock_updates), 1)
+        self.assertEqual(Product.objects.get(pk=self.shampoo.pk).countLeft, 0)
+        self.assertEqual(Product.objects.get(pk=self.mask.pk).countLeft, 0)
+
+    def test_oversell_is_rejected_without_changes(self):
+        purchase = self.create_purchase(shampoo=1, mask=2)
+        response = self.api.patch('/api/v1/purchases/%s/' % purchase.id, {
+            'purchaseStatus': Purchase.COMPLETED, 'unauthorizedUser': 'Анна'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Маска', response.data['purchaseStatus'][0])
+        self.assertEqual(Product.objects.get(pk=self.shampoo.pk).countLeft, 5)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.purchaseStatus, Purchase.IN_PROGRESS)
+        self.assertIsNone(purchase.unauthorizedUser)
+
+    def test_canceled_purchase_cannot_be_completed(self):
+        purchase = self.create_purchase(shampoo=2)
+        purchase.purchaseStatus = Purchase.CLIENT_CANCELED
+        purchase.save()
+        response = self.api.patch('/api/v1/purchases/%s/' % purchase.id,
+                                  {'purchaseStatus': Purchase.COMPLETED})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('purchaseStatus', response.data)
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.purchaseStatus, Purchase.CLIENT_CANCELED)
+        self.assertEqual(Product.objects.get(pk=self.shampoo.pk).countLeft, 5)
+
+    def test_related_add_fills_unit_price(self):
+        purchase = Purchase.objects.create()
+        purchase.products.add(self.shampoo)
+        self.mask.purchase_set.add(purchase)
+        self.assertEqual(dict(purchase.items.values_list('product_id', 'unitPrice')),
+                         {self.shampoo.pk: 300, self.mask.pk: 700})
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.fullPrice, 1000)
+
+    def test_completed_purchase_is_not_decremented_twice(self):
+        purchase = self.create_purchase(shampoo=2)
+        for _ in range(2):
+            response = self.api.patch('/api/v1/purchases/%s/' % purchase.id,
+                                      {'purchaseStatus': Purchase.COMPLETED})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.get(pk=self.shampoo.pk).countLeft, 3)
+
+
+# ============================================
+# ПОКУПКИ
+# ============================================
+
+class PurchaseListTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.products = [Product.objects.create(title='Товар %s' % index, price=100)
+                         for index in range(3)]
+
+    def create_purchases(self, count):
+        discount = Discount.objects.create(discountAmount=5, promoCode='BUY%s' % count)
+        for index in range(count):
+            purchase = Purchase.objects.create(client=create_client(index), discount=discount)
+            for product in self.products[:index % 3 + 1]:
+                PurchaseProduct.objects.create(purchase=purchase, product=product, quantity=1)
+
+    def test_products_are_side_loaded_once(self):
+        self.create_purchases(10)
+        # покупки с клиентом и скидкой, позиции, карта товаров
+        with self.assertNumQueries(3):
+            response = self.api.get('/api/v1/purchases/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(sorted(response.data['products']),
+                         [product.id for product in self.products])
+        purchase = response.data['results'][-1]
+        self.assertEqual([item['product'] for item in purchase['items']], [self.products[0].id])
+        self.assertNotIn('product_details', purchase)
+        self.assertEqual(purchase['client_details']['user_details']['name'], 'Имя')
+        self.assertEqual(response.data['products'][self.products[0].id]['title'], 'Товар 0')
+
+    def test_retrieve_keeps_product_details(self):
+        self.create_purchases(1)
+        response = self.api.get('/api/v1/purchases/%s/' % Purchase.objects.get().id)
+        self.assertEqual(response.data['product_details'][0]['title'], 'Товар 0')
+
+
+# ============================================
+# МИНИАТЮРЫ
+# ============================================
+
+def image_file(name, size=(1200, 800), mode='RGB', image_format='JPEG'):
+    output = io.BytesIO()
+    Image.new(mode, size, 'red').save(output, image_format)
+    return SimpleUploadedFile(name, output.getvalue())
+
+
+class ThumbnailTests(TransactionTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.media = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media, THUMBNAIL_ASYNC=False)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media)
+
+    def test_upload_builds_hashed_thumbnails(self):
+        product = Product.objects.create(title='Шампунь', photo=image_file('shampoo.jpg'))
+        product.refresh_from_db()
+        small = product.photoThumbnails['small']
+        self.assertEqual(set(small), {'jpeg', 'webp'})
+        with Image.open(os.path.join(self.media, small['webp'])) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (160, 107)))
+        self.assertRegex(small['jpeg'], r'^thumbs/shampoo\.[0-9a-f]{12}\.small\.jpeg$')
+
+        response = APIClient().get('/api/v1/products/')
+        self.assertEqual(response.data['results'][0]['photo_thumbnails']['small']['webp'],
+                         'http://testserver/media/' + small['webp'])
+
+    def test_transparent_images_fall_back_to_png(self):
+        group = ServiceGroup.objects.create(
+            title='Ногти', image=image_file('nails.png', mode='RGBA', image_format='PNG'))
+        group.refresh_from_db()
+        self.assertEqual(set(group.imageThumbnails['medium']), {'png', 'webp'})
+
+    def test_replacing_image_removes_old_thumbnails(self):
+        product = Product.objects.create(title='Шампунь', photo=image_file('shampoo.jpg'))
+        product.refresh_from_db()
+        old = product.photoThumbnails['large']['jpeg']
+        product.photo = image_file('shampoo-new.jpg', size=(300, 300))
+        product.save()
+        product.refresh_from_db()
+        self.assertFalse(os.path.exists(os.path.join(self.media, old)))
+        with Image.open(os.path.join(self.media, product.photoThumbnails['large']['jpeg'])) as large:
+            # миниатюры не растягивают картинку больше оригинала
+            self.assertEqual(large.size, (300, 300))
+
+
+# ============================================
+# ПОИСК
+# ============================================
+
+class SearchTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.group = ServiceGroup.objects.create(title='Волосы')
+        self.haircut = Service.objects.create(
+            title='Женская стрижка', description='Стрижка с укладкой', serviceGroup=self.group)
+        self.coloring = Service.objects.create(
+            title='Окрашивание', description='Окрашивание после стрижки', serviceGroup=self.group)
+        self.shampoo = Product.objects.create(title='Шампунь для окрашенных волос')
+
+    def found(self, query, **params):
+        response = self.api.get('/api/v1/search/', dict(params, q=query))
+        self.assertEqual(response.status_code, 200)
+        return [(hit['type'], hit['object']['id']) for hit in response.data]
+
+    def test_word_forms_match_and_title_ranks_first(self):
+        self.assertEqual(self.found('стрижки'), [
+            ('service', self.haircut.id), ('service', self.coloring.id)])
+        self.assertEqual(self.found('окрашенные волосы', type='product'),
+                         [('product', self.shampoo.id)])
+
+    def test_index_follows_changes(self):
+        self.haircut.title = 'Мужская стрижка'
+        self.haircut.save()
+        self.assertIn(('service', self.haircut.id), self.found('мужские'))
+        self.coloring.delete()
+        self.assertEqual(self.found('окрашивание'), [])
+
+        self.group.title = 'Барбершоп'
+        self.group.save()
+        self.assertEqual(self.found('барбершоп'), [('service', self.haircut.id)])
+
+    def test_drafts_are_only_found_in_admin(self):
+        news = News.objects.create(title='Открытие нового салона', description='Скидки')
+        self.assertEqual(self.found('салоны'), [])
+        self.client.force_login(create_user('root@example.com', is_staff=True, is_admin=True,
+                                            is_superuser=True))
+        response = self.client.get('/admin/api/news/?q=салоны')
+        self.assertEqual(list(response.context['cl'].result_list), [news])
+
+        self.client.post('/admin/api/news/', {
+            'action': 'make_news_published', '_selected_action': [news.id]})
+        self.assertEqual(self.found('салоны'), [('news', news.id)])
+
+    def test_admin_finds_numbers_inside_words(self):
+        cream = Product.objects.create(title='Крем SPF50', description='Объём 250мл')
+        self.client.force_login(create_user('root@example.com', is_staff=True, is_admin=True,
+                                            is_superuser=True))
+        response = self.client.get('/admin/api/product/?q=50')
+        self.assertEqual(list(response.context['cl'].result_list), [cream])
+        response = self.client.get('/admin/api/product/?q=окрашенные')
+        self.assertEqual(list(response.context['cl'].result_list), [self.shampoo])
+
+    def test_admin_combines_index_with_other_search_fields(self):
+        mask = Product.objects.create(title='Маска', photo='products/aloe.jpg')
+        self.client.force_login(create_user('root@example.com', is_staff=True, is_admin=True,
+                                            is_superuser=True))
+        with mock.patch.object(ProductAdmin, 'search_fields', ('title', 'description', 'photo')):
+            response = self.client.get('/admin/api/product/?q=aloe')
+            self.assertEqual(list(response.context['cl'].result_list), [mask])
+            response = self.client.get('/admin/api/product/?q=волосы')
+            self.assertEqual(list(response.context['cl'].result_list), [self.shampoo])
+
+    def test_unsupported_database_saves_without_index(self):
+        search.warned_vendors.discard('oracle')
+        with mock.patch.object(connection, 'vendor', 'oracle'), \
+                self.assertLogs('api.search', 'WARNING'):
+            self.haircut.title = 'Мужская стрижка'
+            self.haircut.save()
+            Service.objects.create(title='Бритьё')
+            self.assertEqual(search.search('бритьё'), [])
+        self.assertEqual(Service.objects.filter(title='Бритьё').count(), 1)
+
+    def test_rebuild_restores_index(self):
+        search.rebuild()
+        self.assertEqual(len(search.search('стрижка')), 2)
+
+
+# ============================================
+# ОТЧЁТЫ
+# ============================================
+
+class RevenueReportTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.group = ServiceGroup.objects.create(title='Волосы')
+        self.haircut = Service.objects.create(
+            title='Стрижка', price=1000, percToEmpl=40, serviceGroup=self.group)
+        self.styling = Service.objects.create(
+            title='Укладка', price=500, percToEmpl=20, serviceGroup=self.group)
+        self.employee = create_employee(1)
+
+    def complete_appointment(self, day, full_price=1500):
+        appointment = Appointment.objects.create(
+            employee=self.employee, fullPrice=full_price,
+            scheduledTime=timezone.make_aware(datetime.datetime.combine(day, datetime.time(12))))
+        appointment.services.set([self.haircut, self.styling])
+        appointment.appointmentStatus = Appointment.COMPLETED
+        appointment.save()
+        return appointment
+
+    def rollup(self, period, dimension, object_id):
+        return RevenueRollup.objects.values_list('revenue', 'commission', 'count').get(
+            period=period, dimension=dimension, objectId=object_id)
+
+    def test_completed_appointment_is_rolled_up(self):
+        day = datetime.date(2021, 3, 15)
+        appointment = self.complete_appointment(day)
+        for period in (RevenueRollup.DAY, RevenueRollup.MONTH):
+            self.assertEqual(self.rollup(period, RevenueRollup.SERVICE, self.haircut.id),
+                             (1000, 400, 1))
+            self.assertEqual(self.rollup(period, RevenueRollup.SERVICE, self.styling.id),
+                             (500, 100, 1))
+            self.assertEqual(self.rollup(period, RevenueRollup.SERVICE_GROUP, self.group.id),
+                             (1500, 500, 1))
+            self.assertEqual(self.rollup(period, RevenueRollup.EMPLOYEE, self.employee.id),
+                             (1500, 500, 1))
+
+        appointment.appointmentStatus = Appointment.CLIENT_CANCELED
+        appointment.save()
+        self.assertFalse(RevenueRollup.objects.exists())
+
+    def test_completed_purchase_is_rolled_up(self):
+        product = Product.objects.create(title='Шампунь', price=300, countLeft=5)
+        purchase = Purchase.objects.create()
+        PurchaseProduct.objects.create(purchase=purchase, product=product, quantity=2)
+        pricing.recalculate_purchases(Purchase.objects.all())
+        complete_purchases(Purchase.objects.all())
+        self.assertEqual(self.rollup(RevenueRollup.DAY, RevenueRollup.PRODUCT, product.id),
+                         (600, 0, 1))
+
+    def test_range_is_answered_from_rollups(self):
+        for day in (datetime.date(2021, 1, 31), datetime.date(2021, 2, 10),
+                    datetime.date(2021, 2, 20), datetime.date(2021, 3, 1),
+                    datetime.date(2021, 3, 2)):
+            self.complete_appointment(day)
+        url = '/api/v1/reports/revenue/?dimension=employee&dateFrom=2021-01-31&dateTo=2021-03-01'
+        # сводки и подписи — два запроса при любом числе записей
+        with self.assertNumQueries(2):
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['revenue'], 4 * 1500)
+        self.assertEqual(response.data[0]['commission'], 4 * 500)
+        self.assertEqual(response.data[0]['title'], str(self.employee))
+
+        response = self.api.get(url + '&period=month')
+        self.assertEqual([row['revenue'] for row in response.data], [1500, 3000, 3000])
+
+    def test_admin_dashboard_shows_range_totals(self):
+        self.complete_appointment(datetime.date(2021, 2, 10))
+        self.client.force_login(create_user('root@example.com', is_staff=True, is_admin=True,
+                                            is_superuser=True))
+        response = self.client.get('/admin/api/revenuerollup/dashboard/?dimension=service'
+                                   '&dateFrom=2021-02-01&dateTo=2021-02-28')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['title'] for row in response.context['rows']], ['Стрижка', 'Укладка'])
+        self.assertEqual(response.context['commission'], 500)
+        self.assertEqual(self.client.get('/admin/api/revenuerollup/').status_code, 200)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        for day in (datetime.date(2021, 1, 31), datetime.date(2021, 2, 10)):
+            self.complete_appointment(day)
+        incremental = set(RevenueRollup.objects.values_list(
+            'period', 'periodStart', 'dimension', 'objectId', 'revenue', 'commission', 'count'))
+        RevenueRollup.objects.all().delete()
+        reports.rebuild_range(*reports.get_data_range())
+        self.assertEqual(set(RevenueRollup.objects.values_list(
+            'period', 'periodStart', 'dimension', 'objectId', 'revenue', 'commission', 'count')),
+            incremental)
+
+
+# ============================================
+# СВОБОДНОЕ ВРЕМЯ
+# ============================================
+
+class AvailabilityTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        group = ServiceGroup.objects.create(title='Маникюр')
+        self.service = Service.objects.create(title='Покрытие', serviceGroup=group)
+        position = WorkPosition.objects.create(
+            title='Мастер маникюра', serviceGroup=group, workSchedule=WorkPosition.FIVE_TWO)
+        self.employee = create_employee(1, workPosition=position)
+        create_employee(2, workPosition=position, employeeStatus=Employee.ON_VACATION)
+
+        today = timezone.localdate()
+        self.monday = today + datetime.timedelta(days=7 - today.weekday())
+
+    def get_availability(self, date_from, date_to):
+        return self.api.get('/api/v1/availability/', {
+            'service': self.service.id, 'dateFrom': date_from, 'dateTo': date_to})
+
+    def test_booked_slots_and_days_off_are_excluded(self):
+        booked = timezone.make_aware(datetime.datetime.combine(
+            self.monday, datetime.time(12)))
+        Appointment.objects.create(employee=self.employee, scheduledTime=booked,
+                                   endTime=booked + datetime.timedelta(minutes=30))
+
+        with self.assertNumQueries(3):
+            response = self.get_availability(
+                self.monday, self.monday + datetime.timedelta(days=6))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        slots = response.data[0]['slots']
+        days = {timezone.localtime(
+            datetime.datetime.fromisoformat(slot)).date() for slot in slots}
+        self.assertEqual(len(days), 5)
+        self.assertEqual(len(slots), 5 * 10 - 1)
+        self.assertNotIn(booked.isoformat(), slots)
+
+    def test_range_is_validated(self):
+        response = self.get_availability(self.monday, self.monday - datetime.timedelta(days=1))
+        self.assertEqual(response.status_code, 400)
+
+
+# ============================================
+# КЭШ КАТАЛОГА
+# ============================================
+
+class CatalogCacheTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.service = Service.objects.create(title='Стрижка', price=1000)
+
+    def test_repeated_reads_do_not_query_database(self):
+        first = self.api.get('/api/v1/services/')
+        with self.assertNumQueries(0):
+            second = self.api.get('/api/v1/services/')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertIn('Last-Modified', second)
+
+    def test_image_urls_follow_request_host(self):
+        Service.objects.filter(pk=self.service.pk).update(image='services/haircut.jpg')
+        first = self.api.get('/api/v1/services/%s/' % self.service.id)
+        other = self.api.get('/api/v1/services/%s/' % self.service.id,
+                             HTTP_HOST='127.0.0.1', secure=True)
+        self.assertTrue(first.data['image'].startswith('http://testserver/'))
+        self.assertTrue(other.data['image'].startswith('https://127.0.0.1/'))
+        self.assertNotEqual(other['ETag'], first['ETag'])
+
+    def test_conditional_get_returns_not_modified(self):
+        etag = self.api.get('/api/v1/services/')['ETag']
+        response = self.api.get('/api/v1/services/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_save_invalidates_cached_responses(self):
+        etag = self.api.get('/api/v1/services/%s/' % self.service.id)['ETag']
+        self.service.price = 1500
+        self.service.save()
+        response = self.api.get('/api/v1/services/%s/' % self.service.id,
+                                HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['price'], 1500)
+
+    def test_completed_purchase_invalidates_stock(self):
+        product = Product.objects.create(title='Шампунь', price=300, countLeft=5)
+        purchase = Purchase.objects.create()
+        PurchaseProduct.objects.create(purchase=purchase, product=product, quantity=2)
+        etag = self.api.get('/api/v1/products/')['ETag']
+        with run_on_commit():
+            complete_purchases(Purchase.objects.filter(pk=purchase.pk))
+        response = self.api.get('/api/v1/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['results'][0]['countLeft'], 3)
+
+
+class AsyncReadTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.async_client = AsyncClient()
+        group = ServiceGroup.objects.create(title='Волосы')
+        self.service = Service.objects.create(title='Стрижка', price=1000, serviceGroup=group)
+        self.product = Product.objects.create(title='Шампунь', price=300)
+
+    async def test_catalog_matches_sync_endpoints(self):
+        for path in ('services/', 'services/%s/' % self.service.id,
+                     'products/', 'products/%s/' % self.product.id, 'news/'):
+            response = await self.async_client.get('/api/v1/async/' + path)
+            self.assertEqual(response.status_code, 200)
+            expected = await sync_to_async(self.api.get)('/api/v1/' + path, format='json')
+            self.assertEqual(response.json(), expected.json())
+
+    async def test_cached_response_and_conditional_get(self):
+        first = await self.async_client.get('/api/v1/async/services/')
+        second = await self.async_client.get('/api/v1/async/services/')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+        response = await self.async_client.get('/api/v1/async/services/',
+                                               **{'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_availability(self):
+        day = timezone.localdate() + datetime.timedelta(days=1)
+        response = await self.async_client.get(
+            '/api/v1/async/availability/?service=%s&dateFrom=%s&dateTo=%s'
+            % (self.service.id, day, day))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+
+# ============================================
+# КЭШ АВТОРИЗАЦИИ
+# ============================================
+
+class AuthCacheTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.user = create_user('client@example.com')
+        self.user.set_password('secret-pass')
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+        self.factory = APIRequestFactory()
+
+    def token_request(self):
+        return self.factory.get('/', HTTP_AUTHORIZATION='Token %s' % self.token.key)
+
+    def basic_request(self, password):
+        credentials = base64.b64encode(('client@example.com:%s' % password).encode()).decode()
+        return self.factory.get('/', HTTP_AUTHORIZATION='Basic %s' % credentials)
+
+    def test_repeated_token_is_served_from_cache(self):
+        CachedTokenAuthentication().authenticate(self.token_request())
+        with self.assertNumQueries(0):
+            user, token = CachedTokenAuthentication().authenticate(self.token_request())
+        self.assertEqual(user, self.user)
+        self.assertEqual(token, self.token)
+
+    def test_deleted_token_is_rejected(self):
+        CachedTokenAuthentication().authenticate(self.token_request())
+        Token.objects.filter(user=self.user).delete()
+        with self.assertRaises(AuthenticationFailed):
+            CachedTokenAuthentication().authenticate(self.token_request())
+
+    def test_basic_credentials_are_hashed_once(self):
+        CachedBasicAuthentication().authenticate(self.basic_request('secret-pass'))
+        with self.assertNumQueries(0):
+            user, _ = CachedBasicAuthentication().authenticate(self.basic_request('secret-pass'))
+        self.assertEqual(user, self.user)
+        with self.assertRaises(AuthenticationFailed):
+            CachedBasicAuthentication().authenticate(self.basic_request('wrong-pass'))
+
+    def test_password_change_rejects_cached_credentials(self):
+        CachedBasicAuthentication().authenticate(self.basic_request('secret-pass'))
+        self.user.set_password('new-pass')
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CachedBasicAuthentication().authenticate(self.basic_request('secret-pass'))
+
+
+class LastLoginTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.tracker = LastLoginTracker()
+        self.users = [create_user('user%s@example.com' % index) for index in range(3)]
+
+    def test_save_does_not_touch_last_login(self):
+        user = self.users[0]
+        user.name = 'Анна'
+        user.save()
+        user.refresh_from_db()
+        self.assertIsNone(user.last_login)
+
+    def test_activity_is_throttled_and_flushed_in_one_update(self):
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                for user in self.users:
+                    self.tracker.touch(user)
+        self.assertEqual(len(self.tracker.pending), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.tracker.flush(), 3)
+        self.assertEqual(User.objects.filter(last_login__isnull=False).count(), 3)
+        self.tracker.touch(self.users[0])
+        self.assertEqual(self.tracker.pending, {})
+
+    @override_settings(LAST_LOGIN_FLUSH_SECONDS=0.2)
+    def test_repeat_activity_flushes_time_of_first_touch(self):
+        user = self.users[0]
+        self.tracker.flushed_at = time.monotonic()
+        self.tracker.touch(user)
+        touched_at = self.tracker.pending[user.pk]
+        time.sleep(0.3)
+        self.tracker.touch(user)
+        self.assertEqual(self.tracker.pending, {})
+        user.refresh_from_db()
+        self.assertEqual(user.last_login, touched_at)
+
+
+# ============================================
+# ПОТОК СОБЫТИЙ
+# ============================================
+
+class BrokerTests(TestCase):
+
+    def setUp(self):
+        self.broker = Broker(size=3)
+
+    def test_resume_returns_missed_events(self):
+        first = self.broker.publish('employeeStatus', {'id': 1})
+        second = self.broker.publish('employeeStatus', {'id': 2})
+        self.assertEqual(self.broker.subscribe(lambda message: None, first['id']), [second])
+        self.assertEqual(self.broker.subscribe(lambda message: None, second['id']), [])
+
+    def test_resume_is_refused_when_events_are_lost(self):
+        first = self.broker.publish('employeeStatus', {'id': 1})
+        for index in range(4):
+            self.broker.publish('employeeStatus', {'id': index})
+        self.assertIsNone(self.broker.subscribe(lambda message: None, first['id']))
+        self.assertIsNone(self.broker.subscribe(lambda message: None, 'other-1'))
+
+
+class EventStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.admin = create_user('admin@example.com', is_staff=True, is_admin=True)
+        self.token = Token.objects.create(user=self.admin)
+        self.appointment = Appointment.objects.create(employee=create_employee(0))
+        self.start = broker.publish('test', {})['id']
+
+    def change_status(self):
+        api = APIClient()
+        api.force_authenticate(self.admin)
+        response = api.put('/api/v1/appointments/%s/' % self.appointment.id,
+                           {'appointmentStatus': Appointment.IN_PROGRESS})
+        self.assertEqual(response.status_code, 200)
+
+    def ticket(self):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION='Token %s' % self.token.key)
+        response = api.post('/api/v1/events/ticket/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['ticket']
+
+    def test_stream_resumes_after_last_event_id(self):
+        self.change_status()
+        response = APIClient().get('/api/v1/events/', {'ticket': self.ticket()},
+                                   HTTP_LAST_EVENT_ID=self.start)
+        self.assertEqual(response['Content-Type'], 'text/event-stream; charset=utf-8')
+        chunks = iter(response.streaming_content)
+        self.assertEqual(next(chunks), b'retry: 3000\n\n')
+        event = next(chunks).decode()
+        response.close()
+        self.assertIn('event: appointmentStatus', event)
+        self.assertIn('"appointmentStatus": "in_progress"', event)
+
+    def test_stream_requires_staff(self):
+        response = APIClient().get('/api/v1/events/')
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_stream_rejects_token_and_stale_tickets(self):
+        response = APIClient().get('/api/v1/events/', {'token': self.token.key})
+        self.assertIn(response.status_code, (401, 403))
+
+        with mock.patch('time.time', return_value=time.time() - settings.EVENTS_TICKET_SECONDS - 1):
+            expired = self.ticket()
+        response = APIClient().get('/api/v1/events/', {'ticket': expired})
+        self.assertIn(response.status_code, (401, 403))
+
+        ticket = self.ticket()
+        self.token.delete()
+        response = APIClient().get('/api/v1/events/', {'ticket': ticket})
+        self.assertIn(response.status_code, (401, 403))
+
+    async def test_asgi_stream_pushes_changes(self):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'method': 'GET', 'path': '/api/v1/events/',
+            'query_string': ('ticket=%s' % await sync_to_async(self.ticket)()).encode(),
+            'headers': [],
+        })
+        await communicator.send_input({'type': 'http.request'})
+        start = await communicator.receive_output(5)
+        self.assertEqual(start['status'], 200)
+        retry = await communicator.receive_output(5)
+        self.assertEqual(retry['body'], b'retry: 3000\n\n')
+
+        await sync_to_async(self.change_status)()
+        event = await communicator.receive_output(5)
+        self.assertIn(b'event: appointmentStatus', event['body'])
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait(5)
+
+
+# ============================================
+# ПАГИНАЦИЯ
+# ============================================
+
+class CursorPaginationTests(ApiTestCase):
+
+    def test_pages_cover_history_without_duplicates(self):
+        for index in range(7):
+            News.objects.create(title='Новость %s' % index, status=News.PUBLISHED)
+
+        seen = []
+        url = '/api/v1/news/?page_size=3'
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen += [news['id'] for news in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 7)
+
+    def test_pages_step_over_equal_created_at_without_offset(self):
+        for index in range(7):
+            News.objects.create(title='Новость %s' % index, status=News.PUBLISHED)
+        News.objects.update(created_at=timezone.now())
+
+        pages = []
+        url = '/api/v1/news/?page_size=3'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+            pages.append([news['id'] for news in response.data['results']])
+            url = response.data['next']
+        seen = sum(pages, [])
+        self.assertEqual(seen, sorted(News.objects.values_list('id', flat=True), reverse=True))
+
+        url = response.data['previous']
+        while url:
+            response = self.api.get(url)
+            self.assertEqual([news['id'] for news in response.data['results']], pages.pop(-2))
+            url = response.data['previous']
+        self.assertEqual(len(pages), 1)
+
+
+# ============================================
+# ПОЛЯ ПО ЗАПРОСУ
+# ============================================
+
+class SparseFieldsTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.group = ServiceGroup.objects.create(title='Волосы')
+        for index in range(3):
+            Service.objects.create(title='Стрижка %s' % index, serviceGroup=self.group,
+                                   description='Длинное описание')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_fields_trim_response_and_columns(self):
+        response, queries = self.get('/api/v1/services/?fields=id,title')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'title'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0])
+
+    def test_expand_joins_relation_in_same_query(self):
+        response, queries = self.get('/api/v1/services/?fields=title&expand=serviceGroup')
+        self.assertEqual(response.data['results'][0]['serviceGroup']['title'], 'Волосы')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('JOIN "api_servicegroup"', queries[0])
+
+    def test_expand_many_to_many_is_prefetched(self):
+        employee = create_employee(1)
+        for index in range(3):
+            appointment = Appointment.objects.create(employee=employee)
+            appointment.services.set(Service.objects.all())
+        response, queries = self.get('/api/v1/appointments/?fields=id&expand=services')
+        self.assertEqual(len(response.data['results'][0]['services']), 3)
+        self.assertEqual(len(queries), 2)
+
+    def test_unknown_names_are_rejected(self):
+        response = self.api.get('/api/v1/services/?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.data['fields'])
+        response = self.api.get('/api/v1/services/?expand=client')
+        self.assertEqual(response.status_code, 400)
+
+
+# ============================================
+# АДМИН ПАНЕЛЬ
+# ============================================
+
+class AdminChangelistQueryTests(TestCase):
+
+    def setUp(self):
+        self.admin = create_user('admin@example.com', is_staff=True, is_admin=True,
+                                 is_superuser=True)
+        self.client.force_login(self.admin)
+        self.discount = Discount.objects.create(discountAmount=5, promoCode='ADMIN5')
+        self.group = ServiceGroup.objects.create(title='Волосы')
+        self.position = WorkPosition.objects.create(title='Парикмахер', serviceGroup=self.group)
+        self.product_type = ProductType.objects.create(title='Уход')
+        self.created = 0
+
+    def add_rows(self, count):
+        for index in range(self.created, self.created + count):
+            client = create_client(index)
+            employee = create_employee(index, workPosition=self.position)
+            Appointment.objects.create(client=client, employee=employee, discount=self.discount)
+            Purchase.objects.create(client=client, discount=self.discount)
+            Service.objects.create(title='Услуга %s' % index, serviceGroup=self.group)
+            Product.objects.create(title='Товар %s' % index, productType=self.product_type)
+            WorkPosition.objects.create(title='Должность %s' % index, serviceGroup=self.group)
+        self.created += count
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ['/admin/api/%s/' % name for name in (
+            'appointment', 'purchase', 'employee', 'client', 'service', 'product', 'workposition')]
+        self.add_rows(2)
+        small = [self.count_queries(url) for url in urls]
+        self.add_rows(20)
+        large = [self.count_queries(url) for url in urls]
+        self.assertEqual(dict(zip(urls, large)), dict(zip(urls, small)))
+
+
+# ============================================
+# ПОТОКОВАЯ ВЫГРУЗКА
+# ============================================
+
+class StreamingExportTests(TestCase):
+
+    def setUp(self):
+        self.discount = Discount.objects.create(discountAmount=5, promoCode='EXP5')
+        self.employee = create_employee(0)
+
+    def add_appointments(self, count):
+        for index in range(count):
+            client = create_client(Client.objects.count())
+            Appointment.objects.create(client=client, employee=self.employee,
+                                       discount=self.discount)
+
+    def export_queries(self, file_format):
+        resource = AppointmentResource()
+        with CaptureQueriesContext(connection) as queries:
+            lines = list(stream_export(resource, Appointment.objects.all(), file_format,
+                                       chunk_size=100))
+        return lines, len(queries)
+
+    def test_rows_use_natural_keys_and_queries_do_not_grow(self):
+        self.add_appointments(3)
+        lines, small = self.export_queries('jsonl')
+        self.add_appointments(30)
+        lines, large = self.export_queries('jsonl')
+        self.assertEqual(large, small)
+        self.assertEqual(len(lines), 33)
+        row = json.loads(lines[0])
+        self.assertEqual(row['employee'], str(self.employee.phone))
+        self.assertEqual(row['discount'], 'EXP5')
+
+    def test_admin_action_streams_csv(self):
+        self.add_appointments(3)
+        admin = create_user('admin@example.com', is_staff=True, is_admin=True, is_superuser=True)
+        self.client.force_login(admin)
+        response = self.client.post('/admin/api/appointment/', {
+            'action': 'stream_export_csv',
+            '_selected_action': list(Appointment.objects.values_list('pk', flat=True)),
+        })
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(content.splitlines()), 4)
+        self.assertTrue(content.startswith('client,employee,discount,id,'))
+
+
+# ============================================
+# ПАКЕТНЫЙ ИМПОРТ
+# ============================================
+
+class BulkImportTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.product_type = ProductType.objects.create(title='Уход')
+
+    def dataset(self, rows):
+        return tablib.Dataset(*rows, headers=['id', 'productType', 'title', 'countLeft', 'price'])
+
+    def import_queries(self, count):
+        dataset = self.dataset([('', 'Уход', 'Товар %s-%s' % (count, index), 1, 100)
+                                for index in range(count)])
+        with CaptureQueriesContext(connection) as queries, run_on_commit():
+            result = ProductResource().import_data(dataset)
+        self.assertFalse(result.has_errors())
+        return len(queries)
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.assertEqual(self.import_queries(30), self.import_queries(3))
+        self.assertEqual(Product.objects.filter(productType=self.product_type).count(), 33)
+
+    def test_admin_logs_one_entry_per_import(self):
+        product = Product.objects.create(title='Шампунь', productType=self.product_type)
+        result = ProductResource().import_data(self.dataset(
+            [(product.pk, 'Уход', 'Шампунь', 2, 100)] +
+            [('', 'Уход', 'Маска %s' % index, 1, 100) for index in range(3)]))
+        request = APIRequestFactory().post('/')
+        request.user = create_user('root@example.com', is_staff=True, is_superuser=True)
+        ProductAdmin(Product, admin.site).generate_log_entries(result, request)
+        self.assertEqual(list(LogEntry.objects.values_list('user', 'change_message')), [
+            (request.user.pk, 'Импорт: добавлено 3, изменено 1, удалено 0')])
+
+    def test_update_recalculates_open_purchases(self):
+        product = Product.objects.create(title='Шампунь', productType=self.product_type, price=100)
+        purchase = Purchase.objects.create()
+        PurchaseProduct.objects.create(purchase=purchase, product=product, quantity=2)
+        result = ProductResource().import_data(
+            self.dataset([(product.pk, 'Уход', 'Шампунь', 5, 150)]))
+        self.assertFalse(result.has_errors())
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.fullPrice, 300)
+        self.assertEqual(pricing.get_prices(Product, [product.pk]), {product.pk: 150})
+
+    def test_caches_and_index_are_reset_after_commit(self):
+        product = Product.objects.create(title='Шампунь', productType=self.product_type, price=100)
+        pricing.get_prices(Product, [product.pk])
+        with run_on_commit():
+            ProductResource().import_data(
+                self.dataset([(product.pk, 'Уход', 'Маска', 5, 150)]))
+            self.assertEqual(pricing.get_prices(Product, [product.pk]), {product.pk: 100})
+            self.assertEqual(search.search_ids(Product, 'маска'), [])
+        self.assertEqual(pricing.get_prices(Product, [product.pk]), {product.pk: 150})
+        self.assertEqual(search.search_ids(Product, 'маска'), [product.pk])
+
+    def test_invalid_columns_abort_import(self):
+        Product.objects.create(title='Шампунь', productType=self.product_type)
+        result = ProductResource().import_data(self.dataset([
+            ('', 'Нет такого', 'Маска', 1, 100),
+            ('', 'Уход', 'Шампунь', 1, 100),
+        ]))
+        self.assertTrue(result.has_errors())
+        error = str(result.base_errors[0].error)
+        self.assertIn('Нет такого', error)
+        self.assertIn('Шампунь', error)
+        self.assertFalse(Product.objects.filter(title='Маска').exists())
+
+
+# ============================================
+# СИНТЕТИЧЕСКИЕ ДАННЫЕ
+# ============================================
+
+class DataGeneratorTests(TestCase):
+
+    def test_generated_rows_are_consistent(self):
+        DataGenerator(batch_size=50, seed=1).generate(
+            clients=30, employees=5, services=10, products=10,
+            appointments=200, purchases=50, news=10)
+
+        self.assertEqual(Appointment.objects.count(), 200)
+        self.assertEqual(Purchase.objects.count(), 50)
+        self.assertEqual(Client.objects.count(), 30)
+        self.assertFalse([row for row in pricing.calculate_totals(
+            Appointment.objects.all(), 'services__price') if row[1] != row[2]])
+        self.assertLess(Appointment.objects.order_by('created_at').first().created_at,
+                        timezone.now() - datetime.timedelta(days=30))
+        # новые объекты после генерации получают следующие id
+        self.assertTrue(create_client(999).pk > Client.objects.order_by('-pk')[1].pk)
+
+
+# ============================================
+# МЕТРИКИ
+# ============================================
+
+class MetricsTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        for index in range(3):
+            Product.objects.create(title='Товар %s' % index, price=100)
+
+    def test_requests_are_recorded_per_action(self):
+        for _ in range(2):
+            self.assertEqual(self.api.get('/api/v1/products/').status_code, 200)
+        self.api.get('/api/v1/products/%s/' % Product.objects.first().id)
+
+        rows = {row['endpoint']: row for row in self.api.get('/api/v1/metrics/summary/').data}
+        self.assertEqual(rows['products.list']['count'], 2)
+        self.assertEqual(rows['products.retrieve']['count'], 1)
+        self.assertGreater(rows['products.list']['queries'], 0)
+        self.assertGreater(rows['products.list']['serializerMs'], 0)
+        self.assertGreater(rows['products.list']['bytes'], 0)
+
+        metrics = self.api.get('/api/v1/metrics/').content.decode()
+        self.assertIn('api_request_duration_seconds_count{endpoint="products.list"} 2', metrics)
+        self.assertIn('api_db_queries_total{endpoint="products.retrieve"}', metrics)
+
+    async def test_async_views_are_recorded(self):
+        response = await AsyncClient().get('/api/v1/async/products/')
+        self.assertEqual(response.status_code, 200)
+        rows = {row['endpoint']: row for row in registry.summary()}
+        self.assertGreater(rows['async-products-list']['queries'], 0)
+
+    def test_metrics_require_admin(self):
+        self.assertEqual(APIClient().get('/api/v1/metrics/').status_code, 401)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.api.get('/api/v1/products/')
+        self.assertIn('products.list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+# ============================================
+# БЮДЖЕТ ЗАПРОСОВ
+# ============================================
+
+def router_endpoints():
+    """
+    'basename.action' всех действий viewset'ов из api/urls.py с их методами.
+    """
+    endpoints = {}
+    for pattern in router.urls:
+        actions = getattr(pattern.callback, 'actions', None)
+        if actions:
+            basename = pattern.callback.initkwargs['basename']
+            for method, action in actions.items():
+                endpoints['%s.%s' % (basename, action)] = method
+    return endpoints
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Каждое действие каждого viewset'а и каждый список админки вызываются на
+    10 и на 1000 строках: число запросов не должно зависеть от объёма данных.
+    """
+    SMALL = 10
+    LARGE = 1000
+    # ответ, при котором действие выполнилось целиком: отказ 400/403/404
+    # тратит постоянное число запросов и спрятал бы N+1 за проверкой
+    STATUS = {'list': 200, 'retrieve': 200, 'create': 201, 'update': 200,
+              'partial_update': 200, 'destroy': 204, 'validate': 200}
+    # изменения, доступные только в админке
+    NOT_ALLOWED = {
+        'news.create', 'news.update', 'news.partial_update', 'news.destroy',
+        'employees.create', 'employees.destroy',
+        'clients.update', 'clients.partial_update', 'clients.destroy',
+        'appointments.destroy', 'purchases.create', 'purchases.destroy',
+    } | {'%s.%s' % (basename, action)
+         for basename in ('products', 'product-types', 'service-groups', 'services')
+         for action in ('create', 'update', 'partial_update', 'destroy')}
+
+    def setUp(self):
+        self.admin = create_user('admin@example.com', is_staff=True, is_admin=True,
+                                 is_superuser=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        self.client.force_login(self.admin)
+        self.rows = 0
+
+    def seed(self, rows):
+        count = rows - self.rows
+        DataGenerator(batch_size=500, seed=rows).generate(
+            clients=count, employees=count, services=count, products=count,
+            appointments=count, purchases=count, news=count)
+        self.rows = rows
+
+    def api_requests(self):
+        # запись и объекты для изменения берутся из последней порции данных,
+        # чтобы на обоих масштабах запрос делал одно и то же
+        news = News.objects.filter(status=News.PUBLISHED).last()
+        employee = Employee.objects.last()
+        client = Client.objects.last()
+        appointment = Appointment.objects.last()
+        purchase = Purchase.objects.last()
+        # от статуса зависит, что пересчитывается при изменении
+        Appointment.objects.filter(pk=appointment.pk).update(
+            appointmentStatus=Appointment.EMPLOYEE_WAITING)
+        Purchase.objects.filter(pk=purchase.pk).update(purchaseStatus=Purchase.IN_PROGRESS)
+        product = Product.objects.last()
+        product_type = ProductType.objects.last()
+        group = ServiceGroup.objects.last()
+        service = Service.objects.filter(serviceGroup=employee.workPosition.serviceGroup).last()
+        day = timezone.localdate() + datetime.timedelta(days=60)
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+        today = timezone.localdate()
+
+        requests = {
+            'availability.list': ('get', '/api/v1/availability/', {
+                'service': service.id, 'dateFrom': day, 'dateTo': day}),
+            'promo-codes.validate': ('post', '/api/v1/promo-codes/validate/', {
+                'promoCode': Discount.objects.last().promoCode}),
+            'search.list': ('get', '/api/v1/search/', {'q': 'Услуга'}),
+            'revenue-report.list': ('get', '/api/v1/reports/revenue/', {
+                'dimension': RevenueRollup.SERVICE,
+                'dateFrom': today - datetime.timedelta(days=365), 'dateTo': today}),
+            'clients.create': ('post', '/api/v1/clients/', {
+                'user_details': {'email': 'new%s@example.com' % self.rows, 'name': 'Имя',
+                                 'surname': 'Фамилия', 'password': 'Secret-password-1'},
+                'phone': '+7911000%04d' % self.rows, 'address': 'Москва'}),
+            'appointments.create': ('post', '/api/v1/appointments/', {
+                'employee': employee.id, 'services': [service.id],
+                'scheduledTime': start.isoformat()}),
+            'employees.update': ('put', None, {'employeeStatus': Employee.ON_VACATION}),
+            'employees.partial_update': ('patch', None, {'employeeStatus': Employee.FIRED}),
+            'appointments.update': ('put', None, {
+                'appointmentStatus': Appointment.IN_PROGRESS}),
+            'appointments.partial_update': ('patch', None, {
+                'appointmentStatus': Appointment.CLIENT_CANCELED}),
+            'purchases.update': ('put', None, {'purchaseStatus': Purchase.IN_PROGRESS}),
+            'purchases.partial_update': ('patch', None, {
+                'purchaseStatus': Purchase.CLIENT_CANCELED}),
+        }
+        objects = {
+            'news': news, 'employees': employee, 'clients': client, 'appointments': appointment,
+            'purchases': purchase, 'products': product, 'product-types': product_type,
+            'service-groups': group, 'services': service,
+        }
+        for endpoint, method in router_endpoints().items():
+            basename, action = endpoint.split('.')
+            if basename not in objects:
+                continue
+            method, url, data = requests.get(endpoint, (method, None, {}))
+            if url is None:
+                url = '/api/v1/%s/' % basename
+                if action not in ('list', 'create'):
+                    url += '%s/' % objects[basename].id
+            requests[endpoint] = (method, url, data)
+        return requests
+
+    def expected_status(self, endpoint):
+        if endpoint in self.NOT_ALLOWED:
+            return 405
+        return self.STATUS[endpoint.split('.')[1]]
+
+    def count_api_queries(self, endpoint, method, url, data):
+        for cache in caches.all():
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'get':
+                response = self.api.get(url, data)
+            else:
+                response = getattr(self.api, method)(url, data, format='json')
+        self.assertEqual(response.status_code, self.expected_status(endpoint),
+                         '%s %s: %s' % (method.upper(), url, getattr(response, 'data', None)))
+        return len(queries)
+
+    def count_admin_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries)
+
+    def measure(self):
+        counts = {endpoint: self.count_api_queries(endpoint, *request)
+                  for endpoint, request in self.api_requests().items()}
+        for model in admin.site._registry:
+            if model._meta.app_label == 'api':
+                url = reverse('admin:api_%s_changelist' % model._meta.model_name)
+                counts[url] = self.count_admin_queries(url)
+        return counts
+
+    def test_every_viewset_action_is_covered(self):
+        self.seed(self.SMALL)
+        self.assertEqual(set(router_endpoints()) - set(self.api_requests()), set())
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.seed(self.SMALL)
+        small = self.measure()
+        self.seed(self.LARGE)
+        large = self.measure()
+        self.assertEqual({endpoint: (small[endpoint], count) for endpoint, count in large.items()
+                          if count != small[endpoint]}, {})
+
+
+# ============================================
+# НАГРУЗОЧНЫЕ ЗАМЕРЫ
+# ============================================
+
+class BenchmarkTests(TransactionTestCase):
+
+    def test_scenarios_succeed_under_both_servers(self):
+        benchmark.seed(100)
+        scenarios = benchmark.create_scenarios()
+        generated = Appointment.objects.count()
+        for server in benchmark.SERVERS:
+            for scenario in scenarios:
+                row = benchmark.measure(server, scenario, requests=4, concurrency=2)
+                self.assertEqual((row['endpoint'], row['errors']), (scenario.name, 0))
+                self.assertEqual(row['requests'], 4)
+        self.assertEqual(Appointment.objects.count(), generated + 8)
+
+    def test_database_settings_are_restored(self):
+        test_settings = dict(connection.settings_dict['TEST'])
+        with mock.patch.object(connection.creation, 'create_test_db'), \
+                mock.patch.object(connection.creation, 'destroy_test_db') as destroy:
+            with self.assertRaises(RuntimeError):
+                with benchmark.benchmark_database():
+                    raise RuntimeError
+        destroy.assert_called_once()
+        self.assertEqual(connection.settings_dict['TEST'], test_settings)
+
+    def test_regressions_are_flagged_against_baseline(self):
+        baseline = {'results': [
+            {'server': 'wsgi', 'endpoint': 'services.list', 'p95Ms': 10, 'rps': 100},
+            {'server': 'wsgi', 'endpoint': 'purchases.list', 'p95Ms': 10, 'rps': 100},
+        ]}
+        results = [
+            {'server': 'wsgi', 'endpoint': 'services.list', 'p95Ms': 11, 'rps': 95},
+            {'server': 'wsgi', 'endpoint': 'purchases.list', 'p95Ms': 15, 'rps': 100},
+            {'server': 'asgi', 'endpoint': 'purchases.list', 'p95Ms': 50, 'rps': 10},
+        ]
+        regressions = benchmark.compare(results, baseline, threshold=20)
+        self.assertEqual([(row['server'], row['endpoint'], row['p95Change'])
+                          for row in regressions], [('wsgi', 'purchases.list', 50.0)])
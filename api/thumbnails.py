@@ -0,0 +1,164 @@
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from . import catalog
+from .models import News, ProductType, Product, ServiceGroup, Service, Employee
+
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# МИНИАТЮРЫ
+# ============================================
+
+# Миниатюры строятся после коммита в фоновом потоке, а не в запросе
+# загрузки. Имя файла содержит хэш содержимого оригинала, поэтому
+# миниатюры можно отдавать с вечным кэшированием: новая картинка получит
+# новые имена. Пока миниатюр нет, поле пустое и клиент берёт оригинал.
+
+IMAGE_FIELDS = {
+    News: 'image',
+    ProductType: 'image',
+    Product: 'photo',
+    ServiceGroup: 'image',
+    Service: 'image',
+    Employee: 'photo',
+}
+
+executor = None
+
+
+def thumbnails_field(model):
+    return IMAGE_FIELDS[model] + 'Thumbnails'
+
+
+def thumbnail_name(name, digest, size, extension):
+    stem = os.path.splitext(name)[0]
+    return 'thumbs/%s.%s.%s.%s' % (stem, digest, size, extension)
+
+
+def encode(image, image_format):
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        image.save(output, 'JPEG', quality=settings.THUMBNAIL_QUALITY,
+                   optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        image.save(output, 'WEBP', quality=settings.THUMBNAIL_QUALITY, method=4)
+    else:
+        image.save(output, image_format, optimize=True)
+    return output.getvalue()
+
+
+def render(name):
+    """
+    Строит миниатюры всех размеров и возвращает {размер: {формат: имя}}.
+    Файлы с тем же хэшем уже лежат в хранилище и не пересобираются.
+    """
+    with default_storage.open(name) as source:
+        content = source.read()
+    digest = hashlib.sha1(content).hexdigest()[:12]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+    # прозрачность JPEG не умеет, такие картинки уходят в PNG
+    transparent = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if transparent else 'RGB')
+    formats = {'png': 'PNG'} if transparent else {'jpeg': 'JPEG'}
+    formats['webp'] = 'WEBP'
+
+    manifest = {}
+    for size, max_side in settings.THUMBNAIL_SIZES.items():
+        thumbnail = None
+        manifest[size] = {}
+        for extension, image_format in formats.items():
+            thumbnail_path = thumbnail_name(name, digest, size, extension)
+            if not default_storage.exists(thumbnail_path):
+                if thumbnail is None:
+                    thumbnail = image.copy()
+                    thumbnail.thumbnail((max_side, max_side), Image.LANCZOS)
+                default_storage.save(thumbnail_path,
+                                     ContentFile(encode(thumbnail, image_format)))
+            manifest[size][extension] = thumbnail_path
+    return manifest
+
+
+def generate(model, pk, name):
+    """
+    Строит миниатюры и записывает их в объект, если картинка за это время
+    не сменилась. UPDATE не вызывает сигналов, поэтому кэш каталога
+    сбрасывается здесь.
+    """
+    try:
+        manifest = render(name)
+    except Exception:
+        logger.exception('Не удалось построить миниатюры для %s', name)
+        return None
+    updated = model.objects.filter(pk=pk, **{IMAGE_FIELDS[model]: name}) \
+        .update(**{thumbnails_field(model): manifest})
+    if updated:
+        catalog.bump_version(model)
+    else:
+        delete_files(manifest)
+    return manifest
+
+
+def run_in_background(model, pk, name):
+    close_old_connections()
+    try:
+        generate(model, pk, name)
+    finally:
+        close_old_connections()
+
+
+def schedule(model, pk, name):
+    def submit():
+        global executor
+        if not settings.THUMBNAIL_ASYNC:
+            generate(model, pk, name)
+            return
+        if executor is None:
+            executor = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS,
+                                          thread_name_prefix='thumbnails')
+        executor.submit(run_in_background, model, pk, name)
+
+    transaction.on_commit(submit)
+
+
+def delete_files(manifest):
+    for names in (manifest or {}).values():
+        for name in names.values():
+            default_storage.delete(name)
+
+
+def delete_on_commit(manifest):
+    if manifest:
+        transaction.on_commit(lambda: delete_files(manifest))
+
+
+class ThumbnailsField(serializers.Field):
+    """
+    {размер: {формат: url}} по именам из поля миниатюр.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, manifest):
+        request = self.context.get('request')
+        result = {}
+        for size, names in (manifest or {}).items():
+            result[size] = {}
+            for extension, name in names.items():
+                url = default_storage.url(name)
+                result[size][extension] = request.build_absolute_uri(url) if request else url
+        return result
@@ -2,7 +2,11 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import NewsViewSet, EmployeeViewSet, \
     ClientViewSet, AppointmentViewSet, PurchaseViewSet, ProductViewSet, \
-    ProductTypeViewSet, ServiceGroupViewSet, ServiceViewSet
+    ProductTypeViewSet, ServiceGroupViewSet, ServiceViewSet, AvailabilityViewSet, PromoCodeViewSet, \
+    RevenueReportViewSet, SearchViewSet
+from . import async_views
+from .events import EventStreamView, EventTicketView
+from .metrics import MetricsView, MetricsSummaryView
 
 router = DefaultRouter()
 
@@ -16,9 +20,29 @@ router.register(r'product-types', ProductTypeViewSet, basename='product-types')
 router.register(r'service-groups', ServiceGroupViewSet,
                 basename='service-groups')
 router.register(r'services', ServiceViewSet, basename='services')
+router.register(r'availability', AvailabilityViewSet, basename='availability')
+router.register(r'promo-codes', PromoCodeViewSet, basename='promo-codes')
+router.register(r'search', SearchViewSet, basename='search')
+router.register(r'reports/revenue', RevenueReportViewSet, basename='revenue-report')
+
+# асинхронные копии публичных точек чтения для запуска под ASGI
+async_urlpatterns = [
+    path("news/", async_views.news_list, name='async-news-list'),
+    path("news/<int:pk>/", async_views.news_detail, name='async-news-detail'),
+    path("products/", async_views.product_list, name='async-products-list'),
+    path("products/<int:pk>/", async_views.product_detail, name='async-products-detail'),
+    path("services/", async_views.service_list, name='async-services-list'),
+    path("services/<int:pk>/", async_views.service_detail, name='async-services-detail'),
+    path("availability/", async_views.availability, name='async-availability-list'),
+]
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("async/", include(async_urlpatterns)),
+    path("events/", EventStreamView.as_view(), name='events-stream'),
+    path("events/ticket/", EventTicketView.as_view(), name='events-ticket'),
+    path("metrics/", MetricsView.as_view(), name='metrics'),
+    path("metrics/summary/", MetricsSummaryView.as_view(), name='metrics-summary'),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
     path("rest-auth/", include('rest_framework.urls')),
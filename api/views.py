@@ -10,7 +10,14 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 
 from .utils import get_and_authenticate_user, create_user_account
-from .serializers import EmptySerializer, ServiceGroupSerializer, ServiceGroupShortSerializer, ServiceSerializer, ServiceShortSerializer, WorkPositionSerializer, WorkPositionShortSerializer, UserSerializer, UserShortSerializer, UserCreateSerializer, NewsSerializer, NewsShortSerializer, DiscountSerializer, ProductTypeSerializer, ProductTypeShortSerializer, ProductSerializer, ProductShortSerializer, EmployeeSerializer, EmployeeShortSerializer, EmployeeChangeStatusSerializer, ClientSerializer, ClientShortSerializer, AppointmentSerializer, AppointmentChangeStatusSerializer, AppointmentListSerializer, PurchaseSerializer
+from .queryplan import QueryPlannerMixin, get_query_plan
+from .pagination import CreatedAtCursorPagination
+from .availability import get_available_employees, get_free_slots
+from .booking import get_duration
+from .catalog import CatalogCacheMixin
+from .reports import get_totals, get_series
+from . import search
+from .serializers import EmptySerializer, ServiceGroupSerializer, ServiceGroupShortSerializer, ServiceSerializer, ServiceShortSerializer, WorkPositionSerializer, WorkPositionShortSerializer, UserSerializer, UserShortSerializer, UserCreateSerializer, NewsSerializer, NewsShortSerializer, DiscountSerializer, ProductTypeSerializer, ProductTypeShortSerializer, ProductSerializer, ProductShortSerializer, EmployeeSerializer, EmployeeShortSerializer, EmployeeChangeStatusSerializer, ClientSerializer, ClientShortSerializer, AppointmentSerializer, AppointmentChangeStatusSerializer, AppointmentListSerializer, PurchaseSerializer, PurchaseListSerializer, AvailabilityQuerySerializer, EmployeeAvailabilitySerializer, PromoCodeSerializer, RevenueReportQuerySerializer, RevenueRowSerializer, SearchQuerySerializer, SearchHitSerializer
 
 from .models import News, Discount, ProductType, Product, User, ServiceGroup, WorkPosition, Service, Employee, Client, Appointment, Purchase
 
@@ -21,8 +28,10 @@ User = get_user_model()
 # ============================================
 
 
-class NewsViewSet(viewsets.ModelViewSet):
+class NewsViewSet(CatalogCacheMixin, QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = News.objects.all().filter(status__in=['published', ],)
+    cache_models = (News,)
+    pagination_class = CreatedAtCursorPagination
 
     def get_permissions(self):
         if self.action == 'list' or self.action == 'retrieve':
@@ -49,7 +58,7 @@ class NewsViewSet(viewsets.ModelViewSet):
             'NotAllowed': 'Удаление новости доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
 
-    def update(self, request, pk=None):
+    def update(self, request, pk=None, partial=False):
         content = {
             'NotAllowed': 'Изменение новости доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -60,11 +69,11 @@ class NewsViewSet(viewsets.ModelViewSet):
 # ============================================
 
 
-class EmployeeViewSet(viewsets.ModelViewSet):
+class EmployeeViewSet(QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = Employee.objects.all()
 
     def get_permissions(self):
-        if self.action == 'retrieve' or self.action == 'update':
+        if self.action in ('retrieve', 'update', 'partial_update'):
             permission_classes = [IsAuthenticated]
         else:
             permission_classes = [IsAdminUser]
@@ -75,7 +84,7 @@ class EmployeeViewSet(viewsets.ModelViewSet):
             return EmployeeShortSerializer
         elif self.action == 'retrieve':
             return EmployeeSerializer
-        elif self.action == 'update':
+        elif self.action in ('update', 'partial_update'):
             return EmployeeChangeStatusSerializer
         else:
             return EmptySerializer
@@ -95,7 +104,7 @@ class EmployeeViewSet(viewsets.ModelViewSet):
 # КЛИЕНТЫ
 # ============================================
 
-class ClientViewSet(viewsets.ModelViewSet):
+class ClientViewSet(QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = Client.objects.all()
 
     def get_permissions(self):
@@ -127,13 +136,19 @@ class ClientViewSet(viewsets.ModelViewSet):
             'NotAllowed': 'Удаление клиента доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def update(self, request, pk=None, partial=False):
+        content = {
+            'NotAllowed': 'Изменение клиента доступно только в админ панели'}
+        return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
+
 # ============================================
 # ЗАПИСИ
 # ============================================
 
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
+    pagination_class = CreatedAtCursorPagination
 
     def get_serializer_class(self):
         if self.action == 'list' or self.action == 'retrieve':
@@ -156,15 +171,53 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+# ============================================
+# СВОБОДНОЕ ВРЕМЯ
+# ============================================
+
+
+class AvailabilityViewSet(viewsets.ViewSet):
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        query = AvailabilityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        employees = get_available_employees(
+            query.validated_data['serviceGroup'])
+        service = query.validated_data.get('service')
+        availability = get_free_slots(
+            employees, query.validated_data['dateFrom'], query.validated_data['dateTo'],
+            length=get_duration([service]) if service else None)
+        return Response(EmployeeAvailabilitySerializer(availability, many=True).data)
+
+
+# ============================================
+# ПРОМОКОДЫ
+# ============================================
+
+
+class PromoCodeViewSet(viewsets.ViewSet):
+    permission_classes = [AllowAny]
+
+    @action(detail=False, methods=['post'])
+    def validate(self, request):
+        serializer = PromoCodeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(DiscountSerializer(serializer.validated_data['promoCode']).data)
+
+
 # ============================================
 # ПОКУПКИ
 # ============================================
 
 
-class PurchaseViewSet(viewsets.ModelViewSet):
+class PurchaseViewSet(QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = Purchase.objects.all()
+    pagination_class = CreatedAtCursorPagination
 
     def get_serializer_class(self):
+        if self.action == 'list':
+            return PurchaseListSerializer
         return PurchaseSerializer
 
     def get_permissions(self):
@@ -174,6 +227,20 @@ class PurchaseViewSet(viewsets.ModelViewSet):
             permission_classes = [IsAdminUser]
         return [permission() for permission in permission_classes]
 
+    def list(self, request):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        # без items в ?fields= позиции не загружены и товары не нужны
+        if 'items' in serializer.child.fields:
+            # товар, купленный в нескольких покупках страницы, отдаётся один раз
+            product_ids = {item.product_id for purchase in page for item in purchase.items.all()}
+            products = get_query_plan(ProductShortSerializer, Product).apply(
+                Product.objects.filter(pk__in=product_ids))
+            response.data['products'] = {product['id']: product for product in ProductShortSerializer(
+                products, many=True, context=self.get_serializer_context()).data}
+        return response
+
     def create(self, request, pk=None):
         content = {
             'NotAllowed': 'Создание покупки доступно только в админ панели'}
@@ -189,8 +256,9 @@ class PurchaseViewSet(viewsets.ModelViewSet):
 # ============================================
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CatalogCacheMixin, QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
+    cache_models = (Product, ProductType)
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -217,13 +285,19 @@ class ProductViewSet(viewsets.ModelViewSet):
             'NotAllowed': 'Удаление товара доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def update(self, request, pk=None, partial=False):
+        content = {
+            'NotAllowed': 'Изменение товара доступно только в админ панели'}
+        return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
+
 # ============================================
 # ТИПЫ ТОВАРОВ
 # ============================================
 
 
-class ProductTypeViewSet(viewsets.ModelViewSet):
+class ProductTypeViewSet(CatalogCacheMixin, QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = ProductType.objects.all()
+    cache_models = (ProductType,)
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -250,14 +324,20 @@ class ProductTypeViewSet(viewsets.ModelViewSet):
             'NotAllowed': 'Удаление типа товара доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def update(self, request, pk=None, partial=False):
+        content = {
+            'NotAllowed': 'Изменение типа товара доступно только в админ панели'}
+        return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
+
 
 # ============================================
 # ГРУППА УСЛУГ
 # ============================================
 
 
-class ServiceGroupViewSet(viewsets.ModelViewSet):
+class ServiceGroupViewSet(CatalogCacheMixin, QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = ServiceGroup.objects.all()
+    cache_models = (ServiceGroup,)
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -284,13 +364,19 @@ class ServiceGroupViewSet(viewsets.ModelViewSet):
             'NotAllowed': 'Удаление группы услуг доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    def update(self, request, pk=None, partial=False):
+        content = {
+            'NotAllowed': 'Изменение группы услуг доступно только в админ панели'}
+        return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
+
 # ============================================
 # УСЛУГИ
 # ============================================
 
 
-class ServiceViewSet(viewsets.ModelViewSet):
+class ServiceViewSet(CatalogCacheMixin, QueryPlannerMixin, viewsets.ModelViewSet):
     queryset = Service.objects.all()
+    cache_models = (Service, ServiceGroup)
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -316,3 +402,64 @@ class ServiceViewSet(viewsets.ModelViewSet):
         content = {
             'NotAllowed': 'Удаление услуги доступно только в админ панели'}
         return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def update(self, request, pk=None, partial=False):
+        content = {
+            'NotAllowed': 'Изменение услуги доступно только в админ панели'}
+        return Response(content, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+# ============================================
+# ПОИСК
+# ============================================
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Поиск по услугам, товарам и опубликованным новостям с ранжированием:
+    совпадение в названии весит больше, чем в описании.
+    """
+    permission_classes = [AllowAny]
+    querysets = {
+        Service: Service.objects.all(),
+        Product: Product.objects.all(),
+        News: News.objects.filter(status=News.PUBLISHED),
+    }
+
+    def list(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        hits = search.search(query.validated_data['q'], query.validated_data.get('type'),
+                             limit=query.validated_data['limit'])
+        ids = {}
+        for model, pk, _ in hits:
+            ids.setdefault(model, []).append(pk)
+        objects = {model: self.querysets[model].in_bulk(pks) for model, pks in ids.items()}
+        results = [{'type': search.MODEL_SOURCES[model].kind, 'score': score,
+                    'object': objects[model][pk]}
+                   for model, pk, score in hits if pk in objects[model]]
+        return Response(SearchHitSerializer(results, many=True,
+                                            context={'request': request}).data)
+
+
+# ============================================
+# ОТЧЁТЫ
+# ============================================
+
+
+class RevenueReportViewSet(viewsets.ViewSet):
+    """
+    Выручка и доля сотрудников за период по сводкам: без period — итоги по
+    объектам за весь диапазон, с period=day|month — ряд по периодам.
+    """
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        query = RevenueReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        data = query.validated_data
+        if 'period' in data:
+            rows = get_series(data['dimension'], data['period'], data['dateFrom'], data['dateTo'])
+        else:
+            rows = get_totals(data['dimension'], data['dateFrom'], data['dateTo'])
+        return Response(RevenueRowSerializer(rows, many=True).data)
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# поток событий импортируется только после настройки Django
+from api.events import EventStreamRouter  # noqa: E402
+
+application = EventStreamRouter(django_application)
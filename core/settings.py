@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 import os
+from datetime import date
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +88,61 @@ DATABASES = {
 }
 
 
+# Cache
+# CATALOG_CACHE selects the backend for public catalog responses:
+# locmem (default), file, or redis (django-redis, server at REDIS_URL)
+
+CATALOG_CACHE = os.environ.get('CATALOG_CACHE', 'locmem')
+
+CATALOG_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'catalog'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': CATALOG_CACHE_BACKENDS[CATALOG_CACHE],
+}
+
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60 * 10
+
+# verified tokens and Basic credentials; with several workers use a shared
+# backend, otherwise a revoked token lives in other processes until timeout
+AUTH_CACHE_ALIAS = 'default'
+AUTH_CACHE_TIMEOUT = 60 * 5
+
+# prices used for server-side totals, cached per service/product id; with
+# several workers use a shared backend, otherwise a price change reaches
+# other processes only after the timeout
+PRICE_CACHE_ALIAS = 'default'
+PRICE_CACHE_TIMEOUT = 60
+
+# version of the in-process promo code table; with several workers use a
+# shared backend, otherwise other processes reread promo codes only after
+# the timeout
+PROMO_CODES_CACHE_ALIAS = 'default'
+PROMO_CODES_TIMEOUT = 60
+
+# User.last_login is written at most once per interval per user and flushed
+# in one UPDATE per batch
+LAST_LOGIN_INTERVAL = 60 * 5
+LAST_LOGIN_FLUSH_SECONDS = 60
+LAST_LOGIN_BATCH_SIZE = 500
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -121,12 +178,13 @@ USE_TZ = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedBasicAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.IdCursorPagination',
 }
 
 DJOSER = {
@@ -139,6 +197,68 @@ DJOSER = {
     }
 }
 
+# Booking
+
+BOOKING_OPENING_HOUR = 10
+BOOKING_CLOSING_HOUR = 20
+BOOKING_SLOT_MINUTES = 60
+BOOKING_MAX_RANGE_DAYS = 31
+# first day of the 2/2 and 3/3 shift cycles
+BOOKING_SHIFT_CYCLE_START = date(2021, 1, 4)
+
+# Import
+
+# rows written per bulk_create/bulk_update statement during bulk imports
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 2000))
+
+# Server-sent events
+
+EVENTS_BUFFER_SIZE = 1000
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_RETRY_MS = 3000
+# lifetime of a stream ticket; EventSource cannot send headers, so the stream
+# is opened with ?ticket= instead of the API token
+EVENTS_TICKET_SECONDS = 60
+
+# Search
+
+# dotted path to a search backend class; by default chosen by database vendor
+SEARCH_BACKEND = None
+SEARCH_MAX_RESULTS = 50
+SEARCH_BATCH_SIZE = 2000
+
+# Thumbnails
+
+# longest side in pixels per size; every size is stored as WebP plus JPEG (PNG for transparency)
+THUMBNAIL_SIZES = {'small': 160, 'medium': 480, 'large': 1024}
+THUMBNAIL_QUALITY = 80
+# build thumbnails in a background thread pool after commit instead of inline
+THUMBNAIL_ASYNC = True
+THUMBNAIL_WORKERS = 2
+
+# Metrics
+
+METRICS_ENABLED = True
+# histogram bounds in seconds for api_request_duration_seconds
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# requests per endpoint kept for the rolling percentile summary
+METRICS_WINDOW = 1000
+# requests slower than this are logged with their SQL
+METRICS_SLOW_REQUEST_MS = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 500))
+METRICS_SLOW_SQL_LIMIT = 50
+
+# Benchmarks
+
+# where benchmark_api writes its JSON results
+BENCHMARK_DIR = os.path.join(BASE_DIR, 'benchmarks')
+# p95 growth or throughput drop, in percent, reported as a regression against --baseline
+BENCHMARK_THRESHOLD = 20
+
+# Reports
+
+# longest range served as a per-day series; totals and monthly series are unbounded
+REPORT_MAX_DAYS = 366
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.1/howto/static-files/